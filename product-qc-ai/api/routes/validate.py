@@ -1 +1,242 @@
 # FastAPI route for validation endpoint
+"""
+POST /validate: validate one product from the catalog editor.
+
+Concurrent requests are micro-batched: a single consumer task drains the
+queue and runs one vectorized embedding, spec-agreement scoring and
+rule-check pass (the same scorer as `pipeline.consistency` and the same
+cascade as `pipeline.validation`) per batch. The embedder, vector index,
+spec store and verdict caches are loaded once at startup; recent verdicts sit
+in a bounded LRU keyed by product id and content hash.
+"""
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from fastapi import APIRouter, Request
+from pydantic import BaseModel
+
+from pipeline.cache import KVCache, LRUCache, canonical_text, content_hash
+from pipeline.consistency import SpecAgreement, score_block
+from pipeline.embeddings import get_embedder
+from pipeline.preprocessing import SpecStore, flatten_specs
+from pipeline.validation import LocalJudge, SchedulerJudge, validate_batch
+
+router = APIRouter()
+
+CONTENT_FIELDS = ("title", "brand", "category", "description", "specs")
+
+class Product(BaseModel):
+    product_id: str
+    title: str | None = None
+    brand: str | None = None
+    category: str | None = None
+    description: str | None = None
+    specs: str | dict | None = None
+
+def product_key(product):
+    # The id is part of the key: the `similar` list leaves the product itself out.
+    return content_hash(product.get("product_id") or "", *(product.get(f) or "" for f in CONTENT_FIELDS))
+
+def _spec_json(specs):
+    # JSON object text for flatten_specs; free-text specs carry no attributes to check.
+    try:
+        return specs if isinstance(json.loads(specs), dict) else "{}"
+    except (TypeError, ValueError):
+        return "{}"
+
+# --- SERVICE ---
+class ValidationService:
+    """Warm state for validating batches of products in one pass."""
+
+    def __init__(self, cfg):
+        app_cfg, api_cfg = cfg["app"], cfg.get("api", {})
+        self.similarity_threshold = app_cfg["similarity_threshold"]
+        self.high_severity_threshold = app_cfg["high_severity_threshold"]
+        self.fail_threshold = cfg.get("validation", {}).get("embedding_fail_threshold")
+        self.topk = app_cfg.get("topk_similar", 5)
+        self.nprobe = cfg.get("vector_index", {}).get("nprobe", 8)
+        self.embedder = get_embedder(cfg.get("embeddings", {}))
+        self.cache = KVCache(cfg.get("validation", {}).get("cache_path", "data/processed/cache/validation.sqlite"))
+        self.judge = self._judge(cfg, api_cfg.get("judge", "local"))
+        # Known values per (category, attribute); without the store no product is spec-scored.
+        spec_path = cfg.get("preprocessing", {}).get("output", "data/processed/spec_attributes")
+        self.agreement = SpecAgreement(SpecStore(spec_path)) if os.path.exists(os.path.join(spec_path, "index.json")) else None
+        self.index = None
+        index_dir = os.path.join(cfg.get("vector_index", {}).get("dir", "data/processed/vector_index"), "text")
+        if os.path.exists(os.path.join(index_dir, "meta.json")):
+            from pipeline.vector_index import IVFIndex
+
+            index = IVFIndex.load(index_dir)
+            if index.meta["dim"] == self.embedder.dim:
+                self.index = index
+        self.stats = {"batches": 0, "products": 0}
+
+    @staticmethod
+    def _judge(cfg, kind):
+        if kind == "local":
+            return LocalJudge()
+        from google.cloud import bigquery
+
+        from pipeline.llm import BigQueryEndpoint, scheduler_from_config
+
+        client = bigquery.Client(project=cfg["project_id"])
+        return SchedulerJudge(scheduler_from_config(BigQueryEndpoint(client), cfg), cfg.get("llm", {}).get("pack_size", 10))
+
+    def _embed(self, texts):
+        # One embedder call for every present text in the batch; NaN rows where a field is missing.
+        present = [i for i, t in enumerate(texts) if t]
+        out = np.full((len(texts), self.embedder.dim), np.nan, dtype=np.float32)
+        if present:
+            out[present] = self.embedder.embed([canonical_text(texts[i]) for i in present])
+        return out
+
+    def process(self, products):
+        """Verdicts for a list of product dicts, in order."""
+        df = pd.DataFrame(products, columns=["product_id", *CONTENT_FIELDS])
+        df["specs"] = [s if s is None or isinstance(s, str) else json.dumps(s, sort_keys=True) for s in df["specs"]]
+        text = self._embed([d or t for d, t in zip(df["description"], df["title"])])
+        # Row positions as ids, so two drafts of one product in a batch keep their own scores.
+        rows = df.assign(product_id=[str(i) for i in range(len(df))])
+        ids = rows["product_id"].tolist()
+        agreement = np.full(len(ids), np.nan, dtype=np.float32)
+        if self.agreement is not None:
+            attributes = flatten_specs(pa.table({
+                "product_id": ids,
+                "category": pa.array(df["category"].tolist(), pa.string()),
+                "specs": [_spec_json(s) for s in df["specs"]],
+            }))
+            if attributes is not None:
+                texts = [" ".join(t for t in (title, description) if t) for title, description in zip(df["title"], df["description"])]
+                agreement = self.agreement.score(ids, texts, attributes)
+        columns = score_block(ids, {}, self.similarity_threshold, self.high_severity_threshold, agreement)
+        score, severity = columns["mismatch_score"], columns["severity"]
+        results, _ = validate_batch(
+            rows, dict(zip(ids, score)), self.judge, self.cache,
+            self.similarity_threshold, self.high_severity_threshold, self.fail_threshold,
+        )
+        similar = [[] for _ in products]
+        if self.index is not None:
+            has_text = ~np.isnan(text).any(axis=1)
+            if has_text.any():
+                ids, scores = self.index.search(text[has_text], self.topk + 1, self.nprobe)
+                for i, row_ids, row_scores in zip(np.nonzero(has_text)[0], ids, scores):
+                    pairs = [{"product_id": p, "score": float(s)} for p, s in zip(row_ids, row_scores) if p != products[i]["product_id"]]
+                    similar[i] = pairs[:self.topk]
+        self.stats["batches"] += 1
+        self.stats["products"] += len(products)
+        out = []
+        for i, r in enumerate(results.itertuples(index=False)):
+            out.append({
+                "is_consistent": None if pd.isna(r.is_consistent) else bool(r.is_consistent),
+                "tier": r.tier,
+                "mismatch_score": None if np.isnan(score[i]) else float(score[i]),
+                "severity": severity[i],
+                "reasons": None if pd.isna(r.reasons) else r.reasons,
+                "similar": similar[i],
+            })
+        return out
+
+# --- MICRO-BATCHING ---
+class MicroBatcher:
+    """Collects concurrent submissions into batches of up to `max_batch` items.
+
+    A single consumer waits at most `max_wait_ms` after the first item, then
+    runs `process(items)` off the event loop; requests that arrive meanwhile
+    form the next batch. `max_batch=1` disables batching.
+    """
+
+    def __init__(self, process, max_batch=256, max_wait_ms=2.0):
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                results = await asyncio.to_thread(self.process, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+async def startup(app, cfg, batching=True):
+    api_cfg = cfg.get("api", {})
+    service = ValidationService(cfg)
+    batcher = MicroBatcher(service.process, api_cfg.get("max_batch", 256) if batching else 1, api_cfg.get("max_wait_ms", 2.0))
+    await batcher.start()
+    app.state.service = service
+    app.state.batcher = batcher
+    app.state.verdicts = LRUCache(api_cfg.get("lru_size", 100_000))
+
+async def shutdown(app):
+    await app.state.batcher.stop()
+
+# --- ROUTES ---
+@router.post("/validate")
+async def validate(product: Product, request: Request):
+    state = request.app.state
+    item = product.model_dump()
+    key = product_key(item)
+    verdict = state.verdicts.get(key)
+    cached = verdict is not None
+    if not cached:
+        verdict = await state.batcher.submit(item)
+        state.verdicts.put(key, verdict)
+    return {"product_id": product.product_id, **verdict, "cached": cached}
+
+@router.get("/validate/stats")
+async def stats(request: Request):
+    state = request.app.state
+    service = state.service
+    return {
+        **service.stats,
+        "mean_batch_size": service.stats["products"] / service.stats["batches"] if service.stats["batches"] else 0.0,
+        "lru_size": len(state.verdicts),
+        "lru_hits": state.verdicts.hits,
+        "lru_misses": state.verdicts.misses,
+    }
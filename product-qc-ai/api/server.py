@@ -1 +1,33 @@
 # FastAPI wrapper around validation pipeline
+"""
+Serve with `uvicorn api.server:app` from the project root. The config path
+comes from PRODUCT_QC_CONFIG (default config.yaml); models, index and caches
+load once when the app starts.
+"""
+import os
+import sys
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.routes import validate
+from pipeline.config import load_config
+
+def create_app(config_path="config.yaml", batching=True):
+    @asynccontextmanager
+    async def lifespan(app):
+        await validate.startup(app, load_config(config_path), batching)
+        yield
+        await validate.shutdown(app)
+
+    app = FastAPI(title="Product QC API", lifespan=lifespan)
+    app.include_router(validate.router)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+app = create_app(os.environ.get("PRODUCT_QC_CONFIG", "config.yaml"))
@@ -1 +1,32 @@
 # UI input components for Streamlit app
+import streamlit as st
+
+SORTABLE = {
+    "Mismatch score (worst first)": ("mismatch_score", True),
+    "Mismatch score (best first)": ("mismatch_score", False),
+    "Product id": ("product_id", False),
+    "Title": ("title", False),
+}
+
+def filter_controls(source, table="mismatches"):
+    """Sidebar filters as (filters, sort, page_size); option lists come from cached aggregates."""
+    st.sidebar.header("Filters")
+    severities = st.sidebar.multiselect("Severity", ["high", "medium"], default=["high", "medium"])
+    columns = source.columns(table)
+    categories = list(source.aggregate(table, "category")["category"]) if "category" in columns else []
+    chosen = st.sidebar.multiselect("Category", sorted(c for c in categories if c))
+    min_score = st.sidebar.slider("Min mismatch score", 0.0, 1.0, 0.0, 0.01)
+    search = st.sidebar.text_input("Title contains") if "title" in columns else ""
+    sortable = [label for label, (col, _) in SORTABLE.items() if col in columns]
+    sort = SORTABLE[st.sidebar.selectbox("Sort by", sortable)]
+    page_size = st.sidebar.select_slider("Rows per page", [25, 50, 100, 250], value=50)
+    filters = []
+    if severities:
+        filters.append(("severity", "in", severities))
+    if chosen:
+        filters.append(("category", "in", chosen))
+    if min_score > 0:
+        filters.append(("mismatch_score", ">=", min_score))
+    if search:
+        filters.append(("title", "contains", search))
+    return filters, sort, page_size
@@ -1 +1,25 @@
 # UI results components for Streamlit app
+import streamlit as st
+
+def render_kpis(source, filters, table="mismatches"):
+    total = source.count(table, filters)
+    high = source.count(table, [*filters, ("severity", "==", "high")])
+    corrections = source.count("corrections") if source.has("corrections") else 0
+    cols = st.columns(3)
+    cols[0].metric("Flagged products", f"{total:,}")
+    cols[1].metric("High severity", f"{high:,}")
+    cols[2].metric("Corrections", f"{corrections:,}")
+    return total
+
+def render_breakdown(source, filters, by="category", table="mismatches"):
+    if by not in source.columns(table):
+        return
+    st.subheader(f"Flagged by {by}")
+    st.bar_chart(source.aggregate(table, by, filters).set_index(by)["rows"])
+
+def render_page(source, table, filters, sort, page_size, total, key):
+    """One page of `table`; only that page is fetched from the backend."""
+    pages = max(1, -(-total // page_size))
+    page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+    rows = source.page(table, filters=filters, sort=sort, offset=(page - 1) * page_size, limit=page_size)
+    st.dataframe(rows, use_container_width=True, hide_index=True)
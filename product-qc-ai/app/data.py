@@ -0,0 +1,286 @@
+# Data layer for the Streamlit app
+"""
+Filtering, sorting, counting and aggregation are pushed down to the backend
+(BigQuery SQL, or Arrow scans over local Parquet), and rows come back one
+page at a time, so a rerun never pulls a whole table into pandas.
+
+`CachedSource` memoizes results under the latest `metrics_runs` timestamp:
+cached pages stay valid until a pipeline run records new metrics, and that
+timestamp itself is re-read at most once per TTL.
+
+Filters are (column, op, value) tuples with op one of
+"==", "in", ">=", "<=", "contains".
+"""
+import json
+import os
+import re
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from pipeline.cache import LRUCache
+
+OPS = ("==", "in", ">=", "<=", "contains")
+_IDENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def _check_filters(filters):
+    for column, op, _ in filters:
+        if op not in OPS:
+            raise ValueError(f"Unsupported filter op '{op}'. Choose one of {OPS}.")
+        if not _IDENT_RE.match(column):
+            raise ValueError(f"Invalid column name '{column}'.")
+
+# --- LOCAL PARQUET ---
+class ParquetSource:
+    """Arrow dataset scans over local Parquet files, one file (or directory) per table."""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self._datasets = {}
+
+    def _dataset(self, table):
+        if table not in self._datasets:
+            self._datasets[table] = ds.dataset(self.paths[table], format="parquet")
+        return self._datasets[table]
+
+    @staticmethod
+    def _expr(filters):
+        _check_filters(filters)
+        expr = None
+        for column, op, value in filters:
+            field = pc.field(column)
+            if op == "==":
+                term = field == value
+            elif op == "in":
+                term = field.isin(list(value))
+            elif op == ">=":
+                term = field >= value
+            elif op == "<=":
+                term = field <= value
+            else:
+                term = pc.match_substring(field, str(value), ignore_case=True)
+            expr = term if expr is None else expr & term
+        return expr
+
+    def has(self, table):
+        return table in self.paths and os.path.exists(self.paths[table])
+
+    def columns(self, table):
+        return self._dataset(table).schema.names
+
+    def sorted_by(self, table):
+        """(column, descending) the file is already ordered by, from its `sorted_by` schema metadata."""
+        meta = self._dataset(table).schema.metadata or {}
+        if b"sorted_by" not in meta:
+            return None
+        column, _, direction = meta[b"sorted_by"].decode().partition(":")
+        return column, direction == "desc"
+
+    def count(self, table, filters=()):
+        return self._dataset(table).count_rows(filter=self._expr(filters))
+
+    def page(self, table, columns=None, filters=(), sort=None, offset=0, limit=50):
+        """Rows [offset, offset + limit) of the filtered table as a DataFrame, sorted by (column, descending)."""
+        dataset = self._dataset(table)
+        columns = list(columns or dataset.schema.names)
+        expr = self._expr(filters)
+        if sort is None or tuple(sort) == self.sorted_by(table):
+            # File order is the requested order: stop reading as soon as the page is filled.
+            return self._head(table, columns, expr, offset + limit).slice(offset).to_pandas()
+        column, descending = sort
+        scanned = dataset.to_table(columns=list(dict.fromkeys(columns + [column])), filter=expr)
+        # Partial top-k instead of a full sort: only offset + limit rows are ordered.
+        keys = [(column, "descending" if descending else "ascending")]
+        top = pc.select_k_unstable(scanned, k=min(offset + limit, scanned.num_rows), sort_keys=keys)
+        rows = scanned.take(top).sort_by(keys).slice(offset, limit)
+        return rows.select(columns).to_pandas()
+
+    def _head(self, table, columns, expr, n):
+        path = self.paths[table]
+        if not os.path.isfile(path):
+            return self._dataset(table).scanner(columns=columns, filter=expr).head(n)
+        # ParquetFile streams batches page by page; the dataset scanner decodes whole row groups first.
+        pf = pq.ParquetFile(path)
+        parts, found = [], 0
+        for batch in pf.iter_batches(batch_size=max(n, 4096), columns=columns):
+            part = pa.Table.from_batches([batch])
+            part = part.filter(expr) if expr is not None else part
+            parts.append(part)
+            found += part.num_rows
+            if found >= n:
+                break
+        if not parts:
+            return pf.schema_arrow.empty_table().select(columns)
+        return pa.concat_tables(parts).slice(0, n)
+
+    def aggregate(self, table, by, filters=(), value="mismatch_score"):
+        """Row count and mean `value` per `by` group, largest groups first."""
+        dataset = self._dataset(table)
+        cols = [by] + ([value] if value in dataset.schema.names else [])
+        scanned = dataset.to_table(columns=cols, filter=self._expr(filters))
+        aggs = [(by, "count")] + ([(value, "mean")] if len(cols) > 1 else [])
+        out = scanned.group_by(by).aggregate(aggs)
+        names = {f"{by}_count": "rows", f"{value}_mean": f"mean_{value}"}
+        out = out.rename_columns([names.get(name, name) for name in out.column_names])
+        return out.sort_by([("rows", "descending")]).to_pandas()
+
+    def version(self):
+        """Latest metrics_runs timestamp (None when there is no metrics table)."""
+        if not self.has("metrics"):
+            return None
+        # Read fresh every time: a pipeline run may have rewritten the file.
+        run_ts = ds.dataset(self.paths["metrics"], format="parquet").to_table(columns=["run_ts"]).column("run_ts")
+        latest = pc.max(run_ts).as_py()
+        return latest.isoformat() if latest is not None else None
+
+# --- BIGQUERY ---
+class BigQuerySource:
+    """Same interface as ParquetSource, answered by parameterized SQL."""
+
+    def __init__(self, client, tables):
+        self.client = client
+        self.tables = tables
+
+    def _where(self, filters):
+        from google.cloud import bigquery
+
+        _check_filters(filters)
+        clauses, params = [], []
+        for i, (column, op, value) in enumerate(filters):
+            name = f"p{i}"
+            if op == "in":
+                values = list(value)
+                kind = "FLOAT64" if values and isinstance(values[0], float) else "STRING"
+                clauses.append(f"{column} IN UNNEST(@{name})")
+                params.append(bigquery.ArrayQueryParameter(name, kind, values))
+            elif op == "contains":
+                clauses.append(f"CONTAINS_SUBSTR({column}, @{name})")
+                params.append(bigquery.ScalarQueryParameter(name, "STRING", str(value)))
+            else:
+                kind = "FLOAT64" if isinstance(value, (int, float)) else "STRING"
+                clauses.append(f"{column} {'=' if op == '==' else op} @{name}")
+                params.append(bigquery.ScalarQueryParameter(name, kind, value))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _query(self, sql, params=()):
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(query_parameters=list(params))
+        return self.client.query(sql, job_config=job_config).result()
+
+    def has(self, table):
+        return table in self.tables
+
+    def columns(self, table):
+        return [f.name for f in self.client.get_table(self.tables[table]).schema]
+
+    def count(self, table, filters=()):
+        where, params = self._where(filters)
+        return next(iter(self._query(f"SELECT COUNT(*) AS n FROM `{self.tables[table]}`{where}", params))).n
+
+    def page(self, table, columns=None, filters=(), sort=None, offset=0, limit=50):
+        where, params = self._where(filters)
+        cols = ", ".join(columns) if columns else "*"
+        if columns and not all(_IDENT_RE.match(c) for c in columns):
+            raise ValueError(f"Invalid column list {columns}.")
+        order = ""
+        if sort is not None:
+            if not _IDENT_RE.match(sort[0]):
+                raise ValueError(f"Invalid sort column '{sort[0]}'.")
+            order = f" ORDER BY {sort[0]} {'DESC' if sort[1] else 'ASC'}"
+        sql = f"SELECT {cols} FROM `{self.tables[table]}`{where}{order} LIMIT {int(limit)} OFFSET {int(offset)}"
+        return self._query(sql, params).to_dataframe()
+
+    def aggregate(self, table, by, filters=(), value="mismatch_score"):
+        if not _IDENT_RE.match(by) or not _IDENT_RE.match(value):
+            raise ValueError(f"Invalid column '{by}' / '{value}'.")
+        where, params = self._where(filters)
+        sql = (
+            f"SELECT COUNT(*) AS n_rows, AVG({value}) AS mean_{value}, {by} FROM `{self.tables[table]}`{where} "
+            f"GROUP BY {by} ORDER BY n_rows DESC"
+        )
+        # ROWS is reserved in BigQuery; the charts expect the same `rows` column as ParquetSource.
+        return self._query(sql, params).to_dataframe().rename(columns={"n_rows": "rows"})
+
+    def version(self):
+        if "metrics" not in self.tables:
+            return None
+        row = next(iter(self._query(f"SELECT MAX(run_ts) AS run_ts FROM `{self.tables['metrics']}`")))
+        return row.run_ts.isoformat() if row.run_ts is not None else None
+
+# --- CACHING ---
+class CachedSource:
+    """Memoizes a source's results under its current version (latest metrics_runs entry)."""
+
+    def __init__(self, source, ttl=30.0, maxsize=256):
+        self.source = source
+        self.ttl = ttl
+        self._cache = LRUCache(maxsize)
+        self._lock = threading.Lock()  # Streamlit sessions share one source across threads
+        self._version = None
+        self._checked = None
+
+    def version(self):
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.ttl:
+            self._version = self.source.version()
+            self._checked = now
+        return self._version
+
+    def _cached(self, method, *args, **kwargs):
+        key = json.dumps([method, self.version(), args, kwargs], sort_keys=True, default=str)
+        with self._lock:
+            result = self._cache.get(key)
+        if result is None:
+            result = getattr(self.source, method)(*args, **kwargs)
+            with self._lock:
+                self._cache.put(key, result)
+        return result
+
+    def has(self, table):
+        return self.source.has(table)
+
+    def columns(self, table):
+        return self._cached("columns", table)
+
+    def count(self, table, filters=()):
+        return self._cached("count", table, [tuple(f) for f in filters])
+
+    def page(self, table, columns=None, filters=(), sort=None, offset=0, limit=50):
+        return self._cached("page", table, columns=columns, filters=[tuple(f) for f in filters], sort=sort, offset=offset, limit=limit)
+
+    def aggregate(self, table, by, filters=(), value="mismatch_score"):
+        return self._cached("aggregate", table, by, filters=[tuple(f) for f in filters], value=value)
+
+# --- SETUP ---
+def open_source(cfg):
+    """Backend for `app.data_source`: mock (generated Parquet), parquet (local pipeline outputs),
+    warehouse (the configured `warehouse.backend`) or bigquery."""
+    app_cfg = cfg.get("app", {})
+    kind = app_cfg.get("data_source", "mock")
+    if kind == "mock":
+        from app.mock_data import ensure_mock_data
+
+        source = ParquetSource(ensure_mock_data(app_cfg.get("mock_dir", "data/processed/mock"), app_cfg.get("mock_rows", 1_000_000)))
+    elif kind == "parquet":
+        source = ParquetSource(app_cfg.get("local_tables", {}))
+    elif kind == "warehouse":
+        from pipeline.warehouse import LocalWarehouse, open_warehouse
+
+        warehouse = open_warehouse(cfg)
+        tables = {name: warehouse.table_id(name) for name in ("mismatches", "corrections", "metrics")}
+        source = ParquetSource(tables) if isinstance(warehouse, LocalWarehouse) else BigQuerySource(warehouse.client, tables)
+    elif kind == "bigquery":
+        from google.cloud import bigquery
+
+        from pipeline.config import table_ref
+
+        client = bigquery.Client(project=cfg["project_id"])
+        source = BigQuerySource(client, {name: table_ref(cfg, name) for name in ("mismatches", "corrections", "metrics")})
+    else:
+        raise ValueError(f"Unknown app.data_source '{kind}'. Choose mock, parquet, warehouse or bigquery.")
+    return CachedSource(source, ttl=app_cfg.get("cache_ttl_s", 30))
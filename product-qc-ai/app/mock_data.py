@@ -1 +1,91 @@
 # Lightweight demo data (for offline run)
+"""
+Offline demo tables at realistic scale: flagged mismatches, corrections and
+a metrics_runs entry, generated with vectorized NumPy and written as Parquet
+so the app runs against the same Parquet backend as a local pipeline run.
+"""
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BRANDS = ["acme", "globex", "initech", "umbrella", "hooli", "stark", "wayne", "wonka", "tyrell", "cyberdyne"]
+CATEGORIES = [
+    "electronics>laptops", "electronics>monitors", "electronics>phones", "home>kitchen", "home>furniture",
+    "apparel>shirts", "apparel>shoes", "toys>games", "beauty>skincare", "sports>outdoor",
+]
+NOUNS = ["laptop", "monitor", "phone", "blender", "chair", "shirt", "sneaker", "puzzle", "serum", "tent"]
+FIELDS = ["title", "brand", "category", "specs.colour", "specs.screen_size", "specs.capacity"]
+MOCK_TABLES = ("mismatches", "corrections", "metrics")
+
+def mock_mismatches(n_rows, seed=0, scored_ts=None):
+    rng = np.random.default_rng(seed)
+    scored_ts = scored_ts or datetime.now(timezone.utc)
+    cos = rng.beta(2, 5, size=(n_rows, 3)).astype(np.float32)
+    min_cos = cos.min(axis=1)
+    score = 1 - min_cos
+    brand = rng.integers(0, len(BRANDS), n_rows)
+    category = rng.integers(0, len(CATEGORIES), n_rows)
+    ids = np.char.add("P", np.char.zfill(np.arange(n_rows).astype(str), 8))
+    titles = np.char.add(np.char.add(np.asarray(BRANDS)[brand], " "), np.asarray(NOUNS)[category])
+    return pa.table({
+        "product_id": ids,
+        "title": np.char.add(titles, np.char.add(" ", rng.integers(100, 999, n_rows).astype(str))),
+        "brand": pa.DictionaryArray.from_arrays(brand.astype(np.int32), BRANDS).dictionary_decode(),
+        "category": pa.DictionaryArray.from_arrays(category.astype(np.int32), CATEGORIES).dictionary_decode(),
+        "text_image_cos": cos[:, 0],
+        "spec_image_cos": cos[:, 1],
+        "spec_agreement": cos[:, 2],
+        "min_agreement": min_cos,
+        "mismatch_score": score,
+        # Every mock row is flagged: the app lists flagged products only.
+        "severity": np.where(score >= 0.85, "high", "medium"),
+        "scored_ts": pa.array(np.full(n_rows, np.datetime64(scored_ts.replace(tzinfo=None), "us")), pa.timestamp("us", tz="UTC")),
+    })
+
+def mock_corrections(mismatches, share=0.3, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    n = mismatches.num_rows
+    rows = np.sort(rng.choice(n, size=int(n * share), replace=False))
+    ids = mismatches.column("product_id").take(pa.array(rows))
+    field = rng.integers(0, len(FIELDS), len(rows))
+    return pa.table({
+        "product_id": ids,
+        "field": pa.DictionaryArray.from_arrays(field.astype(np.int32), FIELDS).dictionary_decode(),
+        "original_value": np.char.add("old-", rng.integers(0, 10_000, len(rows)).astype(str)),
+        "corrected_value": np.char.add("new-", rng.integers(0, 10_000, len(rows)).astype(str)),
+        "confidence": rng.uniform(0.5, 1.0, len(rows)).astype(np.float32),
+        "status": np.where(rng.random(len(rows)) < 0.7, "applied", "pending"),
+        "corrected_ts": mismatches.column("scored_ts").take(pa.array(rows)),
+    })
+
+def mock_metrics(run_id, run_ts, n_flagged):
+    return pa.table({
+        "run_id": [run_id],
+        "run_ts": pa.array([run_ts], pa.timestamp("us", tz="UTC")),
+        "stage": ["consistency"],
+        "metric": ["flagged_rows"],
+        "value": [float(n_flagged)],
+        "labels": ["{}"],
+    })
+
+def mock_paths(out_dir):
+    return {name: os.path.join(out_dir, f"{name}.parquet") for name in MOCK_TABLES}
+
+def ensure_mock_data(out_dir, n_rows=1_000_000, seed=0):
+    """Write the mock tables under `out_dir` unless they already exist; returns their paths."""
+    paths = mock_paths(out_dir)
+    if all(os.path.exists(p) for p in paths.values()):
+        return paths
+    os.makedirs(out_dir, exist_ok=True)
+    run_ts = datetime.now(timezone.utc)
+    mismatches = mock_mismatches(n_rows, seed, run_ts)
+    # Stored worst-first, so the default view (by mismatch_score, descending) reads only the first row groups.
+    mismatches = mismatches.sort_by([("mismatch_score", "descending")])
+    mismatches = mismatches.replace_schema_metadata({"sorted_by": "mismatch_score:desc"})
+    pq.write_table(mismatches, paths["mismatches"], row_group_size=131_072)
+    pq.write_table(mock_corrections(mismatches, seed=seed), paths["corrections"], row_group_size=131_072)
+    pq.write_table(mock_metrics(f"mock-{seed}", run_ts, n_rows), paths["metrics"])
+    return paths
@@ -1 +1,37 @@
 # Judge-facing demo app
+import os
+import sys
+
+import streamlit as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.components.inputs import filter_controls
+from app.components.results import render_breakdown, render_kpis, render_page
+from app.data import open_source
+from pipeline.config import load_config
+
+CONFIG_PATH = os.environ.get("PRODUCT_QC_CONFIG", "config.yaml")
+
+@st.cache_resource
+def get_source():
+    # One data source per process: caches survive reruns and are shared by sessions.
+    return open_source(load_config(CONFIG_PATH))
+
+def main():
+    st.set_page_config(page_title="Product QC", layout="wide")
+    st.title("Product Data QC")
+    source = get_source()
+    filters, sort, page_size = filter_controls(source)
+    st.caption(f"Data as of pipeline run {source.version() or 'n/a'}")
+    flagged, corrections = st.tabs(["Flagged products", "Corrections"])
+    with flagged:
+        total = render_kpis(source, filters)
+        render_breakdown(source, filters)
+        render_page(source, "mismatches", filters, sort, page_size, total, key="mismatches")
+    with corrections:
+        if not source.has("corrections"):
+            st.info("No corrections yet. Run `make correct`.")
+            return
+        render_page(source, "corrections", [], None, page_size, source.count("corrections"), key="corrections")
+
+main()
@@ -1,7 +1,8 @@
 import os
+import argparse
 import pandas as pd
 from google.cloud import bigquery
-import re
+from pipeline.ingestion import normalize_text, stream_csv_to_bigquery, DEFAULT_CHUNKSIZE
 
 # --- CONFIG ---
 PROJECT_ID = "proj-product-qc-gmumabigq"  # <-- Replace with your GCP project ID
@@ -15,8 +16,7 @@ def load_and_normalize(csv_path):
     # Normalize text fields
     for col in ["title", "description", "brand", "category"]:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.strip().str.lower()
-            df[col] = df[col].apply(lambda x: re.sub(r'<.*?>', '', x))  # Remove HTML tags
+            df[col] = normalize_text(df[col].astype(str))  # Lowercase, strip, remove HTML tags
     # Flatten common fields, put variable specs into 'specs' JSON
     common_fields = ["product_id", "sku", "brand", "category", "title", "description", "price", "rating", "review_count"]
     variable_fields = [col for col in df.columns if col not in common_fields]
@@ -43,6 +43,20 @@ def load_to_bigquery(df, table_id):
     job.result()
     print(f"Loaded {len(df)} rows to {table_id}.")
 
+# --- STREAMING LOAD (bounded memory) ---
+def stream_to_bigquery(csv_path, table_id, chunksize=DEFAULT_CHUNKSIZE):
+    client = bigquery.Client(project=PROJECT_ID)
+    stats = stream_csv_to_bigquery(client, csv_path, table_id, chunksize=chunksize)
+    print(f"Loaded {stats['rows']} rows to {table_id} in {stats['chunks']} chunks ({stats['seconds']:.1f}s).")
+
 if __name__ == "__main__":
-    df = load_and_normalize(CSV_PATH)
-    load_to_bigquery(df, TABLE_ID)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--stream", action="store_true", help="Read and load the CSV in bounded chunks")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+    if args.stream:
+        stream_to_bigquery(args.csv, TABLE_ID, args.chunksize)
+    else:
+        df = load_and_normalize(args.csv)
+        load_to_bigquery(df, TABLE_ID)
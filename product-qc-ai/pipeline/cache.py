@@ -0,0 +1,86 @@
+"""
+Content hashing shared by the caches in the pipeline.
+
+Cache keys are computed from normalized content, so strings that only differ
+in case or whitespace hit the same entry. `KVCache` persists small JSON values
+(verdicts, templates) between runs; `LRUCache` keeps hot values in memory
+for long-running services.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from collections import OrderedDict
+
+_WS_RE = re.compile(r"\s+")
+
+def canonical_text(text):
+    """Lowercase and collapse whitespace; the form that gets hashed and embedded."""
+    return _WS_RE.sub(" ", str(text)).strip().lower()
+
+def content_hash(*parts):
+    """Stable 128-bit hex digest of the canonical form of `parts`."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(canonical_text(part).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+class KVCache:
+    """Persistent key -> JSON value cache backed by a single SQLite file."""
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        out = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+            batch = keys[i:i + 500]
+            rows = self.conn.execute(f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(batch))})", batch)
+            out.update((key, json.loads(value)) for key, value in rows)
+        return out
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def put_many(self, items):
+        self.conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", ((k, json.dumps(v)) for k, v in items.items()))
+        self.conn.commit()
+
+class LRUCache:
+    """Bounded in-memory map that evicts the least recently used key."""
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
@@ -0,0 +1,13 @@
+"""
+Config loading shared by the pipeline stages (`python -m pipeline.<stage> --config config.yaml`).
+"""
+import yaml
+
+def load_config(path="config.yaml"):
+    with open(path, encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+def table_ref(cfg, key):
+    """Fully qualified BigQuery table id for a `bq_tables` entry."""
+    name = cfg.get("bq_tables", {}).get(key, key)
+    return f"{cfg['project_id']}.{cfg['bq_dataset']}.{name}"
@@ -0,0 +1,259 @@
+"""
+Cross-modal consistency scoring (description vs. image vs. specs).
+
+Streams the catalog in fixed-size blocks of products and scores each block
+in one vectorized pass:
+- cross-modal cosines between the local embedding stores, only for stores
+  written into the same named vector space (see `VectorStore.space`),
+- spec agreement: the product's parsed spec values (the `spec_attributes`
+  store of pipeline.preprocessing) checked against its title and description.
+
+The mismatch score is 1 - the lowest of these; a product with nothing
+comparable stays unscored (NULL). Severity comes from
+`app.similarity_threshold` / `app.high_severity_threshold` and every block is
+appended to the `mismatch_scores` output, so only one block is in memory at a
+time, whatever the catalog size.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from pipeline.config import load_config
+from pipeline.embeddings import VectorStore, tokenize
+from pipeline.metrics import open_tracer
+from pipeline.preprocessing import SpecStore, parse_values
+from pipeline.warehouse import open_warehouse, products_path
+
+DEFAULT_BLOCK_ROWS = 65536
+MODALITIES = ("text", "image", "spec")
+PAIRS = [("text", "image"), ("spec", "image")]
+# Attributes with more distinct values than this (model names, free text) are not checked.
+MAX_VOCAB_VALUES = 64
+
+MISMATCH_SCHEMA = pa.schema([
+    ("product_id", pa.string()),
+    ("text_image_cos", pa.float32()),
+    ("spec_image_cos", pa.float32()),
+    ("spec_agreement", pa.float32()),
+    ("min_agreement", pa.float32()),
+    ("mismatch_score", pa.float32()),
+    ("severity", pa.string()),
+    ("scored_ts", pa.timestamp("us", tz="UTC")),
+])
+
+# --- SCORING ---
+def assign_severity(mismatch_score, similarity_threshold, high_severity_threshold):
+    """'high', 'medium' or 'none' per row; scores are 1 - agreement, NaN means not scorable."""
+    score = np.asarray(mismatch_score, dtype=np.float32)
+    severity = np.full(score.shape, "none", dtype=object)
+    severity[score > 1 - similarity_threshold] = "medium"
+    severity[score >= high_severity_threshold] = "high"
+    return severity
+
+def _normalize(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+def _gather(store, ids):
+    # Rows of `store` for `ids` (NaN where a product has no vector), read in file order.
+    rows = np.fromiter((store.index.get(pid, -1) for pid in ids), dtype=np.int64, count=len(ids))
+    out = np.full((len(ids), store.dim), np.nan, dtype=np.float32)
+    present = rows >= 0
+    if present.any():
+        wanted = rows[present]
+        order = np.argsort(wanted)
+        block = np.empty((len(wanted), store.dim), dtype=np.float32)
+        block[order] = store.vectors[wanted[order]]
+        out[present] = _normalize(block)
+    return out
+
+def _value_tokens(value, numeric):
+    # Numbers only for numeric values: "1,400 w" is mentioned as "1400 watts" just as often.
+    # The number as written, not value_num, which is converted to the canonical unit.
+    tokens = tokenize(value.replace(",", ""))
+    return {t for t in tokens if t[0].isdigit()} if numeric else set(tokens)
+
+class SpecAgreement:
+    """Agreement between a product's title/description and its parsed spec values.
+
+    An attribute agrees when its value appears in the text and contradicts
+    when it does not but another known value of the same (category,
+    attribute) does; attributes the text never mentions are left out. The
+    score is the share of agreeing attributes, NaN when none was checked.
+    Known values come from `store` (a SpecStore); only attributes with
+    2..`max_values` distinct values are checked.
+    """
+
+    def __init__(self, store, max_values=MAX_VOCAB_VALUES):
+        self.store = store
+        self.max_values = max_values
+        self._vocab = {}
+
+    def vocabulary(self, category, attribute):
+        """({value: tokens}, all tokens) of a checkable (category, attribute), else None."""
+        key = (category, attribute)
+        if key not in self._vocab:
+            values = pc.unique(self.store.slice(category, attribute).column("value")).cast(pa.string()) if self.store else pa.array([], pa.string())
+            vocab = None
+            if 2 <= len(values) <= self.max_values:
+                _, value_num, _ = parse_values(values)
+                tokens = {v: _value_tokens(v, n is not None) for v, n in zip(values.to_pylist(), value_num.to_pylist())}
+                vocab = (tokens, set().union(*tokens.values()))
+            self._vocab[key] = vocab
+        return self._vocab[key]
+
+    def attributes(self, ids):
+        """Attribute rows of `ids` from the store (product_id, category, attribute, value)."""
+        table = self.store.table
+        return table.filter(pc.is_in(table.column("product_id"), value_set=pa.array(ids, pa.string())))
+
+    def score(self, ids, texts, attributes=None):
+        """Agreement per product of `ids`; `texts` are their titles and descriptions joined.
+
+        `attributes` defaults to the products' rows in the store; pass
+        `preprocessing.flatten_specs` output to score products not in it.
+        """
+        attributes = self.attributes(ids) if attributes is None else attributes
+        position = {pid: i for i, pid in enumerate(ids)}
+        words = [None] * len(ids)
+        agree = np.zeros(len(ids), dtype=np.float32)
+        checked = np.zeros(len(ids), dtype=np.float32)
+        columns = [attributes.column(c).cast(pa.string()).to_pylist() for c in ("product_id", "category", "attribute", "value")]
+        for pid, category, attribute, value in zip(*columns):
+            vocab = self.vocabulary(category or "", attribute)
+            i = position.get(pid)
+            if vocab is None or i is None or value not in vocab[0]:
+                continue
+            if words[i] is None:
+                words[i] = set(tokenize(texts[i] or ""))
+            own = vocab[0][value]
+            if own and own <= words[i]:
+                agree[i] += 1
+                checked[i] += 1
+            elif (words[i] & vocab[1]) - own:
+                checked[i] += 1  # the text names another value of this attribute
+        out = np.full(len(ids), np.nan, dtype=np.float32)
+        np.divide(agree, checked, out=out, where=checked > 0)
+        return out
+
+def score_block(ids, stores, similarity_threshold, high_severity_threshold, spec_agreement=None):
+    """Cross-modal cosines, spec agreement, mismatch score and severity for one block of product ids."""
+    vectors = {name: _gather(store, ids) for name, store in stores.items()}
+    columns = {"product_id": np.asarray(ids, dtype=object)}
+    scores = []
+    for a, b in PAIRS:
+        col = np.full(len(ids), np.nan, dtype=np.float32)
+        # Only comparable when both stores were written into the same named vector space;
+        # an equal dim alone says nothing about whether two models' axes line up.
+        if a in stores and b in stores and stores[a].space is not None and stores[a].space == stores[b].space:
+            col = np.einsum("ij,ij->i", vectors[a], vectors[b])
+        columns[f"{a}_{b}_cos"] = col
+        scores.append(col)
+    agreement = np.full(len(ids), np.nan, dtype=np.float32) if spec_agreement is None else spec_agreement
+    columns["spec_agreement"] = agreement
+    scores.append(agreement)
+    stacked = np.vstack(scores)
+    has_any = ~np.isnan(stacked).all(axis=0)
+    lowest = np.full(len(ids), np.nan, dtype=np.float32)
+    lowest[has_any] = np.nanmin(stacked[:, has_any], axis=0)
+    columns["min_agreement"] = lowest
+    columns["mismatch_score"] = 1 - lowest
+    columns["severity"] = assign_severity(columns["mismatch_score"], similarity_threshold, high_severity_threshold)
+    return columns
+
+def _open_stores(store_dir):
+    stores = {}
+    for name in MODALITIES:
+        path = os.path.join(store_dir, name)
+        if os.path.exists(os.path.join(path, "meta.json")):
+            stores[name] = VectorStore(path)
+    return stores
+
+def _catalog_blocks(catalog, stores, block_rows):
+    # (ids, texts) per block: from the catalog when given, else the ids of the text store.
+    if catalog is None:
+        if "text" not in stores:
+            raise FileNotFoundError("No catalog and no text embeddings to score. Run `make embed` first.")
+        ids = stores["text"].ids
+        for lo in range(0, len(ids), block_rows):
+            block = ids[lo:lo + block_rows]
+            yield block, [None] * len(block)
+        return
+    dataset = ds.dataset(catalog, format="parquet")
+    columns = [c for c in ("product_id", "title", "description") if c in dataset.schema.names]
+    for batch in dataset.to_batches(columns=columns, batch_size=block_rows):
+        ids = batch.column("product_id").cast(pa.string()).to_pylist()
+        parts = [pc.fill_null(batch.column(c).cast(pa.string()), "") for c in ("title", "description") if c in batch.schema.names]
+        texts = pc.binary_join_element_wise(*parts, " ").to_pylist() if parts else [None] * len(ids)
+        yield ids, texts
+
+def iter_scored_blocks(store_dir, similarity_threshold, high_severity_threshold, block_rows=DEFAULT_BLOCK_ROWS, catalog=None, spec_store=None):
+    """Yield Arrow record batches of mismatch scores, one per block of products.
+
+    `catalog` (a Parquet file or table directory) supplies the products and
+    their text; `spec_store` (a SpecStore) enables spec agreement.
+    """
+    stores = _open_stores(store_dir)
+    agreement = SpecAgreement(spec_store) if spec_store is not None else None
+    scored_ts = datetime.now(timezone.utc)
+    for ids, texts in _catalog_blocks(catalog, stores, block_rows):
+        spec = agreement.score(ids, texts) if agreement is not None and catalog is not None else None
+        columns = score_block(ids, stores, similarity_threshold, high_severity_threshold, spec)
+        columns["scored_ts"] = np.full(len(ids), np.datetime64(scored_ts.replace(tzinfo=None), "us"))
+        yield pa.record_batch([pa.array(columns[f.name], type=f.type, from_pandas=True) for f in MISMATCH_SCHEMA], schema=MISMATCH_SCHEMA)
+
+def write_mismatch_scores(store_dir, output, similarity_threshold, high_severity_threshold, block_rows=DEFAULT_BLOCK_ROWS, catalog=None, spec_store=None):
+    """Stream all blocks into one Parquet file; returns row counts per severity and of unscored rows."""
+    counts = {"none": 0, "medium": 0, "high": 0, "unscored": 0}
+    with pq.ParquetWriter(output, MISMATCH_SCHEMA, compression="snappy") as writer:
+        for batch in iter_scored_blocks(store_dir, similarity_threshold, high_severity_threshold, block_rows, catalog, spec_store):
+            writer.write_batch(batch)
+            values, freq = np.unique(batch.column("severity").to_numpy(zero_copy_only=False), return_counts=True)
+            for value, n in zip(values, freq):
+                counts[value] += int(n)
+            counts["unscored"] += batch.column("mismatch_score").null_count
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Score text/image/spec consistency from local embeddings and spec attributes.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--local", action="store_true", help="Read products from and write scores to the local warehouse whatever warehouse.backend says")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    app_cfg = cfg["app"]
+    cons_cfg = cfg.get("consistency", {})
+    store_dir = cfg.get("embeddings", {}).get("store_dir", "data/processed/embeddings")
+    output = cons_cfg.get("output", "data/processed/mismatch_scores.parquet")
+    catalog = products_path(cfg, local=args.local)
+    spec_path = cfg.get("preprocessing", {}).get("output", "data/processed/spec_attributes")
+    spec_store = SpecStore(spec_path) if os.path.exists(os.path.join(spec_path, "index.json")) else None
+    if spec_store is None:
+        print(f"No spec attribute store at '{spec_path}' (run `make preprocess`); spec agreement is not scored.")
+    with open_tracer(cfg, local=args.local) as tracer:
+        start = time.perf_counter()
+        with tracer.span("consistency") as span:
+            counts = write_mismatch_scores(
+                store_dir, output, app_cfg["similarity_threshold"], app_cfg["high_severity_threshold"],
+                cons_cfg.get("block_rows", DEFAULT_BLOCK_ROWS), catalog, spec_store,
+            )
+            total = counts["none"] + counts["medium"] + counts["high"]
+            span.add(rows_in=total, rows_out=total, flagged_high=counts["high"], flagged_medium=counts["medium"], unscored=counts["unscored"])
+        print(
+            f"Scored {total} products in {time.perf_counter() - start:.1f}s: {counts['high']} high, {counts['medium']} medium, "
+            f"{counts['unscored']} with nothing comparable -> '{output}'"
+        )
+        # One bulk load of the finished file: a load job in BigQuery, a file copy locally.
+        warehouse = open_warehouse(cfg, local=args.local)
+        with tracer.span("consistency_load") as span:
+            span.add(rows_out=warehouse.load_parquet("mismatches", output), bytes_processed=os.path.getsize(output))
+        print(f"Loaded into '{warehouse.table_id('mismatches')}'.")
+
+if __name__ == "__main__":
+    main()
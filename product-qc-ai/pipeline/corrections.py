@@ -1 +1,469 @@
-# AI.GENERATE_TEXT auto fixes
+"""
+AI.GENERATE_TEXT auto-fixes, one template per defect cluster.
+
+Thousands of flagged products usually share the same defect (the same spec
+contradicting the title in one category, the same unexplained mismatch on
+near-identical listings), so fixes are generated per cluster, not per row:
+
+1. Flagged rows (validation verdict false) are grouped by defect signature
+   (category + rule reasons) and, within a signature, by text-embedding
+   similarity to a cluster leader.
+2. One generative call per cluster proposes a parameterized fix, e.g.
+   `{"field": "specs.capacity", "value": "{title_capacity}"}`; the template is
+   filled in locally for every member with that member's own values.
+3. Templates are cached by signature (plus the leader's embedding bucket for
+   unexplained defects) and prompt version, a "no fix" reply included; only
+   replies that failed to parse are retried. Accepted fixes are cached by row
+   content, so later runs only pay for new defect patterns.
+4. Corrections are upserted into the `corrections` table in one batched MERGE
+   (an Arrow upsert locally) and a before/after diff is written next to them.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from pipeline.cache import KVCache, canonical_text, content_hash
+from pipeline.config import load_config
+from pipeline.llm import BigQueryEndpoint, scheduler_from_config
+from pipeline.metrics import open_tracer
+from pipeline.preprocessing import flatten_specs
+from pipeline.validation import COLOURS
+from pipeline.warehouse import BigQueryWarehouse, open_warehouse, products_path
+
+CORRECTION_SCHEMA = pa.schema([
+    ("product_id", pa.string()),
+    ("field", pa.string()),
+    ("original_value", pa.string()),
+    ("corrected_value", pa.string()),
+    ("confidence", pa.float64()),
+    ("status", pa.string()),
+    ("cluster_id", pa.string()),
+    ("corrected_ts", pa.timestamp("us", tz="UTC")),
+])
+ROW_FIELDS = ["title", "brand", "category", "specs"]
+# Rule reasons from pipeline.validation and the spec attribute each one is about.
+REASON_ATTRIBUTES = {"capacity": "capacity", "screen size": "screen_size", "wattage": "wattage", "colour": "colour"}
+# Values pulled out of each member's title; templates refer to them as {title_<name>}.
+# Numbers are written the way spec values are ("256 gb", "15 inch", "800 w").
+TITLE_PATTERNS = {
+    "capacity": (r"\b(\d+(?:\.\d+)?)\s*(gb|tb)\b", "{0} {1}"),
+    "screen_size": (r"(\d+(?:\.\d+)?)\s*(\"|in\b|inch\b|inches\b)", "{0} inch"),
+    "wattage": (r"(\d+(?:\.\d+)?)\s*(w|watt|watts)\b", "{0} w"),
+    "colour": (r"\b(" + "|".join(COLOURS) + r")\b", "{0}"),
+}
+PLACEHOLDERS = ["{title}", "{brand}", "{category}"] + [f"{{title_{name}}}" for name in TITLE_PATTERNS]
+FIX_PROMPT = (
+    "These products share the defect '{signature}'. Propose a fix that applies to all of them. "
+    "Reply with only a JSON array of objects with keys field (title, brand, category or specs.<attribute>), "
+    "value and confidence (0-1). value may use the placeholders "
+    + ", ".join(p.replace("{", "{{").replace("}", "}}") for p in PLACEHOLDERS) + ", "
+    "which are filled in per product.\n"
+    "Example product: Title: {title} | Brand: {brand} | Category: {category} | Specs: {specs}"
+)
+
+# --- SIGNATURES AND CLUSTERS ---
+def _reasons(reasons):
+    if not isinstance(reasons, str):
+        return []
+    return sorted({r.strip().removesuffix(" mismatch") for r in reasons.split(";") if r.strip()})
+
+def defect_signatures(df):
+    """Defect signature per row: category plus the sorted rule reasons ('unexplained' without any)."""
+    category = df["category"].astype("string").fillna("") if "category" in df.columns else pd.Series("", index=df.index)
+    reasons = df["reasons"].map(lambda r: ",".join(_reasons(r)) or "unexplained")
+    return category + "|" + reasons
+
+def cluster_rows(signatures, vectors, cluster_cos=0.85, block_rows=1024):
+    """Leader clustering within each signature.
+
+    A row joins the most similar leader of its signature when their cosine is
+    at least `cluster_cos` and becomes a new leader otherwise. Rows without a
+    vector (all zeros) form one cluster per signature. Returns (labels,
+    leader row per label, cosine of every row to its leader).
+    """
+    n = len(signatures)
+    labels = np.empty(n, dtype=np.int64)
+    sims = np.ones(n, dtype=np.float32)
+    leaders = []
+    norms = np.linalg.norm(vectors, axis=1)
+    unit = vectors / np.where(norms == 0, 1, norms)[:, None]
+    for _, rows in pd.Series(np.arange(n)).groupby(np.asarray(signatures), sort=False):
+        rows = rows.to_numpy()
+        empty = rows[norms[rows] == 0]
+        if len(empty):
+            labels[empty] = len(leaders)
+            leaders.append(empty[0])
+        group = []  # labels of this signature's leaders
+        for start in range(0, len(rows), block_rows):
+            block = rows[start:start + block_rows]
+            block = block[norms[block] > 0]
+            known = len(group)
+            best = np.full(len(block), -1)
+            best_sim = np.full(len(block), -np.inf, dtype=np.float32)
+            if known:
+                s = unit[block] @ unit[[leaders[g] for g in group]].T
+                best, best_sim = s.argmax(axis=1), s.max(axis=1)
+            for i, row in enumerate(block):
+                # Leaders created within this block are not in `s` yet.
+                if len(group) > known:
+                    s_new = unit[[leaders[g] for g in group[known:]]] @ unit[row]
+                    j = int(s_new.argmax())
+                    if s_new[j] > best_sim[i]:
+                        best[i], best_sim[i] = known + j, s_new[j]
+                if best_sim[i] >= cluster_cos:
+                    labels[row], sims[row] = group[best[i]], best_sim[i]
+                    continue
+                labels[row] = len(leaders)
+                group.append(len(leaders))
+                leaders.append(row)
+    return labels, np.asarray(leaders, dtype=np.int64), sims
+
+# --- TEMPLATES ---
+def template_params(df):
+    """Placeholder values per row: plain fields plus values extracted from the title."""
+    title = df["title"].astype("string").fillna("").str.lower()
+    params = pd.DataFrame({field: df[field].astype("string").fillna("") for field in ("title", "brand", "category")}, index=df.index)
+    for name, (pattern, fmt) in TITLE_PATTERNS.items():
+        groups = title.str.extract(pattern)
+        params[f"title_{name}"] = [fmt.format(*g) if pd.notna(g[0]) else None for g in groups.itertuples(index=False)]
+    return params
+
+def apply_template(template, params):
+    """Fill a template value with one row's params; None when a placeholder has no value."""
+    try:
+        value = str(template["value"]).format_map({k: v for k, v in params.items() if isinstance(v, str) and v})
+    except (KeyError, ValueError, IndexError):
+        return None
+    return value or None
+
+def parse_templates(response):
+    """Templates from a reply; [] is an explicit "no fix", None a reply that did not parse."""
+    match = re.search(r"\[.*\]", str(response), re.S)
+    if not match:
+        return None
+    try:
+        values = json.loads(match.group(0))
+    except ValueError:
+        return None
+    out = []
+    for v in values if isinstance(values, list) else []:
+        if isinstance(v, dict) and v.get("field") and v.get("value") is not None:
+            out.append({"field": str(v["field"]), "value": str(v["value"]), "confidence": float(v.get("confidence", 0.5))})
+    return out
+
+class LocalFixer:
+    """Deterministic offline stand-in for AI.GENERATE_TEXT.
+
+    Trusts the title: every spec attribute named by a rule reason is set to the
+    title's value. Unexplained defects get an explicit "no fix" (left for review).
+    """
+
+    def __init__(self, confidence=0.9):
+        self.confidence = confidence
+        self.calls = 0
+
+    def propose(self, requests):
+        self.calls += len(requests)
+        return [
+            [{"field": f"specs.{REASON_ATTRIBUTES[r]}", "value": f"{{title_{REASON_ATTRIBUTES[r]}}}", "confidence": self.confidence}
+             for r in reasons if r in REASON_ATTRIBUTES]
+            for reasons, _ in requests
+        ]
+
+class SchedulerFixer:
+    """Proposes templates through the shared async LLM scheduler, one prompt per cluster."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    @property
+    def calls(self):
+        return self.scheduler.stats["calls"]
+
+    def propose(self, requests):
+        prompts = [
+            FIX_PROMPT.format(signature=", ".join(reasons) or "unexplained mismatch", **{k: row.get(k) or "" for k in ROW_FIELDS})
+            for reasons, row in requests
+        ]
+        replies = asyncio.run(self._gather(prompts))
+        # A call that failed is treated like an unparseable reply: no template, retried next run.
+        return [None if isinstance(r, Exception) else parse_templates(r) for r in replies]
+
+    async def _gather(self, prompts):
+        return await asyncio.gather(*(self.scheduler.submit(p) for p in prompts), return_exceptions=True)
+
+# Keys hash a digest of the prompt rather than the prompt itself: one short string per row.
+_PROMPT_DIGEST = content_hash(FIX_PROMPT)
+
+def embedding_buckets(vectors, bits=8, seed=0):
+    """LSH bucket per row: the signs of the vectors on `bits` fixed random hyperplanes, as hex.
+
+    Near-identical listings land in the same bucket from run to run, whichever
+    of them happens to lead their cluster.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    planes = np.random.default_rng(seed).standard_normal((vectors.shape[1], bits)).astype(np.float32)
+    return [row.tobytes().hex() for row in np.packbits(vectors @ planes > 0, axis=1)]
+
+def template_key(signature, bucket):
+    # Rule-explained defects get one template per signature; unexplained ones one per embedding bucket.
+    if not signature.endswith("|unexplained"):
+        return content_hash(_PROMPT_DIGEST, signature)
+    return content_hash(_PROMPT_DIGEST, signature, bucket)
+
+def fix_keys(df):
+    """Accepted-fix cache key per row: the prompt version plus the row's content."""
+    values = [df[k].astype("string").fillna("") for k in ROW_FIELDS]
+    return [content_hash(_PROMPT_DIGEST, "fix", *row) for row in zip(*values)]
+
+# --- CORRECTION ---
+def _original_values(df):
+    # Current value of every field a template may touch, specs flattened to canonical attributes.
+    values = {}
+    for field in ("title", "brand", "category"):
+        if field in df.columns:
+            values.update(((pid, field), v) for pid, v in zip(df["product_id"], df[field].astype("string").fillna("")))
+    if "specs" in df.columns and len(df):
+        table = pa.Table.from_pandas(df[["product_id", "category", "specs"]].astype("string"), preserve_index=False)
+        attributes = flatten_specs(table.combine_chunks().to_batches()[0])
+        if attributes is not None:
+            rows = zip(*(attributes.column(c).to_pylist() for c in ("product_id", "attribute", "value")))
+            values.update(((pid, f"specs.{attr}"), value) for pid, attr, value in rows)
+    return values
+
+def _record(df, row):
+    return {k: (None if pd.isna(v) else v) for k, v in df.loc[row, ["product_id", *ROW_FIELDS]].items()}
+
+def correct_rows(df, vectors, fixer, templates, fixes, cluster_cos=0.85, apply_threshold=0.8, bucket_bits=8):
+    """Corrections for the flagged rows in `df` (needs product_id, reasons and the ROW_FIELDS).
+
+    `vectors` are the rows' text embeddings (zeros where missing); `templates`
+    and `fixes` are KVCaches; `bucket_bits` sizes the embedding buckets that
+    key unexplained defects. Returns (corrections DataFrame, stats).
+    """
+    stats = {"flagged": len(df), "fix_cache_hits": 0, "clusters": 0, "template_cache_hits": 0, "llm_calls": 0, "corrected_rows": 0}
+    out = []
+    row_keys = fix_keys(df)
+    accepted = fixes.get_many(set(row_keys))
+    for pid, key in zip(df["product_id"], row_keys):
+        for field, original, corrected, confidence, cluster in accepted.get(key, []):
+            out.append((pid, field, original, corrected, confidence, "applied", cluster))
+    todo = np.array([key not in accepted for key in row_keys], dtype=bool)
+    stats["fix_cache_hits"] = int(len(df) - todo.sum())
+    if todo.any():
+        todo_rows = np.flatnonzero(todo)
+        sub = df[todo].reset_index(drop=True)
+        signatures = defect_signatures(sub).to_numpy()
+        todo_vectors = np.asarray(vectors)[todo]
+        labels, leaders, sims = cluster_rows(signatures, todo_vectors, cluster_cos)
+        stats["clusters"] = len(leaders)
+        buckets = embedding_buckets(todo_vectors[leaders], bucket_bits) if len(leaders) else []
+        keys = [template_key(signatures[row], bucket) for row, bucket in zip(leaders, buckets)]
+        cached = templates.get_many(set(keys))
+        stats["template_cache_hits"] = sum(k in cached for k in keys)
+        missing = list(dict.fromkeys(k for k in keys if k not in cached))
+        if missing:
+            first = {k: i for i, k in reversed(list(enumerate(keys)))}
+            calls = fixer.calls
+            proposed = fixer.propose([(_reasons(sub.at[leaders[first[k]], "reasons"]), _record(sub, leaders[first[k]])) for k in missing])
+            stats["llm_calls"] = fixer.calls - calls
+            fresh = dict(zip(missing, proposed))
+            # [] is an answer ("no fix") and is kept for this prompt version; only unparseable replies are retried.
+            templates.put_many({k: v for k, v in fresh.items() if v is not None})
+            cached.update(fresh)
+        # Only members of clusters that got a fix need their parameters and current values.
+        has_fix = np.array([bool(cached[k]) for k in keys], dtype=bool)
+        rows = np.flatnonzero(has_fix[labels]) if len(keys) else np.empty(0, dtype=np.int64)
+        members = sub.iloc[rows]
+        params = template_params(members).to_dict(orient="records")
+        originals = _original_values(members)
+        new_fixes = {}
+        for row, pid, member_params in zip(rows, members["product_id"], params):
+            label, accepted_fixes = labels[row], []
+            cluster = f"{signatures[row]}#{keys[label][:8]}"
+            for template in cached[keys[label]]:
+                corrected = apply_template(template, member_params)
+                original = originals.get((pid, template["field"]))
+                if corrected is None or canonical_text(corrected) == canonical_text(original or ""):
+                    continue
+                confidence = float(template.get("confidence", 0.5)) * float(sims[row])
+                status = "applied" if confidence >= apply_threshold else "pending"
+                out.append((pid, template["field"], original, corrected, confidence, status, cluster))
+                if status == "applied":
+                    accepted_fixes.append([template["field"], original, corrected, confidence, cluster])
+            if accepted_fixes:
+                # Identical listings share a key and get identical fixes.
+                new_fixes[row_keys[todo_rows[row]]] = accepted_fixes
+        fixes.put_many(new_fixes)
+    corrections = pd.DataFrame(out, columns=CORRECTION_SCHEMA.names[:-1])
+    corrections["corrected_ts"] = pd.Timestamp(datetime.now(timezone.utc))
+    stats["corrected_rows"] = int(corrections["product_id"].nunique())
+    return corrections, stats
+
+# --- WRITE BACK ---
+MERGE_SQL = """
+MERGE `{target}` t
+USING `{staging}` s
+ON t.product_id = s.product_id AND t.field = s.field
+WHEN MATCHED AND (t.corrected_value IS DISTINCT FROM s.corrected_value OR t.status IS DISTINCT FROM s.status) THEN UPDATE SET
+  original_value = s.original_value, corrected_value = s.corrected_value, confidence = s.confidence,
+  status = s.status, cluster_id = s.cluster_id, corrected_ts = s.corrected_ts
+WHEN NOT MATCHED THEN INSERT ROW
+"""
+
+def correction_diff(previous, corrections):
+    """Before/after per correction and what the write does with it (insert / update / unchanged)."""
+    new = corrections.select(["product_id", "field", "original_value", "corrected_value", "status"])
+    if previous is None or previous.num_rows == 0:
+        joined = new.append_column("previous_value", pa.nulls(new.num_rows, pa.string())).append_column("previous_status", pa.nulls(new.num_rows, pa.string()))
+    else:
+        prev = previous.select(["product_id", "field", "corrected_value", "status"]).rename_columns(["product_id", "field", "previous_value", "previous_status"])
+        joined = new.join(prev, ["product_id", "field"], join_type="left outer")
+    inserted = pc.is_null(joined["previous_status"])
+    same = pc.and_(pc.equal(joined["previous_value"], joined["corrected_value"]), pc.equal(joined["previous_status"], joined["status"]))
+    change = pc.if_else(inserted, "insert", pc.if_else(pc.fill_null(same, False), "unchanged", "update"))
+    return pa.table({
+        "product_id": joined["product_id"],
+        "field": joined["field"],
+        "before": joined["original_value"],
+        "after": joined["corrected_value"],
+        "previous": joined["previous_value"],
+        "change": change,
+    })
+
+def _key(table):
+    return pc.binary_join_element_wise(table["product_id"], table["field"], "\x1f")
+
+def dedupe_corrections(corrections):
+    """One row per (product_id, field), the most confident; MERGE rejects duplicate source keys."""
+    ranked = corrections.sort_by([("confidence", "descending")])
+    _, first = np.unique(_key(ranked).to_numpy(zero_copy_only=False).astype(str), return_index=True)
+    return ranked.take(pa.array(np.sort(first)))
+
+def merge_corrections(warehouse, corrections):
+    """Upsert corrections keyed by (product_id, field); returns the before/after diff.
+
+    BigQuery: the batch is loaded into a staging table and applied with one
+    MERGE. Local: the same upsert over the Arrow table.
+    """
+    corrections = dedupe_corrections(corrections)
+    if isinstance(warehouse, BigQueryWarehouse):
+        warehouse.write("corrections_staging", corrections)
+        target, staging = warehouse.table_id("corrections"), warehouse.table_id("corrections_staging")
+        previous = None
+        if warehouse.exists("corrections"):
+            previous = warehouse.client.query(
+                f"SELECT t.* FROM `{target}` t JOIN `{staging}` s USING (product_id, field)"
+            ).to_arrow()
+        diff = correction_diff(previous, corrections)
+        warehouse.client.query(
+            f"CREATE TABLE IF NOT EXISTS `{target}` LIKE `{staging}`;\n" + MERGE_SQL.format(target=target, staging=staging)
+        ).result()
+        return diff
+    previous = warehouse.read("corrections") if warehouse.exists("corrections") else None
+    diff = correction_diff(previous, corrections)
+    if previous is not None:
+        previous = previous.filter(pc.invert(pc.is_in(_key(previous), value_set=_key(corrections))))
+        corrections = pa.concat_tables([previous.select(CORRECTION_SCHEMA.names).cast(CORRECTION_SCHEMA), corrections])
+    warehouse.write("corrections", corrections)
+    return diff
+
+# --- INPUTS ---
+def load_flagged(validations_path, products_path):
+    """Products whose validation verdict is false, with their reasons and the ROW_FIELDS."""
+    verdicts = pq.read_table(validations_path, columns=["product_id", "is_consistent", "reasons"])
+    flagged = verdicts.filter(pc.equal(verdicts["is_consistent"], False))
+    products = ds.dataset(products_path, format="parquet")
+    columns = [c for c in ["product_id", *ROW_FIELDS] if c in products.schema.names]
+    rows = products.to_table(columns=columns, filter=ds.field("product_id").isin(flagged["product_id"].combine_chunks()))
+    df = rows.to_pandas().merge(flagged.select(["product_id", "reasons"]).to_pandas(), on="product_id", how="inner")
+    for col in ROW_FIELDS:
+        if col not in df.columns:
+            df[col] = None
+    return df
+
+def text_vectors(store_dir, product_ids, dim=None):
+    """Text embeddings aligned to `product_ids`; zero rows for products that have none."""
+    from pipeline.embeddings import VectorStore
+
+    path = os.path.join(store_dir, "text")
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return np.zeros((len(product_ids), dim or 1), dtype=np.float32)
+    store = VectorStore(path)
+    out = np.zeros((len(product_ids), store.dim), dtype=np.float32)
+    present = [i for i, pid in enumerate(product_ids) if pid in store]
+    if present:
+        out[present] = store.get([product_ids[i] for i in present])
+    return out
+
+def print_correction_report(stats, diff):
+    corrected = stats.get("corrected_rows", 0)
+    per_row = stats["llm_calls"] / corrected if corrected else 0.0
+    changes = dict(zip(*np.unique(diff["change"].to_numpy(zero_copy_only=False), return_counts=True))) if diff.num_rows else {}
+    print(
+        f"{stats['flagged']:,} flagged rows -> {stats['clusters']:,} clusters ({stats['template_cache_hits']:,} templates cached, "
+        f"{stats['fix_cache_hits']:,} rows with cached fixes); {diff.num_rows:,} corrections for {corrected:,} products"
+    )
+    print(f"LLM calls: {stats['llm_calls']:,} ({per_row:.4f} per corrected row)")
+    print("Write-back: " + ", ".join(f"{changes.get(k, 0):,} {k}" for k in ("insert", "update", "unchanged")))
+    for row in diff.filter(pc.not_equal(diff["change"], "unchanged")).slice(0, 5).to_pylist():
+        print(f"  {row['product_id']} {row['field']}: {row['before']!r} -> {row['after']!r}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate cluster-level auto-fixes for flagged products and merge them into corrections.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--local", action="store_true", help="Use the offline LocalFixer and the local warehouse")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    cor_cfg = cfg.get("corrections", {})
+    emb_cfg = cfg.get("embeddings", {})
+    if args.local:
+        fixer = LocalFixer()
+    else:
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=cfg["project_id"])
+        fixer = SchedulerFixer(scheduler_from_config(BigQueryEndpoint(client), cfg))
+    templates = KVCache(cor_cfg.get("template_cache_path", "data/processed/cache/correction_templates.sqlite"))
+    fixes = KVCache(cor_cfg.get("fix_cache_path", "data/processed/cache/correction_fixes.sqlite"))
+    with open_tracer(cfg, local=args.local) as tracer:
+        start = time.perf_counter()
+        with tracer.span("correct", fixer="local" if args.local else "llm") as span:
+            df = load_flagged(
+                cfg.get("validation", {}).get("output", "data/processed/validation_results.parquet"),
+                products_path(cfg, local=args.local),
+            )
+            vectors = text_vectors(emb_cfg.get("store_dir", "data/processed/embeddings"), df["product_id"].tolist())
+            corrections, stats = correct_rows(
+                df, vectors, fixer, templates, fixes, cor_cfg.get("cluster_cos", 0.85), cor_cfg.get("apply_threshold", 0.8),
+                cor_cfg.get("bucket_bits", 8),
+            )
+            table = pa.Table.from_pandas(corrections, schema=CORRECTION_SCHEMA, preserve_index=False)
+            output = cor_cfg.get("output", "data/processed/corrections.parquet")
+            pq.write_table(table, output)
+            diff = merge_corrections(open_warehouse(cfg, local=args.local), table)
+            pq.write_table(diff, cor_cfg.get("diff_output", "data/processed/corrections_diff.parquet"))
+            lookups = stats["clusters"] + stats["fix_cache_hits"]
+            span.add(
+                rows_in=stats["flagged"], rows_out=table.num_rows, llm_calls=stats["llm_calls"], clusters=stats["clusters"],
+                corrected_rows=stats["corrected_rows"], cache_hits=stats["template_cache_hits"] + stats["fix_cache_hits"],
+                cache_misses=lookups - stats["template_cache_hits"] - stats["fix_cache_hits"],
+            )
+            if stats["corrected_rows"]:
+                span.set(llm_calls_per_corrected_row=stats["llm_calls"] / stats["corrected_rows"])
+        print(f"Corrected in {time.perf_counter() - start:.1f}s -> '{output}'")
+        print_correction_report(stats, diff)
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,855 @@
-# ML.GENERATE_EMBEDDING calls
+"""
+Embeddings for products: text (descriptions, spec blobs, reviews) and images.
+
+Server-side embeddings are produced with ML.GENERATE_EMBEDDING and refreshed
+incrementally (see `refresh_embedding_tables` and the scripts/generate_*
+scripts). This module is the offline path used by
+`make embed`: a pluggable local backend embeds text in large NumPy batches,
+and every vector is cached under a hash of its normalized text so unchanged
+strings are never embedded twice. Reviews are pooled into per-product
+summary vectors that are only recomputed when a product's reviews change.
+Local images go through a bounded
+decode/resize pipeline into a pluggable feature extractor, cached by file
+content hash. Vectors are kept in memory-mapped float32 stores that later
+stages open read-only without copying.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pipeline.cache import canonical_text, content_hash
+from pipeline.config import load_config
+from pipeline.metrics import open_tracer
+from pipeline.warehouse import products_path
+
+# --- VECTOR STORE ---
+class VectorStore:
+    """Append-only float32 vectors on disk with one string id per row.
+
+    Layout: `ids.txt` (one id per line), `vectors.f32` (raw row-major float32)
+    and `meta.json` (dim and vector space). `vectors` is a read-only np.memmap,
+    so opening a store costs nothing until rows are touched. Stores whose
+    `space` names match hold vectors from the same model and can be compared;
+    a store without a space is never compared with another one.
+    """
+
+    def __init__(self, path, dim=None, space=None):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim, self.space = meta["dim"], meta.get("space")
+        elif dim is None:
+            raise FileNotFoundError(f"No vector store at '{path}'.")
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.dim, self.space = dim, space
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": dim, "space": space}, f)
+            open(self._ids_path, "a").close()
+            open(self._vectors_path, "ab").close()
+        self._load()
+
+    @property
+    def _ids_path(self):
+        return os.path.join(self.path, "ids.txt")
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, "vectors.f32")
+
+    def _load(self):
+        with open(self._ids_path, encoding="utf-8") as f:
+            self.ids = f.read().splitlines()
+        n_vectors = os.path.getsize(self._vectors_path) // (4 * self.dim)
+        # A partially written append leaves the two files out of step; trust the shorter.
+        del self.ids[min(len(self.ids), n_vectors):]
+        self._index = None
+        self._map()
+
+    def _map(self):
+        n = len(self.ids)
+        if n:
+            self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @property
+    def index(self):
+        # Later rows win, so re-appending an id overrides the earlier vector.
+        if self._index is None:
+            self._index = {key: row for row, key in enumerate(self.ids)}
+        return self._index
+
+    def append(self, ids, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape != (len(ids), self.dim):
+            raise ValueError(f"Expected vectors of shape ({len(ids)}, {self.dim}), got {vectors.shape}.")
+        with open(self._vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self._ids_path, "a", encoding="utf-8") as f:
+            f.writelines(f"{key}\n" for key in ids)
+        if self._index is not None:
+            self._index.update((key, row) for row, key in enumerate(ids, start=len(self.ids)))
+        self.ids.extend(ids)
+        self._map()
+
+    def rows(self, ids):
+        return np.fromiter((self.index[key] for key in ids), dtype=np.int64, count=len(ids))
+
+    def get(self, ids):
+        return np.asarray(self.vectors[self.rows(ids)])
+
+    @classmethod
+    def create(cls, path, dim, space=None):
+        """Start an empty store at `path`, discarding anything already there."""
+        shutil.rmtree(path, ignore_errors=True)
+        return cls(path, dim=dim, space=space)
+
+    def replace(self, path):
+        """Move this store over `path`, so readers never see a half-written store."""
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(self.path, path)
+        return VectorStore(path)
+
+# --- BACKENDS ---
+# Words and numbers, lowercased and split apart: "Red," -> "red", "64GB" -> "64", "gb".
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?|[^\W\d_]+")
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower())
+
+class HashingEmbedder:
+    """Deterministic offline embedder: signed feature hashing of word uni/bigrams.
+
+    Needs nothing but NumPy, so it is the default for offline runs and tests.
+    """
+
+    # Versioned with the tokenizer: the name keys the embedding caches and store spaces.
+    name = "hashing-v2"
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self._buckets = {}
+
+    def _bucket(self, token):
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            h = zlib.crc32(token.encode("utf-8"))
+            bucket = self._buckets[token] = (h % self.dim, 1.0 if (h >> 31) & 1 else -1.0)
+        return bucket
+
+    def embed(self, texts):
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            words = tokenize(text)
+            tokens = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for token in tokens:
+                col, sign = self._bucket(token)
+                rows.append(row)
+                cols.append(col)
+                signs.append(sign)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(out, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)), np.asarray(signs, dtype=np.float32))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1, norms)
+
+class SentenceTransformerEmbedder:
+    """Local transformer model via sentence-transformers (optional dependency)."""
+
+    def __init__(self, model="all-MiniLM-L6-v2", dim=None):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model)
+        self.name = f"st-{model.replace('/', '_')}"
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return self.model.encode(texts, batch_size=256, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+BACKENDS = {
+    "hashing": HashingEmbedder,
+    "sentence-transformers": SentenceTransformerEmbedder,
+}
+
+def get_embedder(emb_cfg):
+    backend = emb_cfg.get("backend", "hashing")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Choose one of {sorted(BACKENDS)}.")
+    kwargs = {"dim": emb_cfg.get("dim", 256)}
+    if emb_cfg.get("model"):
+        kwargs["model"] = emb_cfg["model"]
+    return BACKENDS[backend](**kwargs)
+
+def embedder_space(embedder):
+    """Name of the vector space `embedder` writes into, recorded in store metadata."""
+    return f"{embedder.name}-{embedder.dim}"
+
+def open_cache(store_dir, embedder):
+    # One cache per backend/dim so switching models never mixes vector spaces.
+    return VectorStore(os.path.join(store_dir, "cache", embedder_space(embedder)), dim=embedder.dim)
+
+# --- BATCHED EMBEDDING ---
+def embed_texts(texts, embedder, cache, batch_size=4096, stats=None, seen=None):
+    """Embed `texts`, only sending strings whose normalized hash is not cached yet.
+
+    Returns a (len(texts), dim) float32 array. `stats`, if given, is updated
+    with counts of texts, unique strings and strings actually embedded. Pass
+    the same `seen` set to every call of a run to count unique strings across
+    batches rather than per batch.
+    """
+    keys = [content_hash(text) for text in texts]
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cache and key not in missing:
+            missing[key] = canonical_text(text)
+    pending = list(missing)
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        cache.append(batch, embedder.embed([missing[key] for key in batch]))
+    if stats is not None:
+        stats["texts"] = stats.get("texts", 0) + len(texts)
+        if seen is None:
+            stats["unique"] = stats.get("unique", 0) + len(set(keys))
+        else:
+            # 64-bit key prefixes: exact enough for a count at a fraction of the memory.
+            seen.update(int(key[:16], 16) for key in keys)
+            stats["unique"] = len(seen)
+        stats["embedded"] = stats.get("embedded", 0) + len(pending)
+    return cache.get(keys) if keys else np.zeros((0, cache.dim), dtype=np.float32)
+
+# --- PRODUCT MODALITIES ---
+def iter_product_batches(path, batch_size, columns=("product_id", "description", "specs", "reviews")):
+    """Stream product rows from a local Parquet or CSV export (or a warehouse table directory) as lists of dicts."""
+    if path.endswith(".parquet") or os.path.isdir(path):
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(path, format="parquet")
+        present = [c for c in columns if c in dataset.schema.names]
+        for batch in dataset.to_batches(batch_size=batch_size, columns=present):
+            yield batch.to_pylist()
+    else:
+        import pandas as pd
+
+        for chunk in pd.read_csv(path, chunksize=batch_size, dtype={"product_id": "string"}):
+            present = [c for c in columns if c in chunk.columns]
+            yield chunk[present].astype(object).where(chunk[present].notna(), None).to_dict(orient="records")
+
+def _spec_text(specs):
+    if specs is None:
+        return None
+    return specs if isinstance(specs, str) else json.dumps(specs, sort_keys=True)
+
+def _review_list(reviews):
+    if reviews is None:
+        return []
+    if isinstance(reviews, str):
+        reviews = json.loads(reviews) if reviews.startswith("[") else [reviews]
+    return [r for r in reviews if r]
+
+# --- REVIEWS ---
+# Reviews are embedded once per unique normalized text across the catalog (the
+# embedding cache is keyed by content hash, so boilerplate reviews cost one
+# embedding) and pooled into one summary vector per product. Every pooled row
+# carries a fingerprint of the product's review set: a later run re-pools only
+# products whose reviews changed and copies the rest from the previous store.
+REVIEW_VARIANTS = ("mean", "trimmed", "weighted")
+
+def _normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def pool_reviews(vectors, counts, variants=("mean",), outlier_cos=0.3):
+    """Unit summary vectors per product from review vectors grouped by product.
+
+    `counts[i]` (>= 1) consecutive rows of `vectors` belong to product i.
+    mean: the normalized mean. trimmed: the mean of reviews whose cosine to
+    the mean is at least `outlier_cos` (all of them when none is).
+    weighted: reviews weighted by their (non-negative) cosine to the mean.
+    Returns {variant: (len(counts), dim) float32}.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    owner = np.repeat(np.arange(len(counts)), counts)
+    mean = _normalize_rows(np.add.reduceat(vectors, starts, axis=0))
+    out = {"mean": mean}
+    if set(variants) - {"mean"}:
+        cos = np.einsum("ij,ij->i", _normalize_rows(vectors), mean[owner])
+        weights = {"trimmed": (cos >= outlier_cos).astype(np.float32), "weighted": np.clip(cos, 0, None).astype(np.float32)}
+        for name in variants:
+            if name == "mean":
+                continue
+            w = weights[name]
+            # Products where every review would be dropped keep the plain mean.
+            w = np.where(np.add.reduceat(w, starts)[owner] > 0, w, 1.0)
+            out[name] = _normalize_rows(np.add.reduceat(vectors * w[:, None], starts, axis=0))
+    return {name: out[name].astype(np.float32) for name in variants}
+
+def _review_store_name(variant):
+    return "review" if variant == "mean" else f"review_{variant}"
+
+def _review_set_fingerprint(keys, salt):
+    # Order-insensitive: re-ordered reviews do not invalidate the pooled vector.
+    h = hashlib.blake2b("\x1f".join([salt, *sorted(keys)]).encode("utf-8"), digest_size=8)
+    return int.from_bytes(h.digest(), "little", signed=True)
+
+class ReviewPooler:
+    """Incremental per-product review pooling into `review` (+ `review_<variant>`) stores."""
+
+    def __init__(self, store_dir, embedder, cache, variants=("mean",), outlier_cos=0.3, batch_size=4096):
+        unknown = set(variants) - set(REVIEW_VARIANTS)
+        if unknown:
+            raise ValueError(f"Unknown review pooling variants {sorted(unknown)}. Choose from {REVIEW_VARIANTS}.")
+        self.store_dir = store_dir
+        self.embedder, self.cache, self.batch_size = embedder, cache, batch_size
+        self.variants = ["mean", *[v for v in variants if v != "mean"]]
+        self.outlier_cos = outlier_cos
+        # Pooled vectors depend on the vector space and the pooling settings too.
+        self.salt = f"{embedder.name}-{embedder.dim}-{','.join(self.variants)}-{outlier_cos}"
+        self.previous, self.previous_fp = self._open_previous()
+        self.writers = {v: VectorStore.create(os.path.join(store_dir, f"{_review_store_name(v)}.tmp"), embedder.dim, embedder_space(embedder)) for v in self.variants}
+        self.fingerprints = []
+        self.stats = {"products": 0, "reused": 0, "reviews": 0}
+        self.seen = set()
+
+    def _open_previous(self):
+        paths = {v: os.path.join(self.store_dir, _review_store_name(v)) for v in self.variants}
+        fp_path = os.path.join(paths["mean"], "fingerprints.npy")
+        if not all(os.path.exists(os.path.join(p, "meta.json")) for p in paths.values()) or not os.path.exists(fp_path):
+            return None, {}
+        stores = {v: VectorStore(p) for v, p in paths.items()}
+        fps = np.load(fp_path)
+        return stores, dict(zip(stores["mean"].ids, fps.tolist()))
+
+    def add(self, product_reviews):
+        """Pool one batch of (product_id, [review texts]); products without reviews are skipped."""
+        product_reviews = [(pid, reviews) for pid, reviews in product_reviews if reviews]
+        if not product_reviews:
+            return
+        keys = [[content_hash(r) for r in reviews] for _, reviews in product_reviews]
+        fps = [_review_set_fingerprint(k, self.salt) for k in keys]
+        reuse = [i for i, ((pid, _), fp) in enumerate(zip(product_reviews, fps)) if self.previous_fp.get(pid) == fp]
+        reused = set(reuse)
+        stale = [i for i in range(len(product_reviews)) if i not in reused]
+        if reuse:
+            ids = [product_reviews[i][0] for i in reuse]
+            for v in self.variants:
+                self.writers[v].append(ids, self.previous[v].get(ids))
+        if stale:
+            ids = [product_reviews[i][0] for i in stale]
+            texts = [r for i in stale for r in product_reviews[i][1]]
+            vectors = embed_texts(texts, self.embedder, self.cache, self.batch_size, self.stats, self.seen)
+            pooled = pool_reviews(vectors, [len(product_reviews[i][1]) for i in stale], self.variants, self.outlier_cos)
+            for v in self.variants:
+                self.writers[v].append(ids, pooled[v])
+        self.fingerprints.extend([fps[i] for i in reuse] + [fps[i] for i in stale])
+        self.stats["products"] += len(product_reviews)
+        self.stats["reused"] += len(reuse)
+        self.stats["reviews"] += sum(len(reviews) for _, reviews in product_reviews)
+
+    def close(self):
+        np.save(os.path.join(self.writers["mean"].path, "fingerprints.npy"), np.asarray(self.fingerprints, dtype=np.int64))
+        for v, writer in self.writers.items():
+            writer.replace(os.path.join(self.store_dir, _review_store_name(v)))
+        return self.stats
+
+def embed_products(path, store_dir, embedder, batch_size=4096, review_variants=("mean",), outlier_cos=0.3):
+    """Embed description and spec text and pool review vectors for every product in `path`.
+
+    Writes `text` and `spec` stores and the pooled `review` store(s) (see
+    ReviewPooler) under `store_dir` batch by batch and returns per-modality stats.
+    """
+    cache = open_cache(store_dir, embedder)
+    modalities = ("text", "spec")
+    writers = {name: VectorStore.create(os.path.join(store_dir, f"{name}.tmp"), embedder.dim, embedder_space(embedder)) for name in modalities}
+    pooler = ReviewPooler(store_dir, embedder, cache, review_variants, outlier_cos, batch_size)
+    stats = {name: {} for name in modalities}
+    seen = {name: set() for name in modalities}
+    for rows in iter_product_batches(path, batch_size):
+        items = {name: [] for name in modalities}
+        for row in rows:
+            pid = str(row["product_id"])
+            if row.get("description"):
+                items["text"].append((pid, row["description"]))
+            spec = _spec_text(row.get("specs"))
+            if spec:
+                items["spec"].append((pid, spec))
+        for name, pairs in items.items():
+            if pairs:
+                ids, texts = zip(*pairs)
+                writers[name].append(list(ids), embed_texts(list(texts), embedder, cache, batch_size, stats[name], seen[name]))
+        pooler.add([(str(row["product_id"]), _review_list(row.get("reviews"))) for row in rows])
+    for name, writer in writers.items():
+        writer.replace(os.path.join(store_dir, name))
+    stats["review"] = pooler.close()
+    return stats
+
+# --- IMAGES ---
+# Producer/consumer: a process pool hashes, decodes and resizes image files
+# (at most `queue_size` in flight), the main process groups them into
+# fixed-size batches for the feature extractor. Thumbnails are cached as .npy
+# and features in a VectorStore, both keyed by the file's content hash.
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".ppm", ".pgm"}
+
+def _decode_netpbm(data):
+    # Binary PPM (P6) / PGM (P5) without Pillow; used by the synthetic catalog.
+    header, pos = [], 0
+    while len(header) < 4:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b"#":
+            pos = data.index(b"\n", pos)
+            continue
+        end = pos
+        while not data[end:end + 1].isspace():
+            end += 1
+        header.append(data[pos:end])
+        pos = end
+    magic, width, height = header[0], int(header[1]), int(header[2])
+    channels = 3 if magic == b"P6" else 1
+    pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * channels, offset=pos + 1)
+    pixels = pixels.reshape(height, width, channels)
+    return np.repeat(pixels, 3, axis=2) if channels == 1 else pixels
+
+def _resize_nearest(pixels, size):
+    h, w = pixels.shape[:2]
+    return pixels[(np.arange(size) * h // size)[:, None], (np.arange(size) * w // size)[None, :]]
+
+def decode_image(data, size):
+    """Decode image bytes to a (size, size, 3) uint8 array."""
+    if data[:2] in (b"P5", b"P6"):
+        return _resize_nearest(_decode_netpbm(data), size)
+    import io
+
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert("RGB").resize((size, size), Image.BILINEAR), dtype=np.uint8)
+
+def _decode_task(path, size, thumb_dir):
+    # Worker: content hash plus resized pixels, reusing a cached thumbnail when present.
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    thumb_path = os.path.join(thumb_dir, f"{digest}-{size}.npy")
+    if os.path.exists(thumb_path):
+        return digest, np.load(thumb_path), True
+    pixels = decode_image(data, size)
+    np.save(thumb_path + ".tmp.npy", pixels)
+    os.replace(thumb_path + ".tmp.npy", thumb_path)
+    return digest, pixels, False
+
+class ColorHashExtractor:
+    """Cheap deterministic image feature: joint RGB colour histogram + 64-bit difference hash."""
+
+    name = "colorhash"
+
+    def __init__(self, bins=4):
+        self.bins = bins
+        self.dim = bins ** 3 + 64
+
+    def embed(self, images):
+        images = np.asarray(images)
+        n = len(images)
+        q = (images.astype(np.uint16) * self.bins // 256).reshape(n, -1, 3)
+        codes = (q[..., 0] * self.bins + q[..., 1]) * self.bins + q[..., 2]
+        hist = np.zeros((n, self.bins ** 3), dtype=np.float32)
+        np.add.at(hist, (np.repeat(np.arange(n), codes.shape[1]), codes.ravel()), 1)
+        hist /= codes.shape[1]
+        gray = images.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        small = gray[:, (np.arange(8) * gray.shape[1] // 8)[:, None], (np.arange(9) * gray.shape[2] // 9)[None, :]]
+        dhash = (small[:, :, 1:] > small[:, :, :-1]).reshape(n, 64).astype(np.float32) * 2 - 1
+        out = np.concatenate([hist / np.maximum(np.linalg.norm(hist, axis=1, keepdims=True), 1e-12), dhash / 8], axis=1)
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+IMAGE_BACKENDS = {"colorhash": ColorHashExtractor}
+
+def iter_image_files(images_root):
+    """(product_id, path) for images under images_root/<product_id>/, grouped by product."""
+    if not os.path.exists(images_root):
+        print(f"Image root directory '{images_root}' does not exist.")
+        return
+    with os.scandir(images_root) as it:
+        product_dirs = sorted((e.name, e.path) for e in it if e.is_dir())
+    for product_id, product_dir in product_dirs:
+        with os.scandir(product_dir) as it:
+            for path in sorted(e.path for e in it if e.is_file()):
+                if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+                    yield product_id, path
+
+def peak_rss_mb():
+    import resource
+
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return self_kb / 1024, children_kb / 1024
+
+def embed_images(files, store_dir, extractor, image_size=64, batch_size=256, queue_size=1024, workers=None):
+    """Embed local images into an `image` store with one mean vector per product.
+
+    `files` yields (product_id, path) grouped by product. Returns stats.
+    """
+    thumb_dir = os.path.join(store_dir, "cache", f"thumbs-{image_size}")
+    os.makedirs(thumb_dir, exist_ok=True)
+    cache = VectorStore(os.path.join(store_dir, "cache", f"{extractor.name}-{extractor.dim}-{image_size}"), dim=extractor.dim)
+    writer = VectorStore.create(os.path.join(store_dir, "image.tmp"), extractor.dim, embedder_space(extractor))
+    stats = {"images": 0, "thumb_hits": 0, "feature_hits": 0, "products": 0}
+    group = {"pid": None, "vectors": []}
+    out_ids, out_vectors = [], []
+
+    def emit_group():
+        if group["vectors"]:
+            mean = np.mean(group["vectors"], axis=0)
+            out_ids.append(group["pid"])
+            out_vectors.append(mean / max(np.linalg.norm(mean), 1e-12))
+            stats["products"] += 1
+
+    def flush(batch):
+        digests = [d for _, d, _ in batch]
+        missing = {}
+        for _, digest, pixels in batch:
+            if digest not in cache and digest not in missing:
+                missing[digest] = pixels
+        if missing:
+            cache.append(list(missing), extractor.embed(list(missing.values())))
+        stats["feature_hits"] += len(batch) - len(missing)
+        for (pid, _, _), vector in zip(batch, cache.get(digests)):
+            if pid != group["pid"]:
+                emit_group()
+                group["pid"], group["vectors"] = pid, []
+            group["vectors"].append(vector)
+        if out_ids:
+            writer.append(list(out_ids), np.asarray(out_vectors))
+            out_ids.clear()
+            out_vectors.clear()
+
+    start = time.perf_counter()
+    batch, pending = [], deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def drain_one():
+            pid, future = pending.popleft()
+            digest, pixels, thumb_hit = future.result()
+            stats["images"] += 1
+            stats["thumb_hits"] += thumb_hit
+            batch.append((pid, digest, pixels))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch.clear()
+
+        for pid, path in files:
+            pending.append((pid, pool.submit(_decode_task, path, image_size, thumb_dir)))
+            if len(pending) >= queue_size:
+                drain_one()
+        while pending:
+            drain_one()
+    if batch:
+        flush(batch)
+    emit_group()
+    if out_ids:
+        writer.append(out_ids, np.asarray(out_vectors))
+    writer.replace(os.path.join(store_dir, "image"))
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = elapsed
+    stats["images_per_s"] = stats["images"] / elapsed if elapsed else 0.0
+    stats["peak_rss_mb"], stats["peak_rss_workers_mb"] = peak_rss_mb()
+    return stats
+
+# --- INCREMENTAL SERVER-SIDE REFRESH ---
+# Each embedding table carries a per-row content fingerprint (FARM_FINGERPRINT
+# of the embedded text) and a tombstone flag. A refresh only embeds source rows
+# that are new, were tombstoned, or were re-ingested after their embed_ts with
+# a different fingerprint; rows that vanished from the source get tombstoned.
+# `keys` maps target columns to source columns for the MERGE condition.
+REFRESH_SPECS = {
+    "text_embeddings": {
+        "from": "`{project}.{dataset}.products`",
+        "content": "description",
+        "content_col": "description",
+        "vector_col": "text_vector",
+        "keys": [("product_id", "product_id")],
+    },
+    "spec_embeddings": {
+        "from": "`{project}.{dataset}.products`",
+        "content": "TO_JSON_STRING(specs)",
+        "content_col": "spec_text",
+        "vector_col": "spec_vector",
+        "keys": [("product_id", "product_id")],
+    },
+    # One pooled vector per product over a catalog-wide table of unique review
+    # texts; see _review_refresh_sql.
+    "review_embeddings": {
+        "pooled": True,
+        "content_col": "review",
+        "vector_col": "review_vector",
+    },
+    "image_embeddings": {
+        # The fingerprint covers the URI only; an image overwritten in place is
+        # picked up through the ingest_ts watermark of product_images.
+        "from": "`{project}.{dataset}.product_images`",
+        "content": "image_gcs_uri",
+        "content_col": "image_gcs_uri",
+        "vector_col": "image_vector",
+        "keys": [("product_id", "product_id"), ("image_gcs_uri", "content")],
+    },
+}
+
+def _refresh_sql(table, spec, project, dataset, model):
+    target = f"`{project}.{dataset}.{table}`"
+    content, content_col, vector_col = spec["content"], spec["content_col"], spec["vector_col"]
+    # MERGE fails if a target row matches more than one source row, so a key
+    # ingested twice keeps only its latest row.
+    partition = ", ".join(content if s == "content" else s for _, s in spec["keys"])
+    source = f"""
+      SELECT product_id, {content} AS content, FARM_FINGERPRINT({content}) AS content_fp, ingest_ts
+      FROM {spec["from"].format(project=project, dataset=dataset)}
+      WHERE {content} IS NOT NULL
+      QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY ingest_ts DESC) = 1"""
+    on = " AND ".join(f"t.{t} = s.{s}" for t, s in spec["keys"])
+    changed = f"""t.product_id IS NULL
+         OR IFNULL(t.is_deleted, FALSE)
+         OR (IFNULL(s.ingest_ts > t.embed_ts, TRUE) AND t.content_fp IS DISTINCT FROM s.content_fp)"""
+    joined = f"({source}) s LEFT JOIN {target} t ON {on}"
+    return {
+        "ensure": f"""
+    CREATE TABLE IF NOT EXISTS {target} (
+      product_id STRING, {content_col} STRING, {vector_col} ARRAY<FLOAT64>,
+      content_fp INT64, is_deleted BOOL, embed_ts TIMESTAMP);
+    ALTER TABLE {target} ADD COLUMN IF NOT EXISTS content_fp INT64, ADD COLUMN IF NOT EXISTS is_deleted BOOL;
+    """,
+        "stats": f"""
+    SELECT COUNT(*) AS candidates, COUNTIF({changed}) AS changed
+    FROM {joined};
+    """,
+        "merge": f"""
+    MERGE {target} t
+    USING (
+      SELECT s.product_id, s.content, s.content_fp,
+        ML.GENERATE_EMBEDDING(MODEL `{model}`, s.content) AS vec
+      FROM {joined}
+      WHERE {changed}
+    ) s
+    ON {on}
+    WHEN MATCHED THEN UPDATE SET
+      {content_col} = s.content, {vector_col} = s.vec, content_fp = s.content_fp,
+      is_deleted = FALSE, embed_ts = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (product_id, {content_col}, {vector_col}, content_fp, is_deleted, embed_ts)
+      VALUES (s.product_id, s.content, s.vec, s.content_fp, FALSE, CURRENT_TIMESTAMP());
+    """,
+        "tombstone": f"""
+    UPDATE {target} t
+    SET is_deleted = TRUE, embed_ts = CURRENT_TIMESTAMP()
+    WHERE NOT IFNULL(t.is_deleted, FALSE)
+      AND NOT EXISTS (SELECT 1 FROM ({source}) s WHERE {on});
+    """,
+    }
+
+# Review text as embedded: the same normalization as pipeline.cache.canonical_text.
+_REVIEW_TEXT = r"LOWER(TRIM(REGEXP_REPLACE(review, r'\s+', ' ')))"
+
+def _review_refresh_sql(table, spec, project, dataset, model):
+    """Refresh steps for pooled review embeddings.
+
+    Review texts are deduplicated across the catalog by the fingerprint of
+    their normalized text; `review_text_embeddings` holds one vector per
+    unique text and the embed step only generates vectors for fingerprints it
+    has not seen. `table` then holds the element-wise mean of a product's
+    review vectors, re-pooled only when the product's set of review
+    fingerprints changed.
+    """
+    target = f"`{project}.{dataset}.{table}`"
+    texts = f"`{project}.{dataset}.review_text_embeddings`"
+    vector_col = spec["vector_col"]
+    reviews = f"""
+      SELECT p.product_id, FARM_FINGERPRINT({_REVIEW_TEXT}) AS review_fp, {_REVIEW_TEXT} AS review_text
+      FROM `{project}.{dataset}.products` p, UNNEST(p.reviews) AS review
+      WHERE review IS NOT NULL AND TRIM(review) != ''"""
+    source = f"""
+      SELECT product_id, COUNT(*) AS n_reviews,
+        FARM_FINGERPRINT(STRING_AGG(CAST(review_fp AS STRING), ',' ORDER BY review_fp)) AS content_fp
+      FROM ({reviews})
+      GROUP BY product_id"""
+    changed = "t.product_id IS NULL OR IFNULL(t.is_deleted, FALSE) OR t.content_fp IS DISTINCT FROM s.content_fp"
+    joined = f"({source}) s LEFT JOIN {target} t ON t.product_id = s.product_id"
+    return {
+        # Tables from before pooling hold one row per review (with a `review` column);
+        # their vectors seed the unique-text table and the table is rebuilt per product.
+        "ensure": f"""
+    CREATE TABLE IF NOT EXISTS {texts} (
+      content_fp INT64, {spec["content_col"]} STRING, {vector_col} ARRAY<FLOAT64>, embed_ts TIMESTAMP);
+    IF EXISTS (
+      SELECT 1 FROM `{project}.{dataset}.INFORMATION_SCHEMA.COLUMNS`
+      WHERE table_name = '{table}' AND column_name = 'review'
+    ) THEN
+      INSERT INTO {texts} (content_fp, {spec["content_col"]}, {vector_col}, embed_ts)
+      SELECT FARM_FINGERPRINT({_REVIEW_TEXT}), {_REVIEW_TEXT}, {vector_col}, embed_ts
+      FROM {target}
+      WHERE NOT IFNULL(is_deleted, FALSE) AND {vector_col} IS NOT NULL
+      QUALIFY ROW_NUMBER() OVER (PARTITION BY FARM_FINGERPRINT({_REVIEW_TEXT}) ORDER BY embed_ts DESC) = 1;
+      DROP TABLE {target};
+    END IF;
+    CREATE TABLE IF NOT EXISTS {target} (
+      product_id STRING, {vector_col} ARRAY<FLOAT64>, n_reviews INT64,
+      content_fp INT64, is_deleted BOOL, embed_ts TIMESTAMP);
+    """,
+        "stats": f"""
+    SELECT COUNT(*) AS candidates, COUNTIF({changed}) AS changed,
+      (SELECT COUNT(*) FROM ({reviews})) AS reviews,
+      (SELECT COUNT(DISTINCT review_fp) FROM ({reviews})) AS unique_reviews
+    FROM {joined};
+    """,
+        "embed": f"""
+    INSERT INTO {texts} (content_fp, {spec["content_col"]}, {vector_col}, embed_ts)
+    SELECT u.review_fp, u.review_text, ML.GENERATE_EMBEDDING(MODEL `{model}`, u.review_text), CURRENT_TIMESTAMP()
+    FROM (SELECT review_fp, ANY_VALUE(review_text) AS review_text FROM ({reviews}) GROUP BY review_fp) u
+    LEFT JOIN {texts} e ON e.content_fp = u.review_fp
+    WHERE e.content_fp IS NULL;
+    """,
+        "merge": f"""
+    MERGE {target} t
+    USING (
+      SELECT product_id, n_reviews, content_fp, ARRAY_AGG(value ORDER BY off) AS vec
+      FROM (
+        SELECT s.product_id, s.n_reviews, s.content_fp, off, AVG(x) AS value
+        FROM {joined}
+        JOIN ({reviews}) r ON r.product_id = s.product_id
+        JOIN {texts} e ON e.content_fp = r.review_fp,
+        UNNEST(e.{vector_col}) AS x WITH OFFSET off
+        WHERE {changed}
+        GROUP BY s.product_id, s.n_reviews, s.content_fp, off
+      )
+      GROUP BY product_id, n_reviews, content_fp
+    ) s
+    ON t.product_id = s.product_id
+    WHEN MATCHED THEN UPDATE SET
+      {vector_col} = s.vec, n_reviews = s.n_reviews, content_fp = s.content_fp,
+      is_deleted = FALSE, embed_ts = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT (product_id, {vector_col}, n_reviews, content_fp, is_deleted, embed_ts)
+      VALUES (s.product_id, s.vec, s.n_reviews, s.content_fp, FALSE, CURRENT_TIMESTAMP());
+    """,
+        "tombstone": f"""
+    UPDATE {target} t
+    SET is_deleted = TRUE, embed_ts = CURRENT_TIMESTAMP()
+    WHERE NOT IFNULL(t.is_deleted, FALSE)
+      AND NOT EXISTS (SELECT 1 FROM ({source}) s WHERE t.product_id = s.product_id);
+    """,
+    }
+
+def _table_refresh_sql(table, project, dataset, model):
+    spec = REFRESH_SPECS[table]
+    build = _review_refresh_sql if spec.get("pooled") else _refresh_sql
+    return build(table, spec, project, dataset, model)
+
+def refresh_embedding_tables(runner, tables, project, dataset, model):
+    """Delta-only refresh of several embedding tables; {table: skipped/re-embedded/tombstoned counts}.
+
+    Each table needs ensure -> stats -> [embed] -> merge -> tombstone in order,
+    but the tables are independent, so every step is submitted for all tables
+    at once. Pooled tables also report reviews, unique reviews and the unique
+    texts actually embedded.
+    """
+    sqls = {table: _table_refresh_sql(table, project, dataset, model) for table in tables}
+    jobs = {}
+    for step in ("ensure", "stats", "embed", "merge", "tombstone"):
+        step_tables = [table for table in sqls if step in sqls[table]]
+        for table, job in zip(step_tables, runner.run_all([sqls[table][step] for table in step_tables])):
+            jobs[table, step] = job
+    out = {}
+    for table in sqls:
+        row = next(iter(jobs[table, "stats"].result()))
+        out[table] = {
+            "candidates": row.candidates,
+            "skipped": row.candidates - row.changed,
+            "reembedded": jobs[table, "merge"].num_dml_affected_rows or 0,
+            "tombstoned": jobs[table, "tombstone"].num_dml_affected_rows or 0,
+        }
+        if (table, "embed") in jobs:
+            out[table].update(reviews=row.reviews, unique=row.unique_reviews, embedded=jobs[table, "embed"].num_dml_affected_rows or 0)
+    return out
+
+def refresh_embedding_table(client, table, project, dataset, model):
+    """Delta-only refresh of one embedding table; returns skipped/re-embedded/tombstoned counts."""
+    from pipeline.queries import QueryRunner
+
+    return refresh_embedding_tables(QueryRunner(project, client=client), [table], project, dataset, model)[table]
+
+def print_refresh_report(table, stats):
+    print(f"{table}: {stats['reembedded']} re-embedded, {stats['skipped']} skipped (unchanged), {stats['tombstoned']} tombstoned")
+    if "embedded" in stats:
+        print(f"  {stats['reviews']} reviews, {stats['unique']} unique texts, {stats['embedded']} newly embedded")
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed product text and images offline with local backends and content-hash caches.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--input", default=None, help="Local products export (.parquet or .csv)")
+    parser.add_argument("--images", action="store_true", help="Also embed local images under embeddings.images.root")
+    parser.add_argument("--images-only", action="store_true", help="Only embed local images")
+    parser.add_argument("--local", action="store_true", help="Read products from and record metrics in the local warehouse whatever warehouse.backend says")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    emb_cfg = cfg.get("embeddings", {})
+    store_dir = emb_cfg.get("store_dir", "data/processed/embeddings")
+    with open_tracer(cfg, local=args.local) as tracer:
+        if not args.images_only:
+            path = args.input or products_path(cfg, local=args.local)
+            embedder = get_embedder(emb_cfg)
+            start = time.perf_counter()
+            rev_cfg = emb_cfg.get("reviews", {})
+            with tracer.span("embed_text", backend=emb_cfg.get("backend", "hashing")) as span:
+                stats = embed_products(
+                    path, store_dir, embedder, emb_cfg.get("batch_size", 4096),
+                    review_variants=rev_cfg.get("variants", ()), outlier_cos=rev_cfg.get("outlier_cos", 0.3),
+                )
+                texts, embedded = sum(s.get("texts", 0) for s in stats.values()), sum(s.get("embedded", 0) for s in stats.values())
+                span.add(
+                    rows_in=stats["text"].get("texts", 0), texts=texts, cache_hits=texts - embedded, cache_misses=embedded,
+                    reviews=stats["review"]["reviews"], reviews_embedded=stats["review"].get("embedded", 0),
+                    review_products_reused=stats["review"]["reused"],
+                )
+            elapsed = time.perf_counter() - start
+            for name in ("text", "spec"):
+                s = stats[name]
+                if s:
+                    print(f"{name}: {s['texts']} texts, {s['embedded']} embedded, {s['texts'] - s['embedded']} served from cache or deduplicated")
+            s = stats["review"]
+            print(
+                f"review: {s['reviews']} reviews of {s['products']} products; {s['reused']} products unchanged, "
+                f"{s.get('unique', 0)} unique texts re-pooled, {s.get('embedded', 0)} embedded"
+            )
+            print(f"Done in {elapsed:.1f}s. Vectors in '{store_dir}'.")
+        if args.images or args.images_only:
+            img_cfg = emb_cfg.get("images", {})
+            extractor = IMAGE_BACKENDS[img_cfg.get("backend", "colorhash")]()
+            with tracer.span("embed_images", backend=extractor.name) as span:
+                stats = embed_images(
+                    iter_image_files(img_cfg.get("root", "data/images")), store_dir, extractor,
+                    image_size=img_cfg.get("size", 64), batch_size=img_cfg.get("batch_size", 256),
+                    queue_size=img_cfg.get("queue_size", 1024), workers=img_cfg.get("workers"),
+                )
+                span.add(
+                    rows_in=stats["images"], rows_out=stats["products"], cache_hits=stats["feature_hits"],
+                    cache_misses=stats["images"] - stats["feature_hits"], peak_rss_mb=stats["peak_rss_mb"],
+                )
+            print(
+                f"images: {stats['images']} files for {stats['products']} products in {stats['seconds']:.1f}s "
+                f"({stats['images_per_s']:,.0f} images/s); {stats['thumb_hits']} thumbnail and {stats['feature_hits']} feature cache hits; "
+                f"peak RSS {stats['peak_rss_mb']:.0f} MB (workers {stats['peak_rss_workers_mb']:.0f} MB)"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,165 @@
-# Load product data from GCS → BigQuery
+"""
+Load product data from GCS → BigQuery.
+
+Streaming CSV ingestion: the catalog export is read in bounded chunks, every
+chunk is normalized with vectorized column ops (HTML stripping, spec packing)
+and shipped as its own Parquet load job, so peak memory depends on the chunk
+size and not on the size of the file.
+"""
+import io
+import json
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# --- SCHEMA ---
+TEXT_FIELDS = ["title", "description", "brand", "category"]
+COMMON_FIELDS = ["product_id", "sku", "brand", "category", "title", "description", "price", "rating", "review_count"]
+OUT_COLS = ["product_id", "sku", "brand", "category", "title", "description", "specs", "price", "rating", "review_count", "reviews", "image_refs", "ingest_ts"]
+HTML_TAG_RE = r"<.*?>"
+DEFAULT_CHUNKSIZE = 200_000
+
+IMAGE_REF_TYPE = pa.struct([("gcs_uri", pa.string()), ("object_ref", pa.string())])
+ARROW_SCHEMA = pa.schema([
+    ("product_id", pa.string()),
+    ("sku", pa.string()),
+    ("brand", pa.string()),
+    ("category", pa.string()),
+    ("title", pa.string()),
+    ("description", pa.string()),
+    ("specs", pa.string()),
+    ("price", pa.float64()),
+    ("rating", pa.float64()),
+    ("review_count", pa.int64()),
+    ("reviews", pa.list_(pa.string())),
+    ("image_refs", pa.list_(IMAGE_REF_TYPE)),
+    ("ingest_ts", pa.timestamp("us", tz="UTC")),
+])
+
+# JSON string escapes applied column-wise; backslash must go first.
+_JSON_ESCAPES = [("\\", "\\\\"), ('"', '\\"'), ("\n", "\\n"), ("\r", "\\r"), ("\t", "\\t")]
+_CONTROL_CHARS_RE = r"[\x00-\x1f]"
+
+# --- NORMALIZATION ---
+def normalize_text(col):
+    """Strip, lowercase and remove HTML tags from a text column in one vectorized pass."""
+    return col.astype("string").str.strip().str.lower().str.replace(HTML_TAG_RE, "", regex=True)
+
+def _json_fragments(col):
+    # Encode one column as JSON value literals without touching Python objects per row.
+    if pd.api.types.is_bool_dtype(col):
+        out = col.map({True: "true", False: "false"}).astype("string")
+    elif pd.api.types.is_numeric_dtype(col):
+        if pd.api.types.is_float_dtype(col):
+            col = col.where(np.isfinite(col))
+        out = col.astype("string")
+    else:
+        s = col.astype("string")
+        for old, new in _JSON_ESCAPES:
+            s = s.str.replace(old, new, regex=False)
+        s = s.str.replace(_CONTROL_CHARS_RE, "", regex=True)
+        out = '"' + s + '"'
+    return out.fillna("null")
+
+def pack_specs(df, fields):
+    """Pack the variable columns of a chunk into one JSON object string per row."""
+    if not fields:
+        return pd.Series("{}", index=df.index, dtype="string")
+    out = "{"
+    for i, field in enumerate(fields):
+        sep = "" if i == 0 else ", "
+        out = out + f"{sep}{json.dumps(str(field))}: " + _json_fragments(df[field])
+    return out + "}"
+
+def normalize_chunk(df):
+    """Normalize one raw CSV chunk into the scalar columns of the products schema."""
+    for col in TEXT_FIELDS:
+        if col in df.columns:
+            df[col] = normalize_text(df[col])
+    variable_fields = [col for col in df.columns if col not in COMMON_FIELDS]
+    out = pd.DataFrame(index=df.index)
+    for col in COMMON_FIELDS:
+        out[col] = df[col] if col in df.columns else None
+    for col in ["product_id", "sku"] + TEXT_FIELDS:
+        out[col] = out[col].astype("string")
+    out["price"] = pd.to_numeric(out["price"], errors="coerce").astype("float64")
+    out["rating"] = pd.to_numeric(out["rating"], errors="coerce").astype("float64")
+    out["review_count"] = pd.to_numeric(out["review_count"], errors="coerce").astype("Int64")
+    out["specs"] = pack_specs(df, variable_fields)
+    return out
+
+def _empty_lists(n, value_type):
+    # n empty lists share a single zero offsets buffer instead of n Python lists.
+    offsets = pa.array(np.zeros(n + 1, dtype=np.int32))
+    return pa.ListArray.from_arrays(offsets, pa.array([], type=value_type))
+
+def chunk_to_arrow(out, ingest_ts):
+    """Convert a normalized chunk into an Arrow table matching ARROW_SCHEMA."""
+    n = len(out)
+    scalar_cols = [f.name for f in ARROW_SCHEMA if f.name not in ("reviews", "image_refs", "ingest_ts")]
+    table = pa.Table.from_pandas(out[scalar_cols], preserve_index=False)
+    columns = {name: table.column(name).cast(ARROW_SCHEMA.field(name).type) for name in scalar_cols}
+    columns["reviews"] = _empty_lists(n, pa.string())
+    columns["image_refs"] = _empty_lists(n, IMAGE_REF_TYPE)
+    ts = np.full(n, np.datetime64(ingest_ts.replace(tzinfo=None), "us"))
+    columns["ingest_ts"] = pa.array(ts, type=pa.timestamp("us", tz="UTC"))
+    return pa.table([columns[name] for name in OUT_COLS], schema=ARROW_SCHEMA)
+
+def iter_arrow_chunks(csv_path, chunksize=DEFAULT_CHUNKSIZE):
+    """Yield normalized Arrow tables of at most `chunksize` rows from a CSV export."""
+    ingest_ts = datetime.now(timezone.utc)
+    reader = pd.read_csv(csv_path, chunksize=chunksize, dtype={"product_id": "string", "sku": "string"})
+    for raw in reader:
+        yield chunk_to_arrow(normalize_chunk(raw), ingest_ts)
+
+# --- LOAD JOBS ---
+def _parquet_bytes(table):
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression="snappy")
+    buf.seek(0)
+    return buf
+
+def load_arrow_chunks(client, tables, table_id, append=False, max_inflight=2):
+    """Load Arrow chunks into `table_id`, one Parquet load job per chunk.
+
+    Unless `append`, the first chunk truncates the table and later chunks
+    append. At most `max_inflight` load jobs run while the next chunk is
+    being produced.
+    """
+    from google.cloud import bigquery
+
+    def job_config(disposition):
+        parquet_options = bigquery.ParquetOptions()
+        parquet_options.enable_list_inference = True
+        return bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=disposition,
+            parquet_options=parquet_options,
+        )
+
+    start = time.perf_counter()
+    inflight = []
+    n_rows = n_bytes = n_chunks = 0
+    for table in tables:
+        buf = _parquet_bytes(table)
+        n_bytes += buf.getbuffer().nbytes
+        disposition = "WRITE_TRUNCATE" if n_chunks == 0 and not append else "WRITE_APPEND"
+        inflight.append(client.load_table_from_file(buf, table_id, job_config=job_config(disposition)))
+        # Appends must not race the truncating first job.
+        if n_chunks == 0 or len(inflight) >= max_inflight:
+            inflight.pop(0).result()
+        n_rows += table.num_rows
+        n_chunks += 1
+        print(f"Chunk {n_chunks}: {table.num_rows} rows submitted ({n_rows} total).")
+    for job in inflight:
+        job.result()
+    elapsed = time.perf_counter() - start
+    return {"rows": n_rows, "chunks": n_chunks, "parquet_bytes": n_bytes, "seconds": elapsed}
+
+def stream_csv_to_bigquery(client, csv_path, table_id, chunksize=DEFAULT_CHUNKSIZE, max_inflight=2):
+    """Load a CSV into `table_id` one Parquet load job per normalized chunk."""
+    return load_arrow_chunks(client, iter_arrow_chunks(csv_path, chunksize), table_id, max_inflight=max_inflight)
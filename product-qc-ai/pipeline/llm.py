@@ -0,0 +1,267 @@
+"""
+Asynchronous, rate-limited scheduler for generative calls (AI.GENERATE_BOOL /
+AI.GENERATE_TEXT) shared by validation and corrections.
+
+- bounded concurrency (semaphore) and a token-bucket rate limit,
+- retries with exponential backoff and full jitter,
+- coalescing: identical prompts already in flight share one request,
+- packing: several rows go into one prompt when the task allows it.
+
+`FakeEndpoint` stands in for the model with injected latency and errors, so
+the scheduler can be tested and benchmarked offline.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+import numpy as np
+
+from pipeline.cache import content_hash
+
+class TransientLLMError(Exception):
+    """Raised by endpoints for errors worth retrying (rate limits, timeouts, 5xx)."""
+
+# --- RATE LIMITING ---
+class TokenBucket:
+    """`rate` requests per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# --- SCHEDULER ---
+class LLMScheduler:
+    """Runs `await endpoint(prompt)` calls under concurrency, rate and retry policy."""
+
+    def __init__(self, endpoint, concurrency=16, rate=50.0, burst=None, max_retries=5, base_delay=0.5, max_delay=30.0, seed=None):
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = random.Random(seed)
+        self._inflight = {}
+        self._loop_state = None
+        self.stats = {"requests": 0, "calls": 0, "coalesced": 0, "retries": 0, "failures": 0}
+        self.latencies = []
+        self._started = None
+
+    def _state(self):
+        # Semaphore and bucket are bound to the running loop; recreate them per loop.
+        loop = asyncio.get_running_loop()
+        if self._loop_state is None or self._loop_state[0] is not loop:
+            self._loop_state = (loop, asyncio.Semaphore(self.concurrency), TokenBucket(self.rate, self.burst))
+            self._inflight = {}
+        return self._loop_state[1], self._loop_state[2]
+
+    async def submit(self, prompt):
+        """Result of `prompt`, sharing the request with any identical prompt in flight."""
+        self._started = self._started or time.perf_counter()
+        self.stats["requests"] += 1
+        key = content_hash(prompt)
+        self._state()
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._call(prompt))
+        self._inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _call(self, prompt):
+        semaphore, bucket = self._state()
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                await bucket.acquire()
+                start = time.perf_counter()
+                self.stats["calls"] += 1
+                try:
+                    result = await self.endpoint(prompt)
+                    self.latencies.append(time.perf_counter() - start)
+                    return result
+                except TransientLLMError:
+                    if attempt == self.max_retries:
+                        self.stats["failures"] += 1
+                        raise
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    async def map(self, prompts):
+        return await asyncio.gather(*(self.submit(p) for p in prompts))
+
+    def report(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        lat = np.asarray(self.latencies) * 1000
+        pct = np.percentile(lat, [50, 95, 99]) if len(lat) else [float("nan")] * 3
+        return {
+            **self.stats,
+            "seconds": elapsed,
+            "requests_per_s": self.stats["requests"] / elapsed if elapsed else 0.0,
+            "p50_ms": float(pct[0]),
+            "p95_ms": float(pct[1]),
+            "p99_ms": float(pct[2]),
+        }
+
+# --- PACKING ---
+PACK_HEADER = (
+    "{instruction}\n"
+    "Answer every numbered item below. Reply with only a JSON array of {n} true/false values, in order.\n"
+)
+
+def pack_prompt(instruction, items):
+    lines = [PACK_HEADER.format(instruction=instruction, n=len(items))]
+    lines.extend(f"{i}. {item}" for i, item in enumerate(items, start=1))
+    return "\n".join(lines)
+
+def unpack_bools(response, n):
+    match = re.search(r"\[.*\]", response, re.S)
+    values = json.loads(match.group(0)) if match else None
+    if not isinstance(values, list) or len(values) != n:
+        raise ValueError(f"Expected a JSON array of {n} booleans, got: {response[:200]!r}")
+    return [v if isinstance(v, bool) else str(v).strip().lower() == "true" for v in values]
+
+def parse_bool(response):
+    return str(response).strip().lower().startswith("true")
+
+async def judge_items(scheduler, instruction, items, pack_size=10):
+    """Boolean verdict per item, packing `pack_size` distinct items per prompt.
+
+    A packed answer that cannot be parsed is retried item by item. Items whose
+    call still fails (retries exhausted or a non-transient error) get None, so
+    one bad pack leaves only its own rows unresolved.
+    """
+    unique = list(dict.fromkeys(items))
+
+    async def ask(item):
+        try:
+            return parse_bool(await scheduler.submit(f"{instruction}\n{item}"))
+        except Exception:
+            return None
+
+    async def run_pack(pack):
+        if len(pack) == 1:
+            return [await ask(pack[0])]
+        try:
+            return unpack_bools(await scheduler.submit(pack_prompt(instruction, pack)), len(pack))
+        except ValueError:
+            return list(await asyncio.gather(*(ask(item) for item in pack)))
+        except Exception:
+            return [None] * len(pack)
+
+    packs = [unique[i:i + pack_size] for i in range(0, len(unique), pack_size)]
+    results = await asyncio.gather(*(run_pack(p) for p in packs))
+    verdicts = dict(zip(unique, (v for pack in results for v in pack)))
+    return [verdicts[item] for item in items]
+
+# --- ENDPOINTS ---
+class FakeEndpoint:
+    """Local model stand-in with injected latency and transient errors.
+
+    `answer(item)` decides each verdict; packed prompts get a JSON array back.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.5, error_rate=0.0, seed=0, answer=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.answer = answer or (lambda item: len(item) % 2 == 0)
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    async def __call__(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency * self._random.lognormvariate(0, self.jitter))
+        if self._random.random() < self.error_rate:
+            raise TransientLLMError("injected failure")
+        items = re.findall(r"^\d+\. (.*)$", prompt, re.M)
+        if items:
+            return json.dumps([self.answer(item) for item in items])
+        return "true" if self.answer(prompt.splitlines()[-1]) else "false"
+
+class BigQueryEndpoint:
+    """One generative call per prompt through a BigQuery query, run off the event loop.
+
+    AI.GENERATE rather than AI.GENERATE_BOOL: packed prompts are answered with a
+    JSON array of verdicts and correction prompts with JSON templates, which a
+    single BOOL cannot carry. Single-item answers are read with `parse_bool`.
+    """
+
+    def __init__(self, client, function="AI.GENERATE"):
+        self.client = client
+        self.function = function
+
+    async def __call__(self, prompt):
+        from google.api_core import exceptions
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter("prompt", "STRING", prompt)])
+        sql = f"SELECT {self.function}(@prompt).result AS result"
+        try:
+            rows = await asyncio.to_thread(lambda: list(self.client.query(sql, job_config=job_config).result()))
+        except (exceptions.TooManyRequests, exceptions.ServiceUnavailable, exceptions.InternalServerError, exceptions.DeadlineExceeded) as e:
+            raise TransientLLMError(str(e)) from e
+        return str(rows[0].result)
+
+def scheduler_from_config(endpoint, cfg):
+    llm_cfg = cfg.get("llm", {})
+    return LLMScheduler(
+        endpoint,
+        concurrency=llm_cfg.get("concurrency", 16),
+        rate=llm_cfg.get("rate_per_s", 50.0),
+        burst=llm_cfg.get("burst"),
+        max_retries=llm_cfg.get("max_retries", 5),
+        base_delay=llm_cfg.get("base_delay_s", 0.5),
+    )
+
+def print_report(report):
+    print(
+        f"{report['requests']} requests -> {report['calls']} calls ({report['coalesced']} coalesced, "
+        f"{report['retries']} retries, {report['failures']} failed) in {report['seconds']:.2f}s; "
+        f"{report['requests_per_s']:.0f} req/s; p50 {report['p50_ms']:.0f} ms, p95 {report['p95_ms']:.0f} ms, p99 {report['p99_ms']:.0f} ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LLM scheduler against a fake endpoint.")
+    parser.add_argument("--n", type=int, default=2000, help="Items to judge")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=500.0)
+    parser.add_argument("--duplicates", type=float, default=0.2, help="Share of items repeating an earlier item")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    items = []
+    for i in range(args.n):
+        items.append(rng.choice(items) if items and rng.random() < args.duplicates else f"item {i}")
+    for pack_size in (1, 10):
+        endpoint = FakeEndpoint(latency=args.latency, error_rate=args.error_rate)
+        scheduler = LLMScheduler(endpoint, concurrency=args.concurrency, rate=args.rate, base_delay=0.05, seed=0)
+        start = time.perf_counter()
+        asyncio.run(judge_items(scheduler, "Is this item consistent?", items, pack_size))
+        print(f"pack_size={pack_size}: {args.n / (time.perf_counter() - start):,.0f} items/s;", end=" ")
+        print_report(scheduler.report())
+
+if __name__ == "__main__":
+    main()
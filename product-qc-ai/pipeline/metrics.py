@@ -0,0 +1,192 @@
+"""
+Rows for the `metrics_runs` table.
+
+Metrics are stored long-form, one row per (run, stage, metric), so any stage
+can record new metrics without a schema change:
+run_id, run_ts, stage, metric, value, labels (JSON string).
+
+`Tracer` is how the pipeline instruments itself: a stage wraps its work in
+`tracer.span(stage)`, adds counts (rows_in, rows_out, bytes_processed,
+llm_calls, cache_hits, ...) and gets wall time, throughput and cache hit rate
+recorded on exit. Rows are buffered and appended to `metrics_runs` in the
+configured warehouse in batches. Stages started by the orchestrator share
+its run id through the QC_RUN_ID environment variable.
+
+`python -m pipeline.metrics --prometheus <file>` exports the latest run in the
+Prometheus text format (e.g. for the node_exporter textfile collector).
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from pipeline.config import load_config
+from pipeline.warehouse import open_warehouse
+
+RUN_ID_ENV = "QC_RUN_ID"
+METRICS_SCHEMA = pa.schema([
+    ("run_id", pa.string()),
+    ("run_ts", pa.timestamp("us", tz="UTC")),
+    ("stage", pa.string()),
+    ("metric", pa.string()),
+    ("value", pa.float64()),
+    ("labels", pa.string()),
+])
+
+def new_run_id():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+def current_run_id():
+    """The orchestrator's run id when running as one of its stages, else a new one."""
+    return os.environ.get(RUN_ID_ENV) or new_run_id()
+
+def metric_rows(run_id, stage, metrics, labels=None, run_ts=None):
+    """Flatten a {metric: number} dict into metrics_runs rows (non-numeric values are skipped)."""
+    run_ts = run_ts or datetime.now(timezone.utc).isoformat()
+    labels = json.dumps(labels or {}, sort_keys=True)
+    return [
+        {"run_id": run_id, "run_ts": run_ts, "stage": stage, "metric": name, "value": float(value), "labels": labels}
+        for name, value in metrics.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
+
+def metric_table(rows):
+    """metrics_runs rows as an Arrow table (run_ts may be ISO strings or datetimes)."""
+    run_ts = [datetime.fromisoformat(r["run_ts"]) if isinstance(r["run_ts"], str) else r["run_ts"] for r in rows]
+    columns = {name: [r[name] for r in rows] for name in METRICS_SCHEMA.names}
+    columns["run_ts"] = run_ts
+    return pa.table(columns, schema=METRICS_SCHEMA)
+
+# --- TRACING ---
+class Span:
+    """Counts collected while a traced stage runs."""
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.metrics = {}
+
+    def add(self, **counts):
+        for name, value in counts.items():
+            self.metrics[name] = self.metrics.get(name, 0) + value
+
+    def set(self, **values):
+        self.metrics.update(values)
+
+class Tracer:
+    """Buffers metrics_runs rows for one run and appends them to `warehouse` every `flush_rows` rows."""
+
+    def __init__(self, warehouse=None, run_id=None, flush_rows=500):
+        self.warehouse = warehouse
+        self.run_id = run_id or current_run_id()
+        self.flush_rows = flush_rows
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, metrics, labels=None):
+        rows = metric_rows(self.run_id, stage, metrics, labels, datetime.now(timezone.utc))
+        with self._lock:
+            self._rows.extend(rows)
+            full = len(self._rows) >= self.flush_rows
+        if full:
+            self.flush()
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time a block; on exit records wall_s, failed, the span's counts and derived rates."""
+        span = Span(stage, labels)
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield span
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            metrics = {"wall_s": seconds, "failed": float(failed), **span.metrics}
+            rows = metrics.get("rows_out", metrics.get("rows_in"))
+            if rows is not None and seconds > 0:
+                metrics["rows_per_s"] = rows / seconds
+            lookups = metrics.get("cache_hits", 0) + metrics.get("cache_misses", 0)
+            if lookups:
+                metrics["cache_hit_rate"] = metrics.get("cache_hits", 0) / lookups
+            self.record(stage, metrics, labels)
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if rows and self.warehouse is not None:
+            self.warehouse.write("metrics", metric_table(rows), append=True)
+        return len(rows)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_tracer(cfg, local=False):
+    """Tracer writing to `metrics_runs` in the configured warehouse (local when `local`)."""
+    return Tracer(open_warehouse(cfg, local=local), flush_rows=cfg.get("metrics", {}).get("flush_rows", 500))
+
+# --- PROMETHEUS EXPORT ---
+_PROM_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+def _prom_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_text(rows, prefix="qc_"):
+    """Text exposition of metrics_runs rows: one gauge per metric, labelled by run_id, stage and row labels."""
+    by_metric = {}
+    for row in rows:
+        by_metric.setdefault(prefix + _PROM_NAME_RE.sub("_", row["metric"]), []).append(row)
+    lines = []
+    for name in sorted(by_metric):
+        lines.append(f"# TYPE {name} gauge")
+        for row in by_metric[name]:
+            labels = {"run_id": row["run_id"], "stage": row["stage"], **json.loads(row["labels"] or "{}")}
+            rendered = ",".join(f'{_PROM_NAME_RE.sub("_", k)}="{_prom_label(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{rendered}}} {row['value']!r}")
+    return "\n".join(lines) + "\n"
+
+def latest_run_rows(warehouse):
+    """metrics_runs rows of the most recent run (by run_ts)."""
+    table = warehouse.read("metrics")
+    if table.num_rows == 0:
+        return []
+    latest = table.filter(pc.equal(table["run_ts"], pc.max(table["run_ts"])))["run_id"][0]
+    return table.filter(pc.equal(table["run_id"], latest)).to_pylist()
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the latest run's metrics_runs rows in the Prometheus text format.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--local", action="store_true", help="Read the local warehouse whatever warehouse.backend says")
+    parser.add_argument("--prometheus", default=None, help="Output file (default metrics.prometheus_path, '-' for stdout)")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    rows = latest_run_rows(open_warehouse(cfg, local=args.local))
+    text = prometheus_text(rows)
+    path = args.prometheus or cfg.get("metrics", {}).get("prometheus_path") or "-"
+    if path == "-":
+        print(text, end="")
+        return
+    tmp = path + ".tmp"  # the textfile collector must never read a partial file
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    print(f"{len(rows)} metrics of run {rows[0]['run_id'] if rows else '-'} -> '{path}'")
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,321 @@
-# Orchestrates pipeline steps
+"""
+Runs the pipeline stages as a dependency graph.
+
+Independent branches run concurrently on a thread pool, e.g. text and image
+embedding, or index build alongside consistency scoring. Each stage is
+fingerprinted from its command, the config sections it reads, the
+size/mtime of its input files and the fingerprints of its upstream stages. A
+stage whose fingerprint matches the last successful run (and whose outputs
+still exist) is skipped. The state file is rewritten after every stage, so a
+failed run resumes from the stages that had not completed. Per-stage wall
+time is kept in the state file, printed at the end and recorded in
+`metrics_runs`; every stage process records its own metrics under the same
+run id (QC_RUN_ID).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from pipeline.cache import content_hash
+from pipeline.config import load_config
+from pipeline.metrics import RUN_ID_ENV, open_tracer
+from pipeline.warehouse import LocalWarehouse, open_warehouse, products_path
+
+# --- STAGES ---
+class Stage:
+    """One node of the pipeline graph.
+
+    `run` is a command (argv list, run as a subprocess) or a callable taking no
+    arguments. `config_keys` are dotted config paths whose values feed the
+    fingerprint; `inputs` / `outputs` are files or directories.
+    """
+
+    def __init__(self, name, run, deps=(), inputs=(), outputs=(), config_keys=()):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.config_keys = list(config_keys)
+
+def _module(name, config_path, *extra):
+    return [sys.executable, "-m", f"pipeline.{name}", "--config", config_path, *extra]
+
+def pipeline_stages(cfg, config_path="config.yaml", local=False):
+    """The default graph: load, preprocess, embed -> index / duplicates / consistency -> validate -> correct -> forecast."""
+    emb_cfg = cfg.get("embeddings", {})
+    store_dir = emb_cfg.get("store_dir", "data/processed/embeddings")
+    images_root = emb_cfg.get("images", {}).get("root", "data/images")
+    # Catalogs without local images are scored on text/spec only.
+    image_deps = ["embed_images"] if os.path.isdir(images_root) else []
+    local_flag = ["--local"] if local else []
+    # The CSV is loaded when present; otherwise the pipeline starts from products already in place.
+    csv_path = cfg.get("ingestion", {}).get("csv", "data/processed/quality_control.csv")
+    load_deps = ["load"] if os.path.isfile(csv_path) else []
+    warehouse = open_warehouse(cfg, local=local)
+    # Once the load stage runs, the local stages read the products table it writes.
+    loaded = load_deps and isinstance(warehouse, LocalWarehouse) and not emb_cfg.get("input")
+    catalog = warehouse.table_id("products") if loaded else products_path(cfg, local)
+    stages = [
+        Stage(
+            "load", [sys.executable, "scripts/load_to_bigquery.py", "--config", config_path, "--stream", "--csv", csv_path, *local_flag],
+            inputs=[csv_path],
+            # A BigQuery table has no local path to check; the CSV fingerprint alone decides reruns.
+            outputs=[warehouse.table_id("products")] if isinstance(warehouse, LocalWarehouse) else [],
+            config_keys=["ingestion", "warehouse", "bq_tables.products"],
+        ),
+        Stage(
+            "preprocess", _module("preprocessing", config_path, *local_flag), deps=load_deps,
+            inputs=[cfg.get("preprocessing", {}).get("input") or catalog],
+            outputs=[cfg.get("preprocessing", {}).get("output", "data/processed/spec_attributes")],
+            config_keys=["preprocessing"],
+        ),
+        Stage(
+            "embed_text", _module("embeddings", config_path, *local_flag), deps=load_deps,
+            inputs=[catalog],
+            outputs=[os.path.join(store_dir, name) for name in ("text", "spec", "review")],
+            config_keys=["embeddings.backend", "embeddings.dim", "embeddings.model", "embeddings.input", "embeddings.reviews"],
+        ),
+        Stage(
+            "embed_images", _module("embeddings", config_path, "--images-only", *local_flag),
+            inputs=[images_root],
+            outputs=[os.path.join(store_dir, "image")],
+            config_keys=["embeddings.images"],
+        ),
+        Stage(
+            "index", _module("vector_index", config_path, *local_flag), deps=["embed_text"],
+            outputs=[cfg.get("vector_index", {}).get("dir", "data/processed/vector_index")],
+            config_keys=["vector_index"],
+        ),
+        Stage(
+            "duplicates", _module("duplicates", config_path, *local_flag), deps=["embed_text"],
+            outputs=[cfg.get("duplicates", {}).get("output", "data/processed/duplicate_groups.parquet")],
+            config_keys=["duplicates"],
+        ),
+        Stage(
+            "consistency", _module("consistency", config_path, *local_flag), deps=["embed_text", "preprocess", *image_deps],
+            inputs=[catalog],
+            outputs=[cfg.get("consistency", {}).get("output", "data/processed/mismatch_scores.parquet")],
+            config_keys=["consistency", "app", "preprocessing.output"],
+        ),
+        Stage(
+            "validate", _module("validation", config_path, *local_flag), deps=["consistency"],
+            inputs=[catalog],
+            outputs=[cfg.get("validation", {}).get("output", "data/processed/validation_results.parquet")],
+            config_keys=["validation", "llm", "app"],
+        ),
+        Stage(
+            "correct", _module("corrections", config_path, *local_flag), deps=["validate"],
+            outputs=[cfg.get("corrections", {}).get("output", "data/processed/corrections.parquet")],
+            config_keys=["corrections", "llm"],
+        ),
+        Stage(
+            "forecast", _module("forecasting", config_path, *local_flag), deps=["correct"],
+            config_keys=["forecasting"],
+        ),
+    ]
+    return [
+        s for s in stages
+        if (s.name != "embed_images" or image_deps) and (s.name != "load" or load_deps)
+    ]
+
+# --- FINGERPRINTS ---
+def _config_value(cfg, dotted):
+    value = cfg
+    for part in dotted.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+def _path_signature(path):
+    # Size/mtime of a file, or of every file under a directory; cheap enough for tens of thousands of files.
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return [[path, st.st_size, st.st_mtime_ns]]
+    signature = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            st = os.stat(os.path.join(root, name))
+            signature.append([os.path.relpath(os.path.join(root, name), path), st.st_size, st.st_mtime_ns])
+    return signature
+
+def stage_fingerprint(stage, cfg, upstream):
+    """Hash of everything that decides a stage's outputs; `upstream` maps dep name -> fingerprint."""
+    run = stage.run if isinstance(stage.run, list) else getattr(stage.run, "__qualname__", repr(stage.run))
+    payload = {
+        "run": run,
+        "config": {key: _config_value(cfg, key) for key in stage.config_keys},
+        "inputs": {path: _path_signature(path) for path in stage.inputs},
+        "deps": {dep: upstream[dep] for dep in stage.deps},
+    }
+    return content_hash(json.dumps(payload, sort_keys=True, default=str))
+
+def toposort(stages):
+    """Stage names in dependency order; raises on unknown deps or cycles."""
+    by_name = {s.name: s for s in stages}
+    order, state = [], {}
+
+    def visit(name, path):
+        if name not in by_name:
+            raise ValueError(f"Unknown stage '{name}' (required by {' -> '.join(path)}).")
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for dep in by_name[name].deps:
+            visit(dep, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for stage in stages:
+        visit(stage.name, [])
+    return order
+
+# --- STATE ---
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_state(path, state):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+# --- RUNNER ---
+def _execute(stage, log_dir):
+    if callable(stage.run):
+        stage.run()
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(log_dir, f"{stage.name}.log"), "w", encoding="utf-8") as log:
+        subprocess.run(stage.run, stdout=log, stderr=subprocess.STDOUT, check=True)
+
+def run_pipeline(stages, cfg, state_path, log_dir="data/processed/logs", max_parallel=4, force=False, dry_run=False):
+    """Run `stages` in dependency order, concurrently where the graph allows.
+
+    Returns {stage: {"status": ran|skipped|failed|blocked, "seconds": ...}}.
+    """
+    by_name = {s.name: s for s in stages}
+    order = toposort(stages)
+    state = load_state(state_path)
+    lock = threading.Lock()
+    fingerprints, results = {}, {}
+
+    def is_fresh(stage):
+        prev = state.get(stage.name, {})
+        outputs_exist = all(os.path.exists(p) for p in stage.outputs)
+        return not force and prev.get("status") == "ok" and prev.get("fingerprint") == fingerprints[stage.name] and outputs_exist
+
+    def run_one(stage):
+        start = time.perf_counter()
+        try:
+            _execute(stage, log_dir)
+            status = "ok"
+        except Exception as e:
+            print(f"[{stage.name}] failed: {e}")
+            status = "failed"
+        seconds = time.perf_counter() - start
+        with lock:
+            state[stage.name] = {
+                "status": status,
+                "fingerprint": fingerprints[stage.name],
+                "seconds": round(seconds, 3),
+                "finished_ts": datetime.now(timezone.utc).isoformat(),
+            }
+            if not dry_run:
+                save_state(state_path, state)
+        return status, seconds
+
+    remaining = list(order)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        while remaining or running:
+            for name in list(remaining):
+                stage = by_name[name]
+                dep_status = [results.get(dep, {}).get("status") for dep in stage.deps]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    results[name] = {"status": "blocked", "seconds": 0.0}
+                    remaining.remove(name)
+                    continue
+                if not all(s in ("ran", "skipped") for s in dep_status):
+                    continue
+                remaining.remove(name)
+                fingerprints[name] = stage_fingerprint(stage, cfg, fingerprints)
+                if is_fresh(stage):
+                    results[name] = {"status": "skipped", "seconds": 0.0}
+                    print(f"[{name}] unchanged, skipped")
+                elif dry_run:
+                    results[name] = {"status": "ran", "seconds": 0.0}
+                    print(f"[{name}] would run")
+                else:
+                    print(f"[{name}] started")
+                    running[pool.submit(run_one, stage)] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                status, seconds = future.result()
+                results[name] = {"status": "ran" if status == "ok" else "failed", "seconds": seconds}
+                print(f"[{name}] {'done' if status == 'ok' else 'FAILED'} in {seconds:.1f}s")
+    return results
+
+def print_summary(results, elapsed):
+    for name, r in results.items():
+        print(f"  {name:<13} {r['status']:<8} {r['seconds']:>8.1f}s")
+    stage_total = sum(r["seconds"] for r in results.values())
+    print(f"Wall time {elapsed:.1f}s (sum of stage times {stage_total:.1f}s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline as a DAG, skipping stages whose inputs and config did not change.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--local", action="store_true", help="Offline run: pass --local to every stage")
+    parser.add_argument("--stages", nargs="*", help="Only these stages (and what they depend on)")
+    parser.add_argument("--force", action="store_true", help="Re-run stages even when unchanged")
+    parser.add_argument("--dry-run", action="store_true", help="Print what would run")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    orch_cfg = cfg.get("orchestration", {})
+    stages = pipeline_stages(cfg, args.config, local=args.local)
+    if args.stages:
+        by_name = {s.name: s for s in stages}
+        wanted, todo = set(), list(args.stages)
+        while todo:
+            name = todo.pop()
+            if name not in wanted:
+                wanted.add(name)
+                todo.extend(by_name[name].deps if name in by_name else [])
+        stages = [s for s in stages if s.name in wanted]
+    with open_tracer(cfg, local=args.local) as tracer:
+        os.environ[RUN_ID_ENV] = tracer.run_id  # inherited by the stage subprocesses
+        start = time.perf_counter()
+        results = run_pipeline(
+            stages, cfg, orch_cfg.get("state_path", "data/processed/pipeline_state.json"),
+            log_dir=orch_cfg.get("log_dir", "data/processed/logs"), max_parallel=orch_cfg.get("max_parallel", 4),
+            force=args.force, dry_run=args.dry_run,
+        )
+        elapsed = time.perf_counter() - start
+        print_summary(results, elapsed)
+        # A dry run records nothing, so closing the tracer writes no rows.
+        if not args.dry_run:
+            for name, r in results.items():
+                tracer.record(name, {"stage_wall_s": r["seconds"]}, {"status": r["status"], "source": "orchestration"})
+            statuses = [r["status"] for r in results.values()]
+            tracer.record("pipeline", {"wall_s": elapsed, **{f"stages_{s}": statuses.count(s) for s in ("ran", "skipped", "failed", "blocked")}})
+    if any(r["status"] in ("failed", "blocked") for r in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,268 @@
-# Flatten JSON, join modalities
+"""
+Typed columnar spec attribute store.
+
+`specs` arrives as one JSON object string per product. Parsing it once here
+turns it into a long table with one row per (product, attribute):
+
+    category, attribute, product_id, value, value_num, unit
+
+- `attribute` is a canonical key (lowercase snake_case, common synonyms
+  folded, e.g. color -> colour, storage -> capacity),
+- `value` is the normalized string value, dictionary-encoded (spec values are
+  highly repetitive categoricals),
+- `value_num` / `unit` hold numeric values converted to one canonical unit per
+  dimension (tb -> gb, cm -> inch, kw -> w, ...), null when not numeric.
+
+Rows are sorted by (category, attribute) and the store keeps the row range of
+every pair in `index.json`, so an attribute-level check or aggregation reads
+one contiguous, zero-copy slice of memory-mapped Arrow columns instead of
+re-parsing JSON per row per query. The table is also written to the
+`spec_attributes` warehouse table.
+"""
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.json as pa_json
+
+from pipeline.config import load_config
+from pipeline.metrics import open_tracer
+from pipeline.warehouse import open_warehouse, products_path
+
+DEFAULT_BATCH_ROWS = 262_144
+_DICT = pa.dictionary(pa.int32(), pa.string())
+ATTRIBUTE_SCHEMA = pa.schema([
+    ("category", _DICT),
+    ("attribute", _DICT),
+    ("product_id", pa.string()),
+    ("value", _DICT),
+    ("value_num", pa.float64()),
+    ("unit", _DICT),
+])
+
+# --- CANONICAL KEYS AND UNITS ---
+KEY_ALIASES = {
+    "color": "colour",
+    "storage": "capacity",
+    "storage_capacity": "capacity",
+    "memory_size": "capacity",
+    "screen": "screen_size",
+    "display_size": "screen_size",
+    "screen_size_inches": "screen_size",
+    "power": "wattage",
+    "watts": "wattage",
+    "weight_kg": "weight",
+}
+# unit -> (canonical unit, factor to it)
+UNITS = {
+    "mb": ("gb", 1 / 1024), "gb": ("gb", 1.0), "tb": ("gb", 1024.0),
+    '"': ("inch", 1.0), "in": ("inch", 1.0), "inch": ("inch", 1.0), "inches": ("inch", 1.0),
+    "cm": ("inch", 1 / 2.54), "mm": ("inch", 1 / 25.4),
+    "w": ("w", 1.0), "watt": ("w", 1.0), "watts": ("w", 1.0), "kw": ("w", 1000.0),
+    "g": ("kg", 0.001), "kg": ("kg", 1.0), "lb": ("kg", 0.45359237), "lbs": ("kg", 0.45359237),
+    "mah": ("mah", 1.0), "hz": ("hz", 1.0), "mhz": ("hz", 1e6), "ghz": ("hz", 1e9),
+}
+_KEY_RE = re.compile(r"[^a-z0-9]+")
+_NUMBER_RE = r'^(?P<num>-?\d+(?:\.\d+)?)\s*(?P<unit>[a-z"]*)$'
+
+def canonical_key(key):
+    key = _KEY_RE.sub("_", str(key).lower()).strip("_")
+    return KEY_ALIASES.get(key, key)
+
+def parse_values(values):
+    """(value, value_num, unit) arrays for a string array of raw spec values."""
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    value = pc.utf8_trim_whitespace(pc.utf8_lower(values))
+    match = pc.extract_regex(pc.replace_substring(value, ",", ""), _NUMBER_RE)
+    number = pc.cast(pc.struct_field(match, "num"), pa.float64())
+    raw_unit = pc.dictionary_encode(pc.struct_field(match, "unit"))
+    # Only the handful of distinct unit spellings go through Python.
+    known = [UNITS.get(u) for u in raw_unit.dictionary.to_pylist()]
+    canonical = pa.array([k[0] if k else (u or None) for k, u in zip(known, raw_unit.dictionary.to_pylist())], pa.string())
+    factor = pa.array([k[1] if k else 1.0 for k in known], pa.float64())
+    unit = pc.take(canonical, raw_unit.indices)
+    value_num = pc.multiply(number, pc.fill_null(pc.take(factor, raw_unit.indices), 1.0))
+    return value, value_num, unit
+
+# --- FLATTENING ---
+def _flat_object(obj, prefix=""):
+    # Nested objects -> dotted keys, scalars -> strings (the same shape the Arrow path produces).
+    out = {}
+    for key, value in (obj.items() if isinstance(obj, dict) else ()):
+        if isinstance(value, dict):
+            out.update(_flat_object(value, f"{prefix}{key}."))
+        elif value is not None and not isinstance(value, list):
+            out[prefix + key] = value if isinstance(value, str) else json.dumps(value)
+    return out
+
+def _json_columns(specs):
+    # One column per spec key. pyarrow's JSON reader parses the whole batch
+    # natively; keys whose type changes between rows fall back to json.loads.
+    specs = pc.if_else(pc.equal(pc.fill_null(specs, ""), ""), "{}", pc.fill_null(specs, "{}"))
+    lines = specs.to_pylist()
+    try:
+        table = pa_json.read_json(io.BytesIO("\n".join(lines).encode("utf-8")), read_options=pa_json.ReadOptions(block_size=1 << 26))
+    except pa.ArrowInvalid:
+        objects = [_flat_object(json.loads(line)) for line in lines]
+        table = pa.Table.from_struct_array(pa.array(objects)) if any(objects) else pa.table({})
+    if table.num_columns and table.num_rows != len(lines):
+        raise ValueError(f"Expected {len(lines)} spec objects, parsed {table.num_rows}.")
+    while any(pa.types.is_struct(f.type) for f in table.schema):
+        table = table.flatten()  # nested objects become dotted keys
+    return table
+
+def flatten_specs(batch):
+    """Long attribute table (plain string columns) for one batch of product_id/category/specs."""
+    specs = _json_columns(batch.column("specs"))
+    pid = batch.column("product_id").cast(pa.string())
+    if "category" in batch.schema.names:
+        category = pc.fill_null(batch.column("category").cast(pa.string()), "")
+    else:
+        category = pa.repeat("", batch.num_rows)
+    parts = []
+    for name, column in zip(specs.column_names, specs.columns):
+        if not (pa.types.is_string(column.type) or pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_boolean(column.type)):
+            continue  # lists and nulls carry no scalar attribute
+        column = column.cast(pa.string())
+        rows = pc.indices_nonzero(pc.and_(pc.is_valid(column), pc.not_equal(pc.utf8_trim_whitespace(column), "")))
+        if len(rows) == 0:
+            continue
+        values = pc.take(column, rows)
+        parts.append(pa.table({
+            "category": pc.take(category, rows),
+            "attribute": pa.repeat(canonical_key(name), len(rows)),
+            "product_id": pc.take(pid, rows),
+            "raw": values,
+        }))
+    if not parts:
+        return None
+    long = pa.concat_tables(parts)
+    value, value_num, unit = parse_values(long.column("raw"))
+    return long.drop_columns(["raw"]).append_column("value", value).append_column("value_num", value_num).append_column("unit", unit)
+
+def _sorted_store_table(parts):
+    # Sort once, then dictionary-encode so every column shares one dictionary.
+    if parts:
+        table = pa.concat_tables(parts).combine_chunks()
+        table = table.take(pc.sort_indices(table, [("category", "ascending"), ("attribute", "ascending"), ("product_id", "ascending")]))
+    else:
+        table = pa.table({name: pa.array([], pa.string()) for name in ("category", "attribute", "product_id", "value", "unit")}).append_column("value_num", pa.array([], pa.float64()))
+    columns = {}
+    for field in ATTRIBUTE_SCHEMA:
+        column = table.column(field.name).combine_chunks()
+        columns[field.name] = pc.dictionary_encode(column).cast(field.type) if pa.types.is_dictionary(field.type) else column
+    return pa.table(columns, schema=ATTRIBUTE_SCHEMA)
+
+def _index_entries(table):
+    # Contiguous row range of every (category, attribute) pair in the sorted table.
+    if table.num_rows == 0:
+        return []
+    cat = table.column("category").chunk(0)
+    attr = table.column("attribute").chunk(0)
+    key = cat.indices.to_numpy().astype(np.int64) * (len(attr.dictionary) + 1) + attr.indices.to_numpy()
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(key)) + 1])
+    stops = np.append(starts[1:], table.num_rows)
+    cats, attrs = cat.dictionary.to_pylist(), attr.dictionary.to_pylist()
+    cat_idx, attr_idx = cat.indices.to_numpy(), attr.indices.to_numpy()
+    return [[cats[cat_idx[s]], attrs[attr_idx[s]], int(s), int(e)] for s, e in zip(starts, stops)]
+
+def build_spec_store(batches, path):
+    """Flatten product batches (product_id, category, specs) into a SpecStore at `path`; returns stats."""
+    parts, stats = [], {"products": 0, "with_specs": 0, "attributes": 0}
+    for batch in batches:
+        stats["products"] += batch.num_rows
+        stats["with_specs"] += batch.num_rows - batch.column("specs").null_count
+        part = flatten_specs(batch)
+        if part is not None:
+            parts.append(part)
+    table = _sorted_store_table(parts)
+    stats["attributes"] = table.num_rows
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    with pa.OSFile(os.path.join(tmp, "attributes.arrow"), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    with open(os.path.join(tmp, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(_index_entries(table), f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return stats
+
+# --- STORE ---
+class SpecStore:
+    """Memory-mapped attribute table plus its (category, attribute) -> row range index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.table = pa.ipc.open_file(pa.memory_map(os.path.join(path, "attributes.arrow"))).read_all()
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as f:
+            self.index = {(c, a): (start, stop) for c, a, start, stop in json.load(f)}
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def keys(self, category=None):
+        return [key for key in self.index if category is None or key[0] == category]
+
+    def slice(self, category, attribute):
+        """Rows of one (category, attribute) pair, zero-copy; empty if unknown."""
+        start, stop = self.index.get((category, attribute), (0, 0))
+        return self.table.slice(start, stop - start)
+
+    def lookup(self, category, attribute, product_ids, column="value_num"):
+        """`column` of `attribute` aligned to `product_ids` (null where the product lacks it)."""
+        rows = self.slice(category, attribute)
+        positions = pc.index_in(pa.array(product_ids, pa.string()), value_set=rows.column("product_id"))
+        return pc.take(rows.column(column), positions)
+
+    def attribute_stats(self):
+        """Per (category, attribute): products, distinct values, numeric coverage and range."""
+        stats = self.table.group_by(["category", "attribute"], use_threads=False).aggregate([
+            ("product_id", "count"),
+            ("value", "count_distinct"),
+            ("value_num", "count"),
+            ("value_num", "min"),
+            ("value_num", "max"),
+            ("value_num", "mean"),
+        ])
+        return stats.rename_columns(["category", "attribute", "products", "distinct_values", "numeric", "min", "max", "mean"])
+
+def _product_batches(path, batch_rows):
+    fmt = "csv" if path.endswith(".csv") else "parquet"
+    dataset = ds.dataset(path, format=fmt)
+    columns = [c for c in ("product_id", "category", "specs") if c in dataset.schema.names]
+    yield from dataset.to_batches(columns=columns, batch_size=batch_rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Flatten product specs into the typed spec attribute store.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--input", default=None, help="Local products export (.parquet, .csv or a table directory)")
+    parser.add_argument("--local", action="store_true", help="Write spec_attributes to the local warehouse")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    pre_cfg = cfg.get("preprocessing", {})
+    path = args.input or pre_cfg.get("input") or products_path(cfg, local=args.local)
+    output = pre_cfg.get("output", "data/processed/spec_attributes")
+    with open_tracer(cfg, local=args.local) as tracer:
+        start = time.perf_counter()
+        with tracer.span("preprocess") as span:
+            stats = build_spec_store(_product_batches(path, pre_cfg.get("batch_rows", DEFAULT_BATCH_ROWS)), output)
+            store = SpecStore(output)
+            open_warehouse(cfg, local=args.local).write("spec_attributes", store.table)
+            span.add(rows_in=stats["products"], rows_out=stats["attributes"])
+    print(
+        f"{stats['attributes']} attribute values from {stats['with_specs']}/{stats['products']} products with specs; "
+        f"{len(store.index)} (category, attribute) pairs -> '{output}' in {time.perf_counter() - start:.1f}s"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Single-pass profiling of the products table.
+
+Row count, description/spec/image coverage and per-column null and length
+statistics all come from one scan: one aggregate query in BigQuery, or one
+streaming pass over Arrow record batches for a local Parquet export or
+warehouse table directory.
+Spot-check rows are drawn by sampling (TABLESAMPLE / reservoir sampling),
+never by sorting the whole table.
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+STRING_COLUMNS = ["product_id", "sku", "brand", "category", "title", "description"]
+NULLABLE_COLUMNS = STRING_COLUMNS + ["specs", "price", "rating", "review_count"]
+
+# --- BIGQUERY ---
+def profile_sql(table):
+    col_stats = []
+    for col in NULLABLE_COLUMNS:
+        col_stats.append(f"COUNTIF({col} IS NULL) AS {col}__nulls")
+    for col in STRING_COLUMNS:
+        col_stats.append(f"AVG(LENGTH({col})) AS {col}__avg_len")
+        col_stats.append(f"MAX(LENGTH({col})) AS {col}__max_len")
+    stats = ",\n      ".join(col_stats)
+    return f"""
+    SELECT
+      COUNT(*) AS row_count,
+      COUNTIF(description IS NOT NULL AND description != '') AS with_desc,
+      COUNTIF(specs IS NOT NULL) AS with_specs,
+      COUNTIF(ARRAY_LENGTH(image_refs) > 0) AS with_images,
+      ARRAY_AGG(IF(ARRAY_LENGTH(image_refs) > 0, STRUCT(product_id, ARRAY_LENGTH(image_refs) AS n_images), NULL)
+        IGNORE NULLS ORDER BY ARRAY_LENGTH(image_refs) DESC LIMIT 10) AS top_images,
+      {stats}
+    FROM `{table}`
+    """
+
+def profile_bigquery(client, table, sample_size=5, sample_percent=1):
+    """Profile a BigQuery table with one aggregate scan plus a block-sampled spot check."""
+    row = dict(next(iter(client.query(profile_sql(table)).result())).items())
+    sample_sql = f"SELECT * FROM `{table}` TABLESAMPLE SYSTEM ({sample_percent} PERCENT) LIMIT {sample_size}"
+    sample = [dict(r.items()) for r in client.query(sample_sql).result()]
+    return _assemble(row, sample, top_images=[dict(x) for x in row.pop("top_images") or []])
+
+def _assemble(raw, sample, top_images):
+    n = raw["row_count"]
+    profile = {
+        "row_count": n,
+        "desc_coverage": raw["with_desc"] / n if n else 0.0,
+        "specs_coverage": raw["with_specs"] / n if n else 0.0,
+        "image_coverage": raw["with_images"] / n if n else 0.0,
+        "columns": {},
+        "top_images": top_images,
+        "sample": sample,
+    }
+    for col in NULLABLE_COLUMNS:
+        nulls = raw.get(f"{col}__nulls", n)
+        stats = {"nulls": nulls, "null_rate": nulls / n if n else 0.0}
+        if col in STRING_COLUMNS:
+            stats["avg_len"] = raw.get(f"{col}__avg_len")
+            stats["max_len"] = raw.get(f"{col}__max_len")
+        profile["columns"][col] = stats
+    return profile
+
+# --- LOCAL PARQUET ---
+def profile_parquet(path, batch_size=262_144, sample_size=5, seed=0):
+    """Profile a Parquet file or table directory in one streaming pass over record batches."""
+    dataset = ds.dataset(path, format="parquet")
+    names = set(dataset.schema.names)
+    rng = np.random.default_rng(seed)
+    raw = {"row_count": 0, "with_desc": 0, "with_specs": 0, "with_images": 0}
+    len_sums = dict.fromkeys(STRING_COLUMNS, 0)
+    len_counts = dict.fromkeys(STRING_COLUMNS, 0)
+    top_images = []
+    # Reservoir sample: keep the rows with the smallest random priorities seen so far.
+    sample_keys, sample_rows = np.empty(0), []
+    for batch in dataset.to_batches(batch_size=batch_size):
+        n = batch.num_rows
+        raw["row_count"] += n
+        for col in NULLABLE_COLUMNS:
+            key = f"{col}__nulls"
+            raw[key] = raw.get(key, 0) + (batch.column(col).null_count if col in names else n)
+        for col in STRING_COLUMNS:
+            if col not in names:
+                continue
+            lengths = pc.utf8_length(batch.column(col))
+            len_sums[col] += pc.sum(lengths).as_py() or 0
+            len_counts[col] += n - lengths.null_count
+            batch_max = pc.max(lengths).as_py()
+            if batch_max is not None:
+                raw[f"{col}__max_len"] = max(raw.get(f"{col}__max_len") or 0, batch_max)
+        if "description" in names:
+            desc = batch.column("description")
+            raw["with_desc"] += pc.sum(pc.and_(pc.is_valid(desc), pc.not_equal(desc, ""))).as_py() or 0
+        if "specs" in names:
+            raw["with_specs"] += n - batch.column("specs").null_count
+        if "image_refs" in names:
+            n_images = pc.fill_null(pc.list_value_length(batch.column("image_refs")), 0).to_numpy()
+            raw["with_images"] += int((n_images > 0).sum())
+            best = np.argsort(-n_images, kind="stable")[:10]
+            best = best[n_images[best] > 0]
+            ids = batch.column("product_id").take(pa.array(best)).to_pylist() if "product_id" in names else [None] * len(best)
+            top_images.extend({"product_id": pid, "n_images": int(n_images[i])} for pid, i in zip(ids, best))
+            top_images = sorted(top_images, key=lambda r: -r["n_images"])[:10]
+        keys = rng.random(n)
+        keep = np.argsort(keys)[:sample_size]
+        merged_keys = np.concatenate([sample_keys, keys[keep]])
+        merged_rows = sample_rows + batch.take(pa.array(keep)).to_pylist()
+        order = np.argsort(merged_keys)[:sample_size]
+        sample_keys, sample_rows = merged_keys[order], [merged_rows[i] for i in order]
+    for col in STRING_COLUMNS:
+        raw[f"{col}__avg_len"] = len_sums[col] / len_counts[col] if len_counts[col] else None
+    return _assemble(raw, sample_rows, top_images)
+
+# --- PASS / FAIL ---
+def check_criteria(profile, criteria):
+    """List of human-readable failures; empty means PASS."""
+    checks = [
+        ("row count", profile["row_count"], criteria.get("min_row_count", 0)),
+        ("image coverage", profile["image_coverage"], criteria.get("min_image_coverage", 0)),
+        ("description coverage", profile["desc_coverage"], criteria.get("min_desc_coverage", 0)),
+        ("specs coverage", profile["specs_coverage"], criteria.get("min_specs_coverage", 0)),
+    ]
+    return [f"{name} {value:.4g} < {minimum}" for name, value, minimum in checks if value < minimum]
+
+def profile_metrics(profile):
+    """Flat {metric: value} view of a profile for metrics_runs."""
+    metrics = {k: profile[k] for k in ("row_count", "desc_coverage", "specs_coverage", "image_coverage")}
+    for col, stats in profile["columns"].items():
+        metrics[f"{col}.null_rate"] = stats["null_rate"]
+        if stats.get("avg_len") is not None:
+            metrics[f"{col}.avg_len"] = stats["avg_len"]
+    return metrics
+
+def print_profile(profile, elapsed=None):
+    print(f"Row count: {profile['row_count']}")
+    print(f"Image coverage: {profile['image_coverage']:.2%}")
+    print(f"Description coverage: {profile['desc_coverage']:.2%}")
+    print(f"Specs coverage: {profile['specs_coverage']:.2%}")
+    print("\nColumn stats:")
+    for col, stats in profile["columns"].items():
+        lengths = f", avg len {stats['avg_len']:.1f}, max len {stats['max_len']}" if stats.get("avg_len") is not None else ""
+        print(f"  {col:<13} nulls {stats['nulls']:>10} ({stats['null_rate']:.2%}){lengths}")
+    if profile["top_images"]:
+        print("\nSample join check (images linked):")
+        for row in profile["top_images"]:
+            print(f"  {row['product_id']}: {row['n_images']}")
+    print("\nSpot-check sampled products:")
+    for row in profile["sample"]:
+        print(f"  {row.get('product_id')}: {str(row.get('title'))[:80]}")
+    if elapsed is not None:
+        print(f"\nProfiled in {elapsed:.2f}s")
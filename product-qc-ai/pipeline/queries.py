@@ -0,0 +1,148 @@
+"""
+Shared BigQuery query execution for the scripts.
+
+- The client (and google.cloud.bigquery itself) is created on first use, so
+  CLI startup and code paths that never query stay fast.
+- `run_all` submits independent jobs together and then waits on them, so
+  BigQuery executes them concurrently instead of one after another.
+- `read` caches deterministic read queries under the normalized SQL plus the
+  last-modified time of every table it references: a cached result is
+  reused until one of those tables changes.
+- `stream` yields large results page by page as Arrow record batches.
+
+With a `tracer` (pipeline.metrics), every query records its wall time,
+bytes processed/billed and result rows, and every cache hit is counted.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+
+import pyarrow as pa
+
+from pipeline.cache import LRUCache
+
+DEFAULT_PAGE_SIZE = 50_000
+# `project.dataset.table` references; these make up the snapshot part of a cache key.
+_TABLE_RE = re.compile(r"`([\w-]+\.\w+\.\w+)`")
+# Results of these depend on more than the table contents, so they are never cached.
+_NONDETERMINISTIC_RE = re.compile(r"\b(CURRENT_\w+|RAND|GENERATE_UUID|SESSION_USER|ML\.GENERATE_\w+|AI\.\w+)\s*\(", re.IGNORECASE)
+_WRITE_RE = re.compile(r"^\s*(CREATE|INSERT|UPDATE|DELETE|MERGE|DROP|ALTER|TRUNCATE|DECLARE|BEGIN)\b", re.IGNORECASE)
+_LITERAL_RE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+_COMMENT_RE = re.compile(r"--[^\n]*|#[^\n]*|/\*.*?\*/", re.DOTALL)
+_WS_RE = re.compile(r"\s+")
+
+def normalize_sql(sql):
+    """Drop comments and collapse whitespace outside string literals; literals are kept verbatim."""
+    parts = _LITERAL_RE.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = _WS_RE.sub(" ", _COMMENT_RE.sub(" ", parts[i]))
+    return "".join(parts).strip().rstrip(";").strip()
+
+def is_cacheable(sql):
+    return not _WRITE_RE.match(sql) and not _NONDETERMINISTIC_RE.search(sql)
+
+class QueryRunner:
+    """Runs queries against one project; see the module docstring."""
+
+    def __init__(self, project=None, client=None, cache_dir=None, cache_size=128, tracer=None):
+        self.project = project
+        self._client = client
+        self.tracer = tracer
+        self._started = {}
+        self._lock = threading.Lock()
+        self.cache = LRUCache(cache_size)
+        self.cache_dir = cache_dir
+        self.stats = {"queries": 0, "cache_hits": 0, "bytes_processed": 0, "bytes_billed": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google.cloud import bigquery
+
+                    self._client = bigquery.Client(project=self.project)
+        return self._client
+
+    # --- JOBS ---
+    def submit(self, sql, description=None):
+        """Start a query job without waiting for it."""
+        if description:
+            print(f"Running: {description}")
+        self.stats["queries"] += 1
+        job = self.client.query(sql)
+        self._started[id(job)] = (time.perf_counter(), description or normalize_sql(sql)[:80])
+        return job
+
+    def _wait(self, job, description=None):
+        rows = job.result()
+        metrics = {}
+        for stat, attr in (("bytes_processed", "total_bytes_processed"), ("bytes_billed", "total_bytes_billed")):
+            metrics[stat] = getattr(job, attr, None) or 0
+            self.stats[stat] += metrics[stat]
+        start, label = self._started.pop(id(job), (None, None))
+        if self.tracer is not None and start is not None:
+            rows_out = getattr(job, "num_dml_affected_rows", None) or getattr(rows, "total_rows", None) or 0
+            self.tracer.record("query", {"wall_s": time.perf_counter() - start, "rows_out": rows_out, **metrics}, {"query": label})
+        if description:
+            print(f"Done: {description}\n")
+        return job
+
+    def run(self, sql, description=None):
+        """Run one query to completion; returns the finished job."""
+        return self._wait(self.submit(sql, description), description)
+
+    def run_all(self, queries):
+        """Submit independent queries (SQL strings or (sql, description) pairs) at once; finished jobs in order."""
+        queries = [(q, None) if isinstance(q, str) else q for q in queries]
+        jobs = [self.submit(sql, description) for sql, description in queries]
+        return [self._wait(job, description) for job, (_, description) in zip(jobs, queries)]
+
+    # --- READS ---
+    def cache_key(self, sql):
+        """Normalized SQL plus the modification time of every referenced table; None if not cacheable."""
+        if not is_cacheable(sql):
+            return None
+        snapshot = [f"{table}@{self.client.get_table(table).modified.isoformat()}" for table in sorted(set(_TABLE_RE.findall(sql)))]
+        return hashlib.blake2b("\x1f".join([normalize_sql(sql), *snapshot]).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.arrow")
+
+    def _cached(self, key):
+        table = self.cache.get(key)
+        if table is None and self.cache_dir and os.path.exists(self._cache_path(key)):
+            # Memory-mapped: the table's buffers point straight into the file.
+            table = pa.ipc.open_file(pa.memory_map(self._cache_path(key))).read_all()
+            self.cache.put(key, table)
+        return table
+
+    def _store(self, key, table):
+        self.cache.put(key, table)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = self._cache_path(key) + ".tmp"
+            with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp, self._cache_path(key))
+
+    def read(self, sql, description=None):
+        """Result of a read query as an Arrow table, served from the cache while its tables are unchanged."""
+        key = self.cache_key(sql)
+        table = self._cached(key) if key else None
+        if table is not None:
+            self.stats["cache_hits"] += 1
+            if self.tracer is not None:
+                self.tracer.record("query", {"cache_hits": 1}, {"query": description or normalize_sql(sql)[:80]})
+            return table
+        table = self.run(sql, description).to_arrow()
+        if key:
+            self._store(key, table)
+        return table
+
+    def stream(self, sql, description=None, page_size=DEFAULT_PAGE_SIZE):
+        """Yield the result as Arrow record batches, one page in memory at a time."""
+        rows = self.run(sql, description).result(page_size=page_size)
+        yield from rows.to_arrow_iterable()
@@ -1 +1,340 @@
-# AI.GENERATE_BOOL consistency checks
+"""
+AI.GENERATE_BOOL consistency checks, run as a cheap-first cascade.
+
+1. Rules: vectorized regex/attribute extraction compares title, specs, brand
+   and category and settles clear contradictions and clear agreement.
+2. Embedding: the mismatch score from `pipeline.consistency` passes rows
+   that are clearly consistent. It fails a row only above
+   `validation.embedding_fail_threshold`, a threshold calibrated against
+   labelled data (see `calibrate_fail_threshold`); without one, every row the
+   rules left open and the score does not clear goes on to the LLM.
+3. LLM: only the remaining ambiguous rows are sent to a judge (a generative
+   call through the rate-limited `pipeline.llm` scheduler, or the deterministic
+   `LocalJudge` stand-in offline/in tests).
+
+LLM verdicts are cached by a hash of (prompt template, normalized inputs), so a
+row that did not change is never judged twice. Rows whose LLM call fails are
+left unresolved (NULL verdict) and asked again on the next run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from pipeline.cache import KVCache, content_hash
+from pipeline.config import load_config
+from pipeline.llm import BigQueryEndpoint, judge_items, scheduler_from_config
+from pipeline.metrics import open_tracer
+from pipeline.warehouse import open_warehouse, products_path
+
+_ROW_TEMPLATE = "Title: {title} | Brand: {brand} | Category: {category} | Specs: {specs}"
+VALIDATION_PROMPT = (
+    "Are the title, brand, category and specs of this product consistent with each other? "
+    "Answer strictly true or false.\n" + _ROW_TEMPLATE
+)
+TIERS = ["rules", "embedding", "cache", "llm", "unresolved"]
+
+COLOURS = ["black", "white", "red", "blue", "green", "yellow", "pink", "purple", "orange", "grey", "gray", "silver", "gold", "brown", "beige"]
+_COLOUR_RE = r"\b(" + "|".join(COLOURS) + r")\b"
+_CAPACITY_RE = r"(\d+(?:\.\d+)?)\s*(gb|tb)\b"
+# "in" followed by a number is a word ("2 in 1"), not a unit.
+_SIZE_RE = r"(\d+(?:\.\d+)?)\s*(?:\"|in\b(?!\s*\d)|inch\b|inches\b)"
+_WATTS_RE = r"(\d+(?:\.\d+)?)\s*(?:w|watt|watts)\b"
+
+# --- TIER 1: RULES ---
+def _text(df, col):
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype="string")
+    return df[col].astype("string").fillna("").str.lower()
+
+def _leaf_values(obj):
+    # Scalar values of a (possibly nested) spec object.
+    for value in obj.values():
+        if isinstance(value, dict):
+            yield from _leaf_values(value)
+        elif value is not None and not isinstance(value, list):
+            yield value if isinstance(value, str) else json.dumps(value)
+
+def _spec_values(df):
+    # Parsed spec values, not the raw JSON: its closing quotes would read as inch marks.
+    if "specs" not in df.columns:
+        return pd.Series("", index=df.index, dtype="string")
+    out = []
+    for raw in df["specs"]:
+        obj = raw
+        if isinstance(raw, str) and raw.lstrip().startswith("{"):
+            try:
+                obj = json.loads(raw)
+            except ValueError:
+                obj = raw
+        out.append("; ".join(_leaf_values(obj)) if isinstance(obj, dict) else (obj if isinstance(obj, str) else ""))
+    return pd.Series(out, index=df.index, dtype="string").str.lower()
+
+def _capacity_gb(s):
+    m = s.str.extract(_CAPACITY_RE)
+    value = pd.to_numeric(m[0], errors="coerce")
+    return value.where(m[1] != "tb", value * 1024)
+
+def _number(s, pattern):
+    return pd.to_numeric(s.str.extract(pattern)[0], errors="coerce")
+
+def rule_checks(df):
+    """Per-row counts of attributes that agree / contradict between title and specs.
+
+    Returns a DataFrame with `matches`, `contradictions` and `reasons` columns.
+    """
+    title, specs = _text(df, "title"), _spec_values(df)
+    brand, category = _text(df, "brand"), _text(df, "category")
+    description = _text(df, "description")
+    matches = pd.Series(0, index=df.index)
+    contradictions = pd.Series(0, index=df.index)
+    reasons = pd.Series("", index=df.index, dtype="string")
+
+    def compare(name, left, right):
+        nonlocal matches, contradictions, reasons
+        both = left.notna() & right.notna()
+        agree = both & (left == right)
+        clash = both & (left != right)
+        matches = matches + agree.astype(int)
+        contradictions = contradictions + clash.astype(int)
+        reasons = reasons.mask(clash, reasons + f"{name} mismatch;")
+
+    compare("capacity", _capacity_gb(title), _capacity_gb(specs))
+    compare("screen size", _number(title, _SIZE_RE), _number(specs, _SIZE_RE))
+    compare("wattage", _number(title, _WATTS_RE), _number(specs, _WATTS_RE))
+    compare("colour", title.str.extract(_COLOUR_RE)[0], specs.str.extract(_COLOUR_RE)[0])
+
+    # Brand named in the title is evidence of consistency; a missing title is not.
+    has_brand = (brand != "") & (title != "")
+    brand_in_title = has_brand & pd.Series([b in t for b, t in zip(brand, title)], index=df.index, dtype=bool)
+    matches = matches + brand_in_title.astype(int)
+    # Category keyword (last path segment) named in the title or description.
+    cat_word = category.str.split(r"[>/|,]").str[-1].str.strip()
+    cat_known = cat_word.fillna("") != ""
+    cat_seen = pd.Series([c in t or c in d for c, t, d in zip(cat_word.fillna(""), title, description)], index=df.index, dtype=bool)
+    matches = matches + (cat_known & cat_seen).astype(int)
+    return pd.DataFrame({"matches": matches, "contradictions": contradictions, "reasons": reasons})
+
+# --- TIER 3: JUDGES ---
+class LocalJudge:
+    """Deterministic offline stand-in for AI.GENERATE_BOOL.
+
+    Calls it consistent when the title shares enough words with the brand,
+    category and specs; good enough to exercise the cascade in tests.
+    """
+
+    def __init__(self, min_overlap=0.2):
+        self.min_overlap = min_overlap
+        self.calls = 0
+
+    def judge(self, rows):
+        self.calls += len(rows)
+        out = []
+        for row in rows:
+            title = set(str(row.get("title") or "").lower().split())
+            context = set(" ".join(str(row.get(c) or "") for c in ("brand", "category", "specs")).lower().replace('"', " ").split())
+            out.append(bool(title) and len(title & context) / len(title) >= self.min_overlap)
+        return out
+
+class SchedulerJudge:
+    """Judges rows through the shared async LLM scheduler, packing several rows per prompt."""
+
+    def __init__(self, scheduler, pack_size=10):
+        self.scheduler = scheduler
+        self.pack_size = pack_size
+
+    @property
+    def calls(self):
+        return self.scheduler.stats["calls"]
+
+    def judge(self, rows):
+        instruction, _, _ = VALIDATION_PROMPT.partition("\n")
+        items = [_ROW_TEMPLATE.format(**{k: row.get(k) or "" for k in ("title", "brand", "category", "specs")}) for row in rows]
+        return asyncio.run(judge_items(self.scheduler, instruction, items, self.pack_size))
+
+def verdict_key(row):
+    return content_hash(VALIDATION_PROMPT, *(row.get(k) or "" for k in ("title", "brand", "category", "specs")))
+
+# --- CASCADE ---
+def calibrate_fail_threshold(scores, inconsistent, min_precision=0.95):
+    """Lowest mismatch score whose rows at or above it are inconsistent with `min_precision`, else None.
+
+    `scores` are mismatch scores and `inconsistent` the matching labels
+    (True for a known-bad product); unscored rows are ignored.
+    """
+    labelled = pd.DataFrame({"score": scores, "bad": inconsistent}).dropna()
+    if labelled.empty:
+        return None
+    # Precision of "score >= t" for every distinct t, from the top down.
+    by_score = labelled.groupby("score")["bad"].agg(["sum", "count"]).sort_index(ascending=False).cumsum()
+    precise = by_score.index[(by_score["sum"] / by_score["count"]).to_numpy() >= min_precision]
+    return float(precise.min()) if len(precise) else None
+
+def validate_batch(df, mismatch, judge, cache, similarity_threshold, high_severity_threshold, fail_threshold=None):
+    """Run the cascade over one DataFrame of products.
+
+    `mismatch` maps product_id -> mismatch_score from `pipeline.consistency`.
+    The embedding tier passes rows scoring at most 1 - `similarity_threshold`
+    and fails rows only at or above `fail_threshold` (None: never); rules
+    agreement is never overruled by it. `high_severity_threshold` is kept for
+    callers that share the app thresholds. Returns (results DataFrame, per-tier
+    row counts).
+    """
+    rules = rule_checks(df)
+    score = df["product_id"].map(mismatch).astype("float64").to_numpy()
+    verdict = pd.Series(pd.NA, index=df.index, dtype="boolean")
+    tier = pd.Series(pd.NA, index=df.index, dtype="string")
+
+    fail_rules = rules["contradictions"] > 0
+    pass_rules = (rules["matches"] >= 2) & ~fail_rules
+    verdict[fail_rules], tier[fail_rules] = False, "rules"
+    verdict[pass_rules], tier[pass_rules] = True, "rules"
+
+    open_rows = tier.isna()
+    # Everything else, high scores included, is left for the LLM to settle.
+    fail_emb = open_rows & (score >= fail_threshold) if fail_threshold is not None else pd.Series(False, index=df.index)
+    pass_emb = open_rows & (score <= 1 - similarity_threshold)
+    verdict[fail_emb], tier[fail_emb] = False, "embedding"
+    verdict[pass_emb], tier[pass_emb] = True, "embedding"
+
+    ambiguous = df.index[tier.isna()]
+    if len(ambiguous):
+        records = df.loc[ambiguous, [c for c in ("title", "brand", "category", "specs") if c in df.columns]].astype(object)
+        records = records.where(records.notna(), None).to_dict(orient="records")
+        keys = [verdict_key(r) for r in records]
+        cached = cache.get_many(set(keys))
+        todo = {}
+        for key, record in zip(keys, records):
+            if key not in cached and key not in todo:
+                todo[key] = record
+        pending = list(todo)
+        if pending:
+            # One judge call for the whole batch: the scheduler keeps `llm.concurrency` prompts in flight across it.
+            results = dict(zip(pending, judge.judge([todo[k] for k in pending])))
+            # A failed call (None) is not a verdict: leave it out of the cache so the next run asks again.
+            cache.put_many({k: v for k, v in results.items() if v is not None})
+            cached.update(results)
+        fresh, seen, tiers = set(pending), set(), []
+        for key in keys:
+            # Duplicate rows share one judged key; only the first one counts as an LLM call.
+            if cached[key] is None:
+                tiers.append("unresolved")
+            else:
+                tiers.append("llm" if key in fresh and key not in seen else "cache")
+            seen.add(key)
+        verdict[ambiguous] = [pd.NA if cached[k] is None else cached[k] for k in keys]
+        tier[ambiguous] = tiers
+
+    results = pd.DataFrame({
+        "product_id": df["product_id"].astype("string"),
+        "is_consistent": verdict,
+        "tier": tier,
+        "mismatch_score": score,
+        "reasons": rules["reasons"].replace("", pd.NA),
+    })
+    counts = tier.value_counts().reindex(TIERS, fill_value=0).to_dict()
+    return results, counts
+
+def stamp_changes(results, previous, now):
+    """Add `validated_ts`: `now` for new or changed verdicts, the previous stamp where verdict and reasons are unchanged."""
+    results = results.copy()
+    results["validated_ts"] = pd.Timestamp(now)
+    if previous is None or "validated_ts" not in previous.columns or results.empty:
+        return results
+    prev = previous.drop_duplicates("product_id").set_index("product_id")
+    before = prev.reindex(results["product_id"])
+    same = (
+        (before["is_consistent"].to_numpy() == results["is_consistent"].to_numpy())
+        & (before["reasons"].fillna("").to_numpy() == results["reasons"].fillna("").to_numpy())
+        & before["validated_ts"].notna().to_numpy()
+    )
+    results.loc[same, "validated_ts"] = before["validated_ts"].to_numpy()[same]
+    return results
+
+def print_tier_report(counts, llm_calls):
+    total = sum(counts.values())
+    if not total:
+        print("No rows validated.")
+        return
+    for name in TIERS:
+        print(f"  {name:<9} {counts[name]:>10,} rows ({counts[name] / total:.1%})")
+    print(f"LLM calls: {llm_calls:,} of {total:,} rows ({total - llm_calls:,} saved, {1 - llm_calls / total:.1%})")
+
+def load_mismatch_scores(path):
+    import pyarrow.parquet as pq
+
+    if not path or not os.path.exists(path):
+        return {}
+    table = pq.read_table(path, columns=["product_id", "mismatch_score"]).to_pandas()
+    return dict(zip(table["product_id"], table["mismatch_score"]))
+
+def _has_column(path, name):
+    import pyarrow.parquet as pq
+
+    return os.path.exists(path) and name in pq.read_schema(path).names
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate product consistency with a rules -> embedding -> LLM cascade.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--local", action="store_true", help="Use the offline LocalJudge and the local warehouse")
+    parser.add_argument("--calibrate", metavar="LABELS", help="Calibrate the embedding fail threshold on a labels.parquet (as written by generate_synthetic.py) for this run")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    app_cfg, val_cfg = cfg["app"], cfg.get("validation", {})
+    catalog = products_path(cfg, local=args.local)
+    mismatch = load_mismatch_scores(cfg.get("consistency", {}).get("output"))
+    fail_threshold = val_cfg.get("embedding_fail_threshold")
+    if args.calibrate:
+        labels = pd.read_parquet(args.calibrate, columns=["product_id", "defect"])
+        # Duplicates are consistent products in their own right.
+        bad = labels["defect"].notna() & (labels["defect"] != "duplicate")
+        fail_threshold = calibrate_fail_threshold(labels["product_id"].map(mismatch), bad)
+        print(f"Calibrated embedding fail threshold on '{args.calibrate}': {fail_threshold}")
+    cache = KVCache(val_cfg.get("cache_path", "data/processed/cache/validation.sqlite"))
+    if args.local:
+        judge = LocalJudge()
+    else:
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=cfg["project_id"])
+        scheduler = scheduler_from_config(BigQueryEndpoint(client), cfg)
+        judge = SchedulerJudge(scheduler, cfg.get("llm", {}).get("pack_size", 10))
+
+    import pyarrow.dataset as ds
+
+    with open_tracer(cfg, local=args.local) as tracer:
+        start = time.perf_counter()
+        totals = dict.fromkeys(TIERS, 0)
+        parts = []
+        columns = ["product_id", "title", "brand", "category", "description", "specs"]
+        # A Parquet export or a warehouse table directory.
+        products = ds.dataset(catalog, format="parquet")
+        with tracer.span("validate", judge="local" if args.local else "llm") as span:
+            for batch in products.to_batches(batch_size=val_cfg.get("batch_rows", 100_000), columns=[c for c in columns if c in products.schema.names]):
+                results, counts = validate_batch(
+                    batch.to_pandas(), mismatch, judge, cache,
+                    app_cfg["similarity_threshold"], app_cfg["high_severity_threshold"],
+                    fail_threshold,
+                )
+                parts.append(results)
+                for name in TIERS:
+                    totals[name] += counts[name]
+            results = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+            # Verdict cache: rows answered from it vs rows that had to go to the LLM.
+            span.add(rows_in=len(results), rows_out=len(results), llm_calls=judge.calls, cache_hits=totals["cache"], cache_misses=totals["llm"])
+            span.add(**{f"resolved_{name}": totals[name] for name in TIERS})
+        output = val_cfg.get("output", "data/processed/validation_results.parquet")
+        # Unchanged verdicts keep their stamp, so incremental exports only pick up real changes.
+        previous = pd.read_parquet(output, columns=["product_id", "is_consistent", "reasons", "validated_ts"]) if _has_column(output, "validated_ts") else None
+        results = stamp_changes(results, previous, datetime.now(timezone.utc))
+        results.to_parquet(output, index=False)
+        print(f"Validated {len(results):,} products in {time.perf_counter() - start:.1f}s -> '{output}'")
+        print_tier_report(totals, judge.calls)
+        open_warehouse(cfg, local=args.local).load_parquet("validations", output)
+
+if __name__ == "__main__":
+    main()
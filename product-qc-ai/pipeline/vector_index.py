@@ -1 +1,207 @@
-# Vector index creation and management
+"""
+Vector index creation and management.
+
+An IVF (inverted file) index over the local embedding stores written by
+`pipeline.embeddings`: vectors are clustered with spherical k-means, stored
+on disk grouped by cluster, and memory-mapped at load. A lookup scores only
+the `nprobe` closest clusters instead of the whole catalog, and many queries
+are answered together by one matrix multiply per probed cluster.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from pipeline.config import load_config
+from pipeline.embeddings import VectorStore
+from pipeline.metrics import open_tracer
+
+BLOCK_ROWS = 65536
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+def _assign(vectors, centroids):
+    # Nearest centroid for every row, computed block by block so memmaps stay on disk.
+    out = np.empty(len(vectors), dtype=np.int32)
+    for lo in range(0, len(vectors), BLOCK_ROWS):
+        block = _normalize(vectors[lo:lo + BLOCK_ROWS])
+        out[lo:lo + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+def train_centroids(vectors, nlist, n_iter=10, sample_size=100_000, seed=0):
+    """Spherical k-means on a random sample of `vectors`."""
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(vectors), size=min(sample_size, len(vectors)), replace=False))
+    sample = _normalize(vectors[sample_rows])
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+    for _ in range(n_iter):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        # Re-seed empty clusters so every list stays useful.
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+# --- INDEX ---
+class IVFIndex:
+    """On-disk IVF index: `centroids.npy`, `offsets.npy` and a VectorStore of
+    vectors reordered so every inverted list is one contiguous slice."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.store = VectorStore(os.path.join(path, "lists"))
+        self.ids = np.asarray(self.store.ids, dtype=object)
+        self._row_of = None
+
+    @classmethod
+    def load(cls, path):
+        return cls(path)
+
+    @classmethod
+    def build(cls, path, ids, vectors, nlist=None, n_iter=10, seed=0):
+        """Build an index for `vectors` (any array-like, memmaps welcome) and write it to `path`."""
+        n = len(ids)
+        nlist = min(nlist or max(1, int(4 * np.sqrt(n))), n)
+        centroids = train_centroids(vectors, nlist, n_iter=n_iter, seed=seed)
+        assign = _assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+        os.makedirs(path, exist_ok=True)
+        store = VectorStore.create(os.path.join(path, "lists"), vectors.shape[1])
+        for lo in range(0, n, BLOCK_ROWS):
+            rows = order[lo:lo + BLOCK_ROWS]
+            sorted_rows = np.sort(rows)
+            block = _normalize(vectors[sorted_rows])
+            # Restore the list order after reading the memmap sequentially.
+            block = block[np.searchsorted(sorted_rows, rows)]
+            store.append([ids[r] for r in rows], block)
+        np.save(os.path.join(path, "centroids.npy"), centroids)
+        np.save(os.path.join(path, "offsets.npy"), offsets)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"n": n, "dim": int(vectors.shape[1]), "nlist": nlist, "metric": "cosine"}, f)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, queries, k=5, nprobe=8):
+        """Top-k (ids, cosine scores) for every row of `queries`, best first."""
+        queries = _normalize(np.atleast_2d(queries))
+        m = len(queries)
+        nprobe = min(nprobe, len(self.centroids))
+        centroid_scores = queries @ self.centroids.T
+        probe = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        best_scores = np.full((m, k), -np.inf, dtype=np.float32)
+        best_rows = np.full((m, k), -1, dtype=np.int64)
+        vectors = self.store.vectors
+        for lst in np.unique(probe):
+            lo, hi = self.offsets[lst], self.offsets[lst + 1]
+            if hi == lo:
+                continue
+            qi = np.nonzero((probe == lst).any(axis=1))[0]
+            scores = queries[qi] @ np.asarray(vectors[lo:hi]).T
+            rows = np.broadcast_to(np.arange(lo, hi), scores.shape)
+            all_scores = np.concatenate([best_scores[qi], scores], axis=1)
+            all_rows = np.concatenate([best_rows[qi], rows], axis=1)
+            top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k] if all_scores.shape[1] > k else np.argsort(-all_scores, axis=1)
+            best_scores[qi] = np.take_along_axis(all_scores, top, axis=1)
+            best_rows[qi] = np.take_along_axis(all_rows, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        result_ids = [[self.ids[r] for r in row if r >= 0] for row in best_rows]
+        return result_ids, best_scores
+
+    def search_ids(self, product_ids, k=5, nprobe=8):
+        """Top-k neighbours of indexed products, excluding each product itself.
+
+        Ids that are not in the index get an empty list.
+        """
+        if self._row_of is None:
+            self._row_of = {pid: row for row, pid in enumerate(self.ids)}
+        known = [pid for pid in product_ids if pid in self._row_of]
+        neighbours = {}
+        if known:
+            rows = [self._row_of[pid] for pid in known]
+            ids, scores = self.search(np.asarray(self.store.vectors[rows]), k + 1, nprobe)
+            for pid, row_ids, row_scores in zip(known, ids, scores):
+                pairs = [(i, float(s)) for i, s in zip(row_ids, row_scores) if i != pid]
+                neighbours[pid] = pairs[:k]
+        return [neighbours.get(pid, []) for pid in product_ids]
+
+# --- EVALUATION ---
+def brute_force(vectors, queries, k=5):
+    """Exact top-k rows by cosine, scanning `vectors` block by block."""
+    queries = _normalize(np.atleast_2d(queries))
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    for lo in range(0, len(vectors), BLOCK_ROWS):
+        scores = queries @ _normalize(vectors[lo:lo + BLOCK_ROWS]).T
+        all_scores = np.concatenate([best_scores, scores], axis=1)
+        all_rows = np.concatenate([best_rows, np.broadcast_to(np.arange(lo, lo + scores.shape[1]), scores.shape)], axis=1)
+        top = np.argsort(-all_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(all_scores, top, axis=1)
+        best_rows = np.take_along_axis(all_rows, top, axis=1)
+    return best_rows, best_scores
+
+def recall_at_k(index, ids, vectors, k=5, nprobe=8, n_queries=200, seed=0):
+    """Mean overlap between IVF and exact top-k for a random sample of stored vectors."""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False))
+    queries = np.asarray(vectors[rows])
+    exact_rows, _ = brute_force(vectors, queries, k)
+    approx_ids, _ = index.search(queries, k, nprobe)
+    hits = [len({ids[r] for r in exact} & set(approx)) for exact, approx in zip(exact_rows, approx_ids)]
+    return float(np.mean(hits)) / k
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the local IVF vector index.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--modality", default="text", help="Embedding store to index (text, spec, image, ...)")
+    parser.add_argument("--query", nargs="*", help="Product ids to look up instead of building")
+    parser.add_argument("--local", action="store_true", help="Record build metrics in the local warehouse whatever warehouse.backend says")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    idx_cfg = cfg.get("vector_index", {})
+    store_dir = cfg.get("embeddings", {}).get("store_dir", "data/processed/embeddings")
+    index_dir = os.path.join(idx_cfg.get("dir", "data/processed/vector_index"), args.modality)
+    k = cfg["app"]["topk_similar"]
+    nprobe = idx_cfg.get("nprobe", 8)
+    if args.query:
+        index = IVFIndex.load(index_dir)
+        start = time.perf_counter()
+        results = index.search_ids(args.query, k, nprobe)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for pid, neighbours in zip(args.query, results):
+            print(pid, neighbours if neighbours else "(not in the index)")
+        print(f"{len(args.query)} lookups in {elapsed_ms:.1f} ms")
+        return
+    store = VectorStore(os.path.join(store_dir, args.modality))
+    with open_tracer(cfg, local=args.local) as tracer:
+        start = time.perf_counter()
+        with tracer.span("index", modality=args.modality) as span:
+            index = IVFIndex.build(index_dir, store.ids, store.vectors, nlist=idx_cfg.get("nlist"))
+            span.add(rows_in=len(index), bytes_processed=store.vectors.nbytes)
+        print(f"Built IVF index over {len(index)} vectors ({index.meta['nlist']} lists) in {time.perf_counter() - start:.1f}s -> '{index_dir}'")
+        recall = recall_at_k(index, store.ids, store.vectors, k, nprobe)
+        sample = store.ids[:100]
+        start = time.perf_counter()
+        for pid in sample:
+            index.search_ids([pid], k, nprobe)
+        single_ms = (time.perf_counter() - start) * 1000 / max(len(sample), 1)
+        tracer.record("index", {f"recall_at_{k}": recall, "lookup_ms": single_ms}, {"modality": args.modality, "nprobe": nprobe})
+    print(f"Recall@{k} vs brute force (nprobe={nprobe}): {recall:.3f}; single lookup: {single_ms:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Warehouse backends: BigQuery, or a local Arrow/Parquet copy of the dataset.
+
+Both resolve the logical table keys of `bq_tables` in config.yaml to physical
+tables: `project.dataset.name` in BigQuery, `<root>/<dataset>/<name>/` (a
+directory of Parquet parts) locally. Stages hand over Arrow tables, pandas
+frames or streams of Arrow chunks; the local backend writes them straight to
+Parquet without converting rows, so the pipeline, the API and the app run on
+a laptop-scale catalog at local-disk speed with no GCP project.
+
+`warehouse.backend` selects the backend; `--local` on a stage forces the
+local one.
+"""
+import os
+import shutil
+import uuid
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DEFAULT_ROOT = "data/warehouse"
+DEFAULT_BATCH_ROWS = 65_536
+DEFAULT_PRODUCTS = "data/processed/products.parquet"
+
+def _chunks(data):
+    # A single Arrow table / DataFrame, or an iterable of them, as a stream of Arrow chunks.
+    if isinstance(data, (pa.Table, pa.RecordBatch)) or hasattr(data, "to_parquet"):
+        data = [data]
+    for chunk in data:
+        yield chunk if isinstance(chunk, (pa.Table, pa.RecordBatch)) else pa.Table.from_pandas(chunk, preserve_index=False)
+
+# --- LOCAL ---
+class LocalWarehouse:
+    """Parquet-part directories under `<root>/<dataset>/`, one per table."""
+
+    def __init__(self, root=DEFAULT_ROOT, dataset="product_qc", tables=None):
+        self.root = os.path.join(root, dataset)
+        self.tables = tables or {}
+
+    def table_id(self, key):
+        return os.path.join(self.root, self.tables.get(key, key))
+
+    def exists(self, key):
+        path = self.table_id(key)
+        return os.path.isdir(path) and any(name.endswith(".parquet") and not name.startswith(".") for name in os.listdir(path))
+
+    def _part(self, path):
+        # Parts are written under a dot-name (which dataset scans ignore) and renamed when complete,
+        # so concurrent appends never expose a partial file.
+        name = f"part-{uuid.uuid4().hex[:12]}.parquet"
+        return os.path.join(path, "." + name), os.path.join(path, name)
+
+    def _target(self, key, append):
+        # Truncating writes go to a sibling directory that replaces the table once complete,
+        # so readers never see a half-written table.
+        path = self.table_id(key)
+        target = path if append else path + ".tmp"
+        if not append:
+            shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(target, exist_ok=True)
+        return path, target
+
+    def _commit(self, path, target):
+        if target != path:
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(target, path)
+
+    def write(self, key, data, append=False):
+        """Write an Arrow table, a DataFrame or an iterable of them; returns the row count.
+
+        Chunks are streamed into one Parquet part, so memory is bounded by the chunk size.
+        """
+        path, target = self._target(key, append)
+        tmp, part = self._part(target)
+        writer, rows = None, 0
+        try:
+            for chunk in _chunks(data):
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, chunk.schema, compression="snappy")
+                writer.write(chunk)
+                rows += chunk.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is not None:
+            os.replace(tmp, part)
+        self._commit(path, target)
+        return rows
+
+    def load_parquet(self, key, parquet_path, append=False):
+        """Add an existing Parquet file as a table part, byte for byte (no decode or re-encode)."""
+        path, target = self._target(key, append)
+        # A copy, not a hard link: the stage may rewrite its output file in place on the next run.
+        tmp, part = self._part(target)
+        shutil.copyfile(parquet_path, tmp)
+        os.replace(tmp, part)
+        self._commit(path, target)
+        return pq.ParquetFile(parquet_path).metadata.num_rows
+
+    def _dataset(self, key):
+        return ds.dataset(self.table_id(key), format="parquet")
+
+    def read(self, key, columns=None):
+        return self._dataset(key).to_table(columns=columns)
+
+    def scan(self, key, columns=None, batch_size=DEFAULT_BATCH_ROWS):
+        """Stream a table as Arrow record batches."""
+        yield from self._dataset(key).to_batches(columns=columns, batch_size=batch_size)
+
+    def count(self, key):
+        return self._dataset(key).count_rows()
+
+# --- BIGQUERY ---
+class BigQueryWarehouse:
+    """The same interface over a BigQuery dataset; Arrow data is shipped as Parquet load jobs."""
+
+    def __init__(self, client, project, dataset, tables=None):
+        self.client = client
+        self.project = project
+        self.dataset = dataset
+        self.tables = tables or {}
+
+    def table_id(self, key):
+        return f"{self.project}.{self.dataset}.{self.tables.get(key, key)}"
+
+    def exists(self, key):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self.client.get_table(self.table_id(key))
+            return True
+        except NotFound:
+            return False
+
+    def write(self, key, data, append=False):
+        from pipeline.ingestion import load_arrow_chunks
+
+        return load_arrow_chunks(self.client, _chunks(data), self.table_id(key), append=append)["rows"]
+
+    def load_parquet(self, key, parquet_path, append=False):
+        from google.cloud import bigquery
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition="WRITE_APPEND" if append else "WRITE_TRUNCATE",
+        )
+        with open(parquet_path, "rb") as f:
+            job = self.client.load_table_from_file(f, self.table_id(key), job_config=job_config)
+        job.result()
+        return job.output_rows
+
+    def _select(self, key, columns):
+        cols = ", ".join(f"`{c}`" for c in columns) if columns else "*"
+        return f"SELECT {cols} FROM `{self.table_id(key)}`"
+
+    def read(self, key, columns=None):
+        return self.client.query(self._select(key, columns)).to_arrow()
+
+    def scan(self, key, columns=None, batch_size=DEFAULT_BATCH_ROWS):
+        rows = self.client.query(self._select(key, columns)).result(page_size=batch_size)
+        yield from rows.to_arrow_iterable()
+
+    def count(self, key):
+        return self.client.get_table(self.table_id(key)).num_rows
+
+# --- SETUP ---
+def _is_local(cfg, local):
+    return local or cfg.get("warehouse", {}).get("backend", "local") == "local"
+
+def products_path(cfg, local=False):
+    """The catalog the offline stages read.
+
+    `embeddings.input` when set; otherwise the local warehouse `products`
+    table once `make load` has written it; otherwise the processed Parquet export.
+    """
+    path = cfg.get("embeddings", {}).get("input")
+    if path:
+        return path
+    if _is_local(cfg, local):
+        warehouse = open_warehouse(cfg, local=True)
+        if warehouse.exists("products"):
+            return warehouse.table_id("products")
+    return DEFAULT_PRODUCTS
+
+def open_warehouse(cfg, local=False):
+    """Backend for `warehouse.backend` (local | bigquery); `local=True` forces the local one."""
+    wh_cfg = cfg.get("warehouse", {})
+    backend = "local" if local else wh_cfg.get("backend", "local")
+    dataset, tables = cfg.get("bq_dataset", "product_qc"), cfg.get("bq_tables", {})
+    if backend == "local":
+        return LocalWarehouse(wh_cfg.get("root", DEFAULT_ROOT), dataset, tables)
+    if backend == "bigquery":
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=cfg["project_id"])
+        return BigQueryWarehouse(client, cfg["project_id"], dataset, tables)
+    raise ValueError(f"Unknown warehouse.backend '{backend}'. Choose local or bigquery.")
@@ -0,0 +1,282 @@
+"""
+Offline benchmark suite with baseline regression gates (`make bench`).
+
+For every size in `bench.sizes` a synthetic catalog is generated
+(scripts/generate_synthetic.py, no images), then each stage runs in its own
+spawned process so peak RSS is measured per stage:
+- ingestion: CSV -> normalized Arrow chunks (pipeline.ingestion),
+- embedding: local text embedding with a cold cache (pipeline.embeddings),
+- search: IVF index build and single-query latency (pipeline.vector_index),
+- consistency: streamed cross-modal scoring (pipeline.consistency),
+- duplicates: blocked near-duplicate search (pipeline.duplicates), with pair
+  precision and recall against the injected duplicates in labels.parquet.
+
+Throughput, latency percentiles and peak memory go into a versioned results
+file under `bench.results_dir`. The run fails when a metric is worse than the
+stored baseline by more than its configured tolerance, or when a quality
+metric is below its `bench.min_quality` floor.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.config import load_config
+
+RESULTS_VERSION = 1
+STAGES = ["ingestion", "embedding", "search", "consistency", "duplicates"]
+# Metric -> (kind, higher is better). Tolerances are configured per kind.
+METRICS = {
+    "rows_per_s": ("throughput", True),
+    "queries_per_s": ("throughput", True),
+    "p50_ms": ("latency", False),
+    "p95_ms": ("latency", False),
+    "p99_ms": ("latency", False),
+    "peak_rss_mb": ("memory", False),
+    "recall_at_k": ("quality", True),
+    "precision": ("quality", True),
+    "recall": ("quality", True),
+}
+DEFAULT_TOLERANCE = {"throughput": 0.25, "latency": 0.35, "memory": 0.25, "quality": 0.02}
+
+def _percentiles(seconds):
+    p50, p95, p99 = np.percentile(np.asarray(seconds) * 1000, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+# --- STAGES ---
+def bench_ingestion(data_dir, n):
+    from pipeline.ingestion import iter_arrow_chunks
+
+    latencies, rows = [], 0
+    start = time.perf_counter()
+    chunks = iter_arrow_chunks(os.path.join(data_dir, "products.csv"), chunksize=50_000)
+    while True:
+        t = time.perf_counter()
+        table = next(chunks, None)
+        if table is None:
+            break
+        latencies.append(time.perf_counter() - t)
+        rows += table.num_rows
+    return {"rows_per_s": rows / (time.perf_counter() - start), **_percentiles(latencies)}
+
+def bench_embedding(data_dir, n):
+    from pipeline.embeddings import HashingEmbedder, VectorStore, embed_texts, iter_product_batches, open_cache, _spec_text
+
+    store_dir = os.path.join(data_dir, "embeddings")
+    shutil.rmtree(store_dir, ignore_errors=True)
+    embedder = HashingEmbedder(256)
+    cache = open_cache(store_dir, embedder)
+    stores = {name: VectorStore.create(os.path.join(store_dir, name), embedder.dim) for name in ("text", "spec")}
+    latencies, rows = [], 0
+    start = time.perf_counter()
+    for batch in iter_product_batches(os.path.join(data_dir, "products.parquet"), 8192, columns=("product_id", "description", "specs")):
+        t = time.perf_counter()
+        ids = [str(r["product_id"]) for r in batch]
+        stores["text"].append(ids, embed_texts([r["description"] or "" for r in batch], embedder, cache))
+        stores["spec"].append(ids, embed_texts([_spec_text(r["specs"]) or "" for r in batch], embedder, cache))
+        latencies.append(time.perf_counter() - t)
+        rows += len(batch)
+    return {"rows_per_s": rows / (time.perf_counter() - start), **_percentiles(latencies)}
+
+def bench_search(data_dir, n, k=5, n_queries=200):
+    from pipeline.embeddings import VectorStore
+    from pipeline.vector_index import IVFIndex, recall_at_k
+
+    store = VectorStore(os.path.join(data_dir, "embeddings", "text"))
+    start = time.perf_counter()
+    index = IVFIndex.build(os.path.join(data_dir, "index"), store.ids, store.vectors)
+    build_s = time.perf_counter() - start
+    rng = np.random.default_rng(0)
+    queries = [store.ids[i] for i in rng.choice(len(store.ids), size=min(n_queries, len(store.ids)), replace=False)]
+    latencies = []
+    for pid in queries:
+        t = time.perf_counter()
+        index.search_ids([pid], k)
+        latencies.append(time.perf_counter() - t)
+    return {
+        "rows_per_s": len(store.ids) / build_s,
+        "queries_per_s": len(queries) / sum(latencies),
+        **_percentiles(latencies),
+        "recall_at_k": recall_at_k(index, store.ids, store.vectors, k, n_queries=n_queries),
+    }
+
+def bench_consistency(data_dir, n):
+    import pyarrow.parquet as pq
+
+    from pipeline.consistency import MISMATCH_SCHEMA, iter_scored_blocks
+
+    latencies, rows = [], 0
+    start = time.perf_counter()
+    blocks = iter_scored_blocks(os.path.join(data_dir, "embeddings"), 0.70, 0.85, block_rows=65_536)
+    with pq.ParquetWriter(os.path.join(data_dir, "mismatch_scores.parquet"), MISMATCH_SCHEMA) as writer:
+        while True:
+            t = time.perf_counter()
+            batch = next(blocks, None)
+            if batch is None:
+                break
+            writer.write_batch(batch)
+            latencies.append(time.perf_counter() - t)
+            rows += batch.num_rows
+    return {"rows_per_s": rows / (time.perf_counter() - start), **_percentiles(latencies)}
+
+def bench_duplicates(data_dir, n):
+    import pandas as pd
+
+    from pipeline.duplicates import DEFAULT_BLOCK_BY, DEFAULT_THRESHOLD, duplicate_roots, find_duplicate_pairs, load_block_keys, pair_quality
+    from pipeline.embeddings import VectorStore
+
+    store_path = os.path.join(data_dir, "embeddings", "text")
+    ids = VectorStore(store_path).ids
+    start = time.perf_counter()
+    keys = load_block_keys(os.path.join(data_dir, "products.parquet"), ids, DEFAULT_BLOCK_BY)
+    a, b, scores = find_duplicate_pairs(store_path, DEFAULT_THRESHOLD, keys, workers=1)
+    elapsed = time.perf_counter() - start
+    roots = duplicate_roots(pd.read_parquet(os.path.join(data_dir, "labels.parquet"), columns=["product_id", "defect", "detail"]))
+    precision, recall = pair_quality(ids, a, b, scores, roots, DEFAULT_THRESHOLD)
+    return {"rows_per_s": len(ids) / elapsed, **_percentiles([elapsed]), "precision": precision, "recall": recall}
+
+BENCHMARKS = {
+    "ingestion": bench_ingestion,
+    "embedding": bench_embedding,
+    "search": bench_search,
+    "consistency": bench_consistency,
+    "duplicates": bench_duplicates,
+}
+
+def _peak_rss_mb():
+    # VmHWM resets on exec; ru_maxrss carries the parent's peak over fork+exec.
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _run_stage(stage, data_dir, n):
+    # Runs in a freshly spawned process, so the high-water mark is this stage's own.
+    metrics = BENCHMARKS[stage](data_dir, n)
+    metrics["peak_rss_mb"] = _peak_rss_mb()
+    return metrics
+
+def run_suite(sizes, stages=STAGES, work_dir=None, seed=0):
+    """{"<stage>@<size>": metrics} for every stage and size."""
+    from scripts.generate_synthetic import generate
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix="qc-bench-")
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        for n in sizes:
+            data_dir = os.path.join(work_dir, str(n))
+            generate(data_dir, n, chunk_rows=100_000, seed=seed, formats=("parquet", "csv"), images=False)
+            for stage in stages:
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    metrics = pool.submit(_run_stage, stage, data_dir, n).result()
+                results[f"{stage}@{n}"] = metrics
+                print(f"{stage}@{n}: " + ", ".join(f"{k} {v:,.2f}" for k, v in metrics.items()))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+# --- RESULTS AND GATES ---
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def results_document(results):
+    return {
+        "version": RESULTS_VERSION,
+        "created_ts": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+
+def write_results(results_dir, doc):
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(results_dir, f"bench-{stamp}-{doc['git_commit'] or 'nogit'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+    return path
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Human-readable regressions of `results` against `baseline` results; empty means PASS."""
+    tolerance = {**DEFAULT_TOLERANCE, **(tolerance or {})}
+    failures = []
+    for key, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(key, {}).get(metric)
+            if base is None or metric not in METRICS:
+                continue
+            kind, higher_is_better = METRICS[metric]
+            tol = tolerance[kind]
+            if higher_is_better and value < base * (1 - tol):
+                failures.append(f"{key} {metric} {value:,.2f} < baseline {base:,.2f} - {tol:.0%}")
+            elif not higher_is_better and value > base * (1 + tol):
+                failures.append(f"{key} {metric} {value:,.2f} > baseline {base:,.2f} + {tol:.0%}")
+    return failures
+
+def below_floor(results, floors):
+    """Quality metrics of `results` under their absolute `floors` ({metric: minimum}), whatever the baseline says."""
+    return [
+        f"{key} {metric} {metrics[metric]:.2f} < floor {floor:.2f}"
+        for key, metrics in results.items() for metric, floor in (floors or {}).items()
+        if metric in metrics and metrics[metric] < floor
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite and gate on the stored baseline.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--sizes", nargs="*", type=int, default=None, help="Catalog sizes (default bench.sizes)")
+    parser.add_argument("--stages", nargs="*", default=STAGES, choices=STAGES)
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run's results as the new baseline")
+    args = parser.parse_args()
+    bench_cfg = load_config(args.config).get("bench", {})
+    sizes = args.sizes or bench_cfg.get("sizes", [10_000, 100_000, 1_000_000])
+    baseline_path = bench_cfg.get("baseline", "benchmarks/baseline.json")
+    results = run_suite(sizes, args.stages)
+    doc = results_document(results)
+    print(f"Results -> '{write_results(bench_cfg.get('results_dir', 'benchmarks/results'), doc)}'")
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path, encoding="utf-8") as f:
+                baseline = json.load(f)
+        doc["results"] = {**baseline.get("results", {}), **results}
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+        print(f"Baseline updated -> '{baseline_path}'")
+        return
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at '{baseline_path}'; run with --update-baseline to create one.")
+        return
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    failures = compare_to_baseline(results, baseline["results"], bench_cfg.get("tolerance")) + below_floor(results, bench_cfg.get("min_quality"))
+    if failures:
+        print("REGRESSIONS:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print(f"PASS: no regressions against baseline from {baseline.get('git_commit')} ({baseline.get('created_ts')}).")
+
+if __name__ == "__main__":
+    main()
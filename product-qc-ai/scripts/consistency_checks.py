@@ -1,37 +1,59 @@
 """
 Implement logic to detect mismatches or inconsistencies between different modalities (e.g., description vs. image embeddings).
 """
+import argparse
 import os
-from google.cloud import bigquery
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.config import load_config
+from pipeline.queries import QueryRunner
 
 PROJECT_ID = os.environ.get("BQ_PROJECT_ID", "your-gcp-project")
 DATASET = os.environ.get("BQ_DATASET", "product_qc")
-
-client = bigquery.Client(project=PROJECT_ID)
-
-def run_query(query, description):
-    print(f"Running: {description}")
-    job = client.query(query)
-    results = job.result()
-    print(f"Done: {description}\n")
-    return results
+QUERY_CACHE_DIR = os.environ.get("BQ_QUERY_CACHE_DIR", "data/processed/cache/queries")
 
 def main():
-    # Example: Flag products where text and image embeddings are not similar (low cosine similarity)
-    threshold = float(os.environ.get("CONSISTENCY_THRESHOLD", 0.3))
+    parser = argparse.ArgumentParser(description="Score text vs. image consistency in BigQuery.")
+    parser.add_argument("--config", default="config.yaml")
+    args = parser.parse_args()
+    app_cfg = load_config(args.config)["app"]
+    runner = QueryRunner(PROJECT_ID, cache_dir=QUERY_CACHE_DIR)
+    # Flag products where text and image embeddings are not similar (low cosine similarity).
+    # The cosine is computed once per row and the result is persisted to mismatch_scores.
+    # Same thresholds as the local scorer (pipeline/consistency.py), so both backends agree.
+    threshold = float(app_cfg["similarity_threshold"])
+    high_threshold = float(app_cfg["high_severity_threshold"])
     query = f"""
+    CREATE OR REPLACE TABLE `{PROJECT_ID}.{DATASET}.mismatch_scores` AS
+    WITH scored AS (
+      SELECT
+        t.product_id,
+        ML.DOT_PRODUCT(t.text_vector, i.image_vector) / (ML.NORM(t.text_vector) * ML.NORM(i.image_vector)) AS cosine_similarity
+      FROM `{PROJECT_ID}.{DATASET}.text_embeddings` t
+      JOIN `{PROJECT_ID}.{DATASET}.image_embeddings` i
+        ON t.product_id = i.product_id
+    )
     SELECT
-      t.product_id,
-      ML.DOT_PRODUCT(t.text_vector, i.image_vector) / (ML.NORM(t.text_vector) * ML.NORM(i.image_vector)) AS cosine_similarity
-    FROM `{PROJECT_ID}.{DATASET}.text_embeddings` t
-    JOIN `{PROJECT_ID}.{DATASET}.image_embeddings` i
-      ON t.product_id = i.product_id
-    WHERE ML.DOT_PRODUCT(t.text_vector, i.image_vector) / (ML.NORM(t.text_vector) * ML.NORM(i.image_vector)) < {threshold}
-    ORDER BY cosine_similarity ASC;
+      product_id,
+      cosine_similarity AS text_image_cos,
+      1 - cosine_similarity AS mismatch_score,
+      CASE
+        WHEN 1 - cosine_similarity >= {high_threshold} THEN 'high'
+        WHEN cosine_similarity < {threshold} THEN 'medium'
+        ELSE 'none'
+      END AS severity,
+      CURRENT_TIMESTAMP() AS scored_ts
+    FROM scored;
     """
-    results = run_query(query, "Consistency check: text vs. image embeddings")
-    for row in results:
-        print(row)
+    runner.run(query, "Consistency check: text vs. image embeddings")
+    # Cached until mismatch_scores is rewritten.
+    summary = runner.read(
+        f"SELECT severity, COUNT(*) AS n FROM `{PROJECT_ID}.{DATASET}.mismatch_scores` GROUP BY severity ORDER BY severity",
+        "Mismatch summary",
+    )
+    for row in summary.to_pylist():
+        print(f"{row['severity']}: {row['n']}")
 
 if __name__ == "__main__":
     main()
@@ -11,6 +11,8 @@ TABLES = [
             bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
             bigquery.SchemaField("description", "STRING"),
             bigquery.SchemaField("text_vector", "FLOAT64", mode="REPEATED"),
+            bigquery.SchemaField("content_fp", "INT64"),
+            bigquery.SchemaField("is_deleted", "BOOL"),
             bigquery.SchemaField("embed_ts", "TIMESTAMP"),
         ],
     },
@@ -20,6 +22,8 @@ TABLES = [
             bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
             bigquery.SchemaField("image_gcs_uri", "STRING"),
             bigquery.SchemaField("image_vector", "FLOAT64", mode="REPEATED"),
+            bigquery.SchemaField("content_fp", "INT64"),
+            bigquery.SchemaField("is_deleted", "BOOL"),
             bigquery.SchemaField("embed_ts", "TIMESTAMP"),
         ],
     },
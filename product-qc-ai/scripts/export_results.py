@@ -1 +1,326 @@
-# Export flagged records
+"""
+Export flagged records for downstream teams: one row per flagged product and proposed
+correction, with its mismatch score, written as files partitioned by category and severity.
+
+- Rows arrive as a stream of Arrow batches: BigQuery result pages, or batches
+  of the local warehouse tables joined to narrow lookups of products, scores
+  and corrections.
+- Each partition (`category=<c>/severity=<s>/`) buffers rows up to one row
+  group. The total across partitions is capped at `max_buffered_rows`, so
+  memory stays flat however large the export is.
+- Files are compressed Parquet (`compression`), or gzipped JSONL / CSV, and
+  roll to a new part at `target_file_mb`. Parts are written under a dot-name
+  and renamed when complete.
+- `_watermark.json` in the output directory records the latest change
+  (verdict, score or correction) exported. The next run only exports rows changed
+  after it, and `--full` exports everything.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.config import load_config
+from pipeline.metrics import open_tracer
+from pipeline.queries import QueryRunner
+from pipeline.warehouse import BigQueryWarehouse, open_warehouse, products_path
+
+EXPORT_SCHEMA = pa.schema([
+    ("product_id", pa.string()),
+    ("category", pa.string()),
+    ("brand", pa.string()),
+    ("severity", pa.string()),
+    ("mismatch_score", pa.float32()),
+    ("tier", pa.string()),
+    ("reasons", pa.string()),
+    ("field", pa.string()),
+    ("original_value", pa.string()),
+    ("corrected_value", pa.string()),
+    ("confidence", pa.float64()),
+    ("status", pa.string()),
+    ("changed_ts", pa.timestamp("us", tz="UTC")),
+])
+PARTITION_KEYS = ["category", "severity"]
+FORMATS = {"parquet": ".parquet", "jsonl": ".jsonl.gz", "csv": ".csv.gz"}
+WATERMARK_FILE = "_watermark.json"
+
+# --- WATERMARK ---
+def read_watermark(out_dir):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return datetime.fromisoformat(json.load(f)["changed_ts"])
+
+def write_watermark(out_dir, changed_ts, export_id, rows):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"changed_ts": changed_ts.isoformat(), "export_id": export_id, "rows": rows}, f)
+    os.replace(path + ".tmp", path)
+
+# --- FILES ---
+class _PartFile:
+    """One output file; rows are appended as Arrow tables and `size` is the bytes on disk so far."""
+
+    def __init__(self, path, fmt, schema, compression):
+        self.tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+        self.path = path
+        self.fmt = fmt
+        self.sink = pa.OSFile(self.tmp, "wb")
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(self.sink, schema, compression=compression)
+        else:
+            self.stream = pa.CompressedOutputStream(self.sink, "gzip")
+            self.writer = pacsv.CSVWriter(self.stream, schema) if fmt == "csv" else None
+        self.rows = 0
+
+    def write(self, table):
+        if self.fmt == "jsonl":
+            lines = "".join(json.dumps(row, default=str) + "\n" for row in table.to_pylist())
+            self.stream.write(lines.encode("utf-8"))
+        else:
+            self.writer.write_table(table)
+        self.rows += table.num_rows
+
+    @property
+    def size(self):
+        return self.sink.tell()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.fmt != "parquet":
+            self.stream.close()
+        self.sink.close()
+        os.replace(self.tmp, self.path)
+        return os.path.getsize(self.path)
+
+def _path_value(value):
+    return re.sub(r"[^\w.-]+", "_", value) or "unknown"
+
+class PartitionedWriter:
+    """Splits batches by PARTITION_KEYS, buffers them per partition and rolls files at `target_bytes`."""
+
+    def __init__(self, out_dir, fmt="parquet", compression="zstd", target_bytes=128 << 20,
+                 row_group_rows=65_536, max_buffered_rows=262_144, schema=EXPORT_SCHEMA, export_id=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}'. Choose {', '.join(FORMATS)}.")
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.compression = compression
+        self.target_bytes = target_bytes
+        self.row_group_rows = row_group_rows
+        self.max_buffered_rows = max_buffered_rows
+        self.schema = schema
+        self.export_id = export_id or uuid.uuid4().hex[:12]
+        self.buffers = {}  # partition -> [tables]
+        self.buffered = {}  # partition -> rows
+        self.open = {}  # partition -> _PartFile
+        self.parts = {}  # partition -> files started
+        self.files = []
+        self.stats = {"rows": 0, "files": 0, "bytes": 0}
+
+    def write(self, table):
+        table = table.select(self.schema.names).cast(self.schema)
+        keys = pc.binary_join_element_wise(*(pc.fill_null(table[k], "") for k in PARTITION_KEYS), "\x1f")
+        encoded = pc.dictionary_encode(keys).combine_chunks()
+        codes = encoded.indices.to_numpy()
+        order = np.argsort(codes, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(encoded.dictionary)))])
+        table = table.take(pa.array(order))
+        for i, key in enumerate(encoded.dictionary.to_pylist()):
+            if bounds[i + 1] > bounds[i]:
+                self._buffer(tuple(key.split("\x1f")), table.slice(bounds[i], bounds[i + 1] - bounds[i]))
+        while sum(self.buffered.values()) > self.max_buffered_rows:
+            self._flush(max(self.buffered, key=self.buffered.get))
+
+    def _buffer(self, partition, table):
+        self.buffers.setdefault(partition, []).append(table)
+        self.buffered[partition] = self.buffered.get(partition, 0) + table.num_rows
+        if self.buffered[partition] >= self.row_group_rows:
+            self._flush(partition)
+
+    def _flush(self, partition):
+        table = pa.concat_tables(self.buffers.pop(partition)).combine_chunks()
+        del self.buffered[partition]
+        part = self.open.get(partition)
+        if part is None:
+            part = self.open[partition] = self._start(partition)
+        part.write(table)
+        self.stats["rows"] += table.num_rows
+        if part.size >= self.target_bytes:
+            self._finish(partition)
+
+    def _start(self, partition):
+        directory = os.path.join(self.out_dir, *(f"{k}={_path_value(v)}" for k, v in zip(PARTITION_KEYS, partition)))
+        os.makedirs(directory, exist_ok=True)
+        seq = self.parts[partition] = self.parts.get(partition, 0) + 1
+        path = os.path.join(directory, f"part-{self.export_id}-{seq:05d}{FORMATS[self.fmt]}")
+        return _PartFile(path, self.fmt, self.schema, self.compression)
+
+    def _finish(self, partition):
+        part = self.open.pop(partition)
+        self.stats["bytes"] += part.close()
+        self.stats["files"] += 1
+        self.files.append(part.path)
+
+    def close(self):
+        for partition in list(self.buffers):
+            self._flush(partition)
+        for partition in list(self.open):
+            self._finish(partition)
+        return self.stats
+
+# --- SOURCES ---
+EXPORT_SQL = """
+SELECT
+  v.product_id,
+  p.category,
+  p.brand,
+  IFNULL(m.severity, 'unscored') AS severity,
+  m.mismatch_score,
+  v.tier,
+  v.reasons,
+  c.field,
+  c.original_value,
+  c.corrected_value,
+  c.confidence,
+  c.status,
+  (SELECT MAX(ts) FROM UNNEST([v.validated_ts, m.scored_ts, c.corrected_ts]) AS ts) AS changed_ts
+FROM `{validations}` v
+JOIN `{products}` p USING (product_id)
+LEFT JOIN `{mismatches}` m USING (product_id)
+LEFT JOIN `{corrections}` c USING (product_id)
+WHERE NOT v.is_consistent
+"""
+
+def bigquery_batches(warehouse, runner, since=None, page_size=50_000):
+    """Flagged rows joined in BigQuery and streamed page by page."""
+    sql = EXPORT_SQL.format(**{key: warehouse.table_id(key) for key in ("validations", "products", "mismatches", "corrections")})
+    if since is not None:
+        # Rows with no timestamp at all cannot be placed before the watermark, so they count as changed.
+        sql = f"SELECT * FROM ({sql}) WHERE changed_ts IS NULL OR changed_ts > TIMESTAMP '{since.isoformat(sep=' ')}'"
+    yield from runner.stream(sql, "Export flagged records", page_size=page_size)
+
+_TS = pa.timestamp("us", tz="UTC")
+# A row changes when its verdict, its score or one of its corrections does.
+_CHANGE_COLUMNS = ["validated_ts", "scored_ts", "corrected_ts"]
+# Columns a local batch needs before changed_ts is derived; tables that do not exist yet leave them null.
+_SOURCE_FIELDS = [f for f in EXPORT_SCHEMA if f.name != "changed_ts"] + [pa.field(c, _TS) for c in _CHANGE_COLUMNS]
+
+def _keyed(table):
+    # Join keys must share a type; tables written from pandas may carry large_string ids.
+    return table.set_column(table.column_names.index("product_id"), "product_id", table["product_id"].cast(pa.string()))
+
+def _lookup(warehouse, key, columns):
+    return _keyed(warehouse.read(key, columns=columns)) if warehouse.exists(key) else None
+
+def local_batches(warehouse, products, since=None, batch_rows=65_536):
+    """Flagged validation rows, batch by batch, joined to narrow product / score / correction lookups.
+
+    `products` holds product_id, category and brand. Only the lookups' few
+    columns are held in memory; the exported rows are never collected.
+    """
+    scores = _lookup(warehouse, "mismatches", ["product_id", "mismatch_score", "severity", "scored_ts"])
+    corrections = _lookup(warehouse, "corrections", ["product_id", "field", "original_value", "corrected_value", "confidence", "status", "corrected_ts"])
+    # Products and scores are one row per product: hash the ids once and gather by position per batch.
+    lookup = products.join(scores, "product_id", join_type="left outer") if scores is not None else products
+    positions = pd.Index(lookup["product_id"].to_numpy(zero_copy_only=False))
+    lookup = lookup.drop_columns(["product_id"])
+    columns = ["product_id", "is_consistent", "tier", "reasons"]
+    # Validation results written before verdicts were stamped have no validated_ts.
+    if "validated_ts" in ds.dataset(warehouse.table_id("validations"), format="parquet").schema.names:
+        columns.append("validated_ts")
+    for batch in warehouse.scan("validations", columns=columns, batch_size=batch_rows):
+        flagged = _keyed(pa.Table.from_batches([batch]).filter(pc.equal(batch["is_consistent"], False)).drop_columns(["is_consistent"]))
+        pos = positions.get_indexer(flagged["product_id"].to_numpy(zero_copy_only=False))
+        rows = flagged.filter(pa.array(pos >= 0))
+        matched = lookup.take(pa.array(pos[pos >= 0]))
+        for name in matched.column_names:
+            rows = rows.append_column(name, matched[name])
+        rows = rows.join(corrections, "product_id", join_type="left outer") if corrections is not None else rows
+        for field in _SOURCE_FIELDS:
+            if field.name not in rows.column_names:
+                rows = rows.append_column(field, pa.nulls(rows.num_rows, field.type))
+        # As epoch microseconds: max_element_wise has no zoned-timestamp kernel.
+        changed = pc.max_element_wise(*(rows[c].cast(_TS).cast(pa.int64()) for c in _CHANGE_COLUMNS))
+        rows = rows.append_column("changed_ts", changed.cast(_TS))
+        rows = rows.set_column(rows.column_names.index("severity"), "severity", pc.fill_null(rows["severity"], "unscored"))
+        if since is not None:
+            # Rows with no timestamp at all cannot be placed before the watermark, so they count as changed.
+            rows = rows.filter(pc.fill_null(pc.greater(rows["changed_ts"], pa.scalar(since, _TS)), True))
+        if rows.num_rows:
+            yield rows.select(EXPORT_SCHEMA.names)
+
+# --- EXPORT ---
+def export(batches, writer, since=None):
+    """Drain `batches` into `writer`; returns stats with the latest changed_ts seen."""
+    start = time.perf_counter()
+    latest = since
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        newest = pc.max(batch["changed_ts"]).as_py()
+        if newest is not None and (latest is None or newest > latest):
+            latest = newest
+        writer.write(batch)
+    stats = writer.close()
+    seconds = time.perf_counter() - start
+    return {**stats, "seconds": seconds, "rows_per_s": stats["rows"] / seconds if seconds else 0.0, "changed_ts": latest}
+
+def main():
+    parser = argparse.ArgumentParser(description="Export flagged records as partitioned, compressed files.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--local", action="store_true", help="Read the local warehouse")
+    parser.add_argument("--format", choices=list(FORMATS), default=None)
+    parser.add_argument("--output", default=None, help="Output directory")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and export every flagged row")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    ex_cfg = cfg.get("export", {})
+    out_dir = args.output or ex_cfg.get("output_dir", "data/exports/flagged")
+    os.makedirs(out_dir, exist_ok=True)
+    since = None if args.full else read_watermark(out_dir)
+    batch_rows = ex_cfg.get("batch_rows", 65_536)
+    warehouse = open_warehouse(cfg, local=args.local)
+    with open_tracer(cfg, local=args.local) as tracer:
+        writer = PartitionedWriter(
+            out_dir, args.format or ex_cfg.get("format", "parquet"), ex_cfg.get("compression", "zstd"),
+            int(ex_cfg.get("target_file_mb", 128) * (1 << 20)), batch_rows, ex_cfg.get("max_buffered_rows", 262_144),
+        )
+        with tracer.span("export", format=writer.fmt, incremental=since is not None) as span:
+            if isinstance(warehouse, BigQueryWarehouse):
+                runner = QueryRunner(warehouse.project, client=warehouse.client, tracer=tracer)
+                batches = bigquery_batches(warehouse, runner, since, page_size=batch_rows)
+            else:
+                # The processed catalog when products were never loaded into the local warehouse.
+                columns = ["product_id", "category", "brand"]
+                products = _lookup(warehouse, "products", columns)
+                if products is None:
+                    products = _keyed(ds.dataset(products_path(cfg, local=args.local), format="parquet").to_table(columns=columns))
+                batches = local_batches(warehouse, products, since, batch_rows)
+            stats = export(batches, writer, since)
+            span.add(rows_out=stats["rows"], files=stats["files"], bytes_written=stats["bytes"])
+    if stats["changed_ts"] is not None and stats["rows"]:
+        write_watermark(out_dir, stats["changed_ts"], writer.export_id, stats["rows"])
+    scope = f"changed after {since.isoformat()}" if since else "all flagged"
+    print(
+        f"Exported {stats['rows']:,} rows ({scope}) to {stats['files']} {writer.fmt} files, "
+        f"{stats['bytes'] / (1 << 20):.1f} MiB in {stats['seconds']:.1f}s ({stats['rows_per_s']:,.0f} rows/s) -> {out_dir}"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,373 @@
 # Script for stress-test dataset
+"""
+Seeded, vectorized generator of synthetic catalogs for load and accuracy tests.
+
+Writes products chunk by chunk, in the products schema
+(`pipeline.ingestion.ARROW_SCHEMA` / `setup_products_table.SCHEMA`) for
+Parquet and JSONL, or as the raw export `load_and_normalize` reads for CSV
+(common fields plus one column per spec attribute). Includes reviews, spec
+blobs and one small PPM image per product.
+
+Defects are injected at configurable rates and written to `labels.parquet`
+(product_id, defect, detail), so the pipeline's detections can be scored
+against ground truth:
+- title_spec_contradiction: a spec value disagrees with the title,
+- wrong_category: the category does not match the product,
+- duplicate: a re-listing of an earlier product under a new id,
+- image_mismatch: the image shows another colour/category.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.config import load_config
+from pipeline.ingestion import ARROW_SCHEMA, COMMON_FIELDS, IMAGE_REF_TYPE, OUT_COLS
+from pipeline.warehouse import open_warehouse
+
+# --- CONFIG ---
+OUT_DIR = os.path.join("data", "synthetic")
+N_PRODUCTS = 100_000
+CHUNK_ROWS = 100_000
+SEED = 42
+IMAGE_SIZE = 32
+DEFECT_RATES = {
+    "title_spec_contradiction": 0.03,
+    "wrong_category": 0.02,
+    "duplicate": 0.02,
+    "image_mismatch": 0.02,
+}
+DEFECTS = list(DEFECT_RATES)
+
+BRANDS = np.array(["acme", "globex", "initech", "umbrella", "hooli", "stark", "wayne", "wonka", "tyrell", "cyberdyne"], dtype=object)
+COLOURS = np.array(["black", "white", "red", "blue", "green", "silver", "gold", "pink"], dtype=object)
+COLOUR_RGB = np.array([[20, 20, 20], [235, 235, 235], [200, 30, 30], [30, 60, 200], [30, 160, 60], [190, 190, 200], [210, 170, 40], [240, 130, 180]], dtype=np.float32)
+# (category, noun, spec key, values, unit)
+CATEGORIES = [
+    ("electronics>laptops", "laptop", "screen_size", [13, 14, 15, 16], "inch"),
+    ("electronics>monitors", "monitor", "screen_size", [24, 27, 32, 34], "inch"),
+    ("electronics>phones", "phone", "capacity", [64, 128, 256, 512], "gb"),
+    ("electronics>storage", "ssd", "capacity", [1, 2, 4, 8], "tb"),
+    ("home>kitchen", "blender", "wattage", [500, 800, 1000, 1200], "w"),
+    ("home>cleaning", "vacuum", "wattage", [600, 900, 1400, 2000], "w"),
+]
+CAT_NAMES = np.array([c[0] for c in CATEGORIES], dtype=object)
+CAT_NOUNS = np.array([c[1] for c in CATEGORIES], dtype=object)
+CAT_KEYS = np.array([c[2] for c in CATEGORIES], dtype=object)
+CAT_UNITS = np.array([c[4] for c in CATEGORIES], dtype=object)
+CAT_VALUES = np.array([c[3] for c in CATEGORIES])
+SPEC_KEYS = sorted(set(CAT_KEYS))
+# Description wording is drawn per product: opening template, adjective, a
+# category feature line and a closing blurb, so unrelated listings rarely
+# share more than their attributes.
+ADJECTIVES = np.array(["compact", "sleek", "powerful", "reliable", "versatile", "premium", "affordable", "quiet", "durable", "modern"], dtype=object)
+FEATURES = [  # per category, same order as CATEGORIES
+    ["a backlit keyboard makes late work easy.", "the aluminium chassis stays cool under load.", "all day battery life keeps you going.", "fast charging gets you back to work in minutes."],
+    ["thin bezels suit multi screen setups.", "the stand tilts and swivels.", "flicker free backlight is easy on the eyes.", "built in speakers save desk space."],
+    ["the triple camera shoots sharp photos at night.", "a bright oled display works in sunlight.", "the battery lasts two days.", "water resistance covers rain and splashes."],
+    ["read speeds reach 3500 mb/s.", "hardware encryption protects your files.", "a five year endurance rating is included.", "works with consoles and pcs alike."],
+    ["stainless steel blades crush ice.", "the glass jug is dishwasher safe.", "six speeds and a pulse mode cover every recipe.", "a vacuum sealed lid keeps smoothies fresh."],
+    ["the hepa filter traps fine dust.", "a long cord reaches every room.", "the brush roll untangles hair by itself.", "it switches between carpet and hard floor modes."],
+]
+FEATURE_TEXT = np.array(FEATURES, dtype=object)
+BLURBS = np.array([
+    "built to last with a two year warranty.",
+    "a customer favourite for everyday use.",
+    "ships in recyclable packaging.",
+    "lightweight and easy to set up.",
+    "free returns within thirty days.",
+    "order today for next day delivery.",
+    "backed by our price match promise.",
+    "rated highly by thousands of buyers.",
+    "includes everything you need in the box.",
+    "",
+], dtype=object)
+MODEL_LETTERS = np.array(list("abcdefghjkmnprstvwxz"), dtype=object)
+REVIEW_HEADS = np.array(["great", "solid", "disappointing", "decent", "excellent"], dtype=object)
+REVIEW_TAILS = np.array([" for the price.", ", would buy again.", ", the finish looks cheap.", ", arrived quickly."], dtype=object)
+
+# --- GENERATION ---
+def _cat(*parts):
+    out = parts[0]
+    for part in parts[1:]:
+        out = out + part
+    return out
+
+def _describe(template, brand, noun, colour, value, model, adjective, feature, blurb):
+    """Product descriptions from one of several opening templates, chosen per row."""
+    openings = [
+        _cat("the ", brand, " ", noun, " comes in ", colour, " with ", value, ". "),
+        _cat(brand, " ", model, ": a ", adjective, " ", colour, " ", noun, " with ", value, ". "),
+        _cat("meet the ", adjective, " ", noun, " from ", brand, ", now with ", value, " and a ", colour, " finish. "),
+        _cat("this ", colour, " ", noun, " by ", brand, " offers ", value, " in a ", adjective, " design. "),
+        _cat(value, ", ", colour, ", ", adjective, ". the ", model, " is ", brand, "'s latest ", noun, ". "),
+        _cat("looking for a ", adjective, " ", noun, "? the ", brand, " ", model, " pairs ", value, " with a ", colour, " body. "),
+    ]
+    opening = np.choose(template, openings)
+    return np.char.strip(_cat(opening, feature, " ", blurb).astype(str)).astype(object)
+
+def generate_chunk(start, n, seed, defect_rates):
+    """One chunk of `n` products with ids start..start+n-1.
+
+    Returns (fields DataFrame, (review owner rows, review texts, reviews per
+    product), labels DataFrame, image params). Every chunk draws from its own
+    stream seeded by (seed, start).
+    """
+    rng = np.random.default_rng([seed, start])
+    brand = rng.integers(0, len(BRANDS), n)
+    cat = rng.integers(0, len(CATEGORIES), n)
+    colour = rng.integers(0, len(COLOURS), n)
+    value = CAT_VALUES[cat, rng.integers(0, CAT_VALUES.shape[1], n)]
+    rates = np.array([defect_rates.get(d, 0.0) for d in DEFECTS])
+    defect = rng.choice(len(DEFECTS) + 1, size=n, p=np.append(rates, 1 - rates.sum()))
+    is_defect = {name: defect == i for i, name in enumerate(DEFECTS)}
+    detail = np.full(n, None, dtype=object)
+
+    # Specs agree with the title unless the row is a contradiction.
+    spec_colour, spec_value, cat_label = colour.copy(), value.copy(), cat.copy()
+    rows = np.nonzero(is_defect["title_spec_contradiction"])[0]
+    on_colour = rng.random(len(rows)) < 0.5
+    spec_colour[rows[on_colour]] = (colour[rows[on_colour]] + rng.integers(1, len(COLOURS), on_colour.sum())) % len(COLOURS)
+    vrows = rows[~on_colour]
+    shift = rng.integers(1, CAT_VALUES.shape[1], len(vrows))
+    current = np.argmax(CAT_VALUES[cat[vrows]] == value[vrows, None], axis=1)
+    spec_value[vrows] = CAT_VALUES[cat[vrows], (current + shift) % CAT_VALUES.shape[1]]
+    detail[rows] = np.where(on_colour, "colour", CAT_KEYS[cat[rows]])
+
+    rows = np.nonzero(is_defect["wrong_category"])[0]
+    cat_label[rows] = (cat[rows] + rng.integers(1, len(CATEGORIES), len(rows))) % len(CATEGORIES)
+    detail[rows] = CAT_NAMES[cat[rows]]
+
+    img_colour, img_cat = colour.copy(), cat.copy()
+    rows = np.nonzero(is_defect["image_mismatch"])[0]
+    img_colour[rows] = (colour[rows] + rng.integers(1, len(COLOURS), len(rows))) % len(COLOURS)
+    img_cat[rows] = (cat[rows] + rng.integers(1, len(CATEGORIES), len(rows))) % len(CATEGORIES)
+    detail[rows] = COLOURS[img_colour[rows]]
+    image_seed = rng.integers(0, 2**31, n)
+    image_src = np.arange(n)
+    template = rng.integers(0, 6, n)
+    adjective = rng.integers(0, len(ADJECTIVES), n)
+    feature = rng.integers(0, FEATURE_TEXT.shape[1], n)
+    model = _cat(MODEL_LETTERS[rng.integers(0, len(MODEL_LETTERS), n)], MODEL_LETTERS[rng.integers(0, len(MODEL_LETTERS), n)], rng.integers(100, 1000, n).astype(str).astype(object))
+
+    # Duplicates re-list an earlier product of the chunk under the same title and
+    # description wording (only the closing blurb is redrawn), reusing its image file.
+    ids = _cat(np.full(n, "SYN", dtype=object), np.char.zfill(np.arange(start, start + n).astype(str), 9).astype(object))
+    rows = np.nonzero(is_defect["duplicate"] & (np.arange(n) > 0))[0]
+    src = (rng.random(len(rows)) * rows).astype(np.int64)
+    for arr in (brand, cat, colour, value, spec_colour, spec_value, cat_label, img_colour, img_cat, image_seed, template, adjective, feature, model):
+        arr[rows] = arr[src]
+    image_src[rows] = src
+    detail[rows] = ids[src]
+    defect[is_defect["duplicate"] & (np.arange(n) == 0)] = len(DEFECTS)  # the first row has nothing to copy
+
+    value_str = _cat(value.astype(str).astype(object), " ", CAT_UNITS[cat])
+    spec_value_str = _cat(spec_value.astype(str).astype(object), " ", CAT_UNITS[cat])
+    noun = CAT_NOUNS[cat]
+    fields = pd.DataFrame({
+        "product_id": ids,
+        "sku": _cat(np.full(n, "SKU-", dtype=object), rng.integers(16**7, 16**8, n).astype(str).astype(object)),
+        "brand": BRANDS[brand],
+        "category": CAT_NAMES[cat_label],
+        "title": _cat(BRANDS[brand], " ", model, " ", value_str, " ", COLOURS[colour], " ", noun),
+        "description": _describe(
+            template, BRANDS[brand], noun, COLOURS[colour], value_str, model, ADJECTIVES[adjective],
+            FEATURE_TEXT[cat, feature], BLURBS[rng.integers(0, len(BLURBS), n)],
+        ),
+        "price": np.round(rng.lognormal(4 + cat * 0.3, 0.4), 2),
+        "rating": np.round(rng.uniform(1, 5, n), 1),
+        "colour": COLOURS[spec_colour],
+        "spec_key": CAT_KEYS[cat],
+        "spec_value": spec_value_str,
+    })
+    n_reviews = rng.integers(0, 4, n)
+    owner = np.repeat(np.arange(n), n_reviews)
+    reviews = _cat(REVIEW_HEADS[rng.integers(0, len(REVIEW_HEADS), len(owner))], " ", noun[owner], REVIEW_TAILS[rng.integers(0, len(REVIEW_TAILS), len(owner))])
+    fields["review_count"] = n_reviews + rng.poisson(20, n)
+    labels = pd.DataFrame({
+        "product_id": ids,
+        "defect": np.append(np.array(DEFECTS, dtype=object), None)[defect],
+        "detail": detail,
+    })
+    labels.loc[labels["defect"].isna(), "detail"] = None
+    images = {"colour": img_colour, "cat": img_cat, "seed": image_seed, "src": image_src}
+    return fields, (owner, reviews, n_reviews), labels, images
+
+def render_images(images, size, rows=None):
+    """(n, size, size, 3) uint8 images: colour tint times a per-category pattern plus seeded noise."""
+    rows = np.arange(len(images["colour"])) if rows is None else rows
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / max(size - 1, 1)
+    patterns = np.stack([xx, yy, (xx + yy) / 2, 1 - xx, 1 - yy, np.abs(xx - yy)])  # one per category
+    shade = 0.55 + 0.45 * patterns[images["cat"][rows]]
+    base = COLOUR_RGB[images["colour"][rows]][:, None, None, :] * shade[..., None]
+    noise = np.random.default_rng(int(images["seed"][rows[0]]) if len(rows) else 0).normal(0, 8, base.shape)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+def write_images(image_dir, ids, images, size, batch=4096):
+    """One binary PPM per product under image_dir/<product_id>/0.ppm; returns their paths.
+
+    Duplicate listings point at the image file of the product they copy.
+    """
+    header = b"P6\n%d %d\n255\n" % (size, size)
+    paths = np.empty(len(ids), dtype=object)
+    for lo in range(0, len(ids), batch):
+        rows = np.arange(lo, min(lo + batch, len(ids)))
+        src = images["src"][rows]
+        copies = rows[src != rows]
+        rows = rows[src == rows]
+        pixels = render_images(images, size, rows)
+        for i, px in zip(rows, pixels):
+            product_dir = os.path.join(image_dir, ids[i])
+            os.makedirs(product_dir, exist_ok=True)
+            paths[i] = os.path.join(product_dir, "0.ppm")
+            with open(paths[i], "wb") as f:
+                f.write(header + px.tobytes())
+        paths[copies] = paths[images["src"][copies]]
+    return paths
+
+# --- OUTPUT ---
+def _specs_json(fields):
+    return _cat('{"colour": "', fields["colour"].to_numpy(), '", "', fields["spec_key"].to_numpy(), '": "', fields["spec_value"].to_numpy(), '"}')
+
+def to_arrow(fields, reviews, image_paths, ingest_ts):
+    """Products in ARROW_SCHEMA (the BigQuery products schema)."""
+    n = len(fields)
+    owner, texts, n_reviews = reviews
+    columns = {c: pa.array(fields[c].to_numpy(), type=ARROW_SCHEMA.field(c).type) for c in COMMON_FIELDS}
+    columns["specs"] = pa.array(_specs_json(fields), type=pa.string())
+    offsets = np.concatenate([[0], np.cumsum(n_reviews)]).astype(np.int32)
+    columns["reviews"] = pa.ListArray.from_arrays(pa.array(offsets), pa.array(texts, type=pa.string()))
+    if image_paths is None:
+        columns["image_refs"] = pa.ListArray.from_arrays(pa.array(np.zeros(n + 1, dtype=np.int32)), pa.array([], type=IMAGE_REF_TYPE))
+    else:
+        refs = pa.StructArray.from_arrays([pa.nulls(n, pa.string()), pa.array(image_paths, type=pa.string())], fields=list(IMAGE_REF_TYPE))
+        columns["image_refs"] = pa.ListArray.from_arrays(pa.array(np.arange(n + 1, dtype=np.int32)), refs)
+    columns["ingest_ts"] = pa.array(np.full(n, np.datetime64(ingest_ts.replace(tzinfo=None), "us")), type=ARROW_SCHEMA.field("ingest_ts").type)
+    return pa.table([columns[c] for c in OUT_COLS], schema=ARROW_SCHEMA)
+
+def to_raw_csv_frame(fields):
+    """The raw export shape `load_and_normalize` packs: common fields plus one column per spec key."""
+    out = fields[[c for c in COMMON_FIELDS if c in fields.columns]].copy()
+    out["colour"] = fields["colour"]
+    for key in SPEC_KEYS:
+        out[key] = fields["spec_value"].where(fields["spec_key"] == key)
+    return out
+
+class ChunkWriters:
+    """Appends chunks to products.{parquet,jsonl,csv} and labels.parquet under out_dir."""
+
+    def __init__(self, out_dir, formats):
+        self.out_dir = out_dir
+        self.formats = formats
+        self.parquet = None
+        self.labels = None
+        self.first = True
+        os.makedirs(out_dir, exist_ok=True)
+        for fmt in ("jsonl", "csv"):
+            path = self.path(fmt)
+            if fmt in formats and os.path.exists(path):
+                os.remove(path)
+
+    def path(self, fmt):
+        return os.path.join(self.out_dir, f"products.{fmt}")
+
+    def write(self, table, fields, labels):
+        if "parquet" in self.formats:
+            if self.parquet is None:
+                self.parquet = pq.ParquetWriter(self.path("parquet"), ARROW_SCHEMA, compression="snappy")
+            self.parquet.write_table(table)
+        if "jsonl" in self.formats:
+            df = table.to_pandas()
+            df["ingest_ts"] = df["ingest_ts"].dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            df.to_json(self.path("jsonl"), orient="records", lines=True, mode="a")
+        if "csv" in self.formats:
+            to_raw_csv_frame(fields).to_csv(self.path("csv"), mode="a", header=self.first, index=False)
+        label_table = pa.Table.from_pandas(labels, preserve_index=False, schema=LABEL_SCHEMA)
+        if self.labels is None:
+            self.labels = pq.ParquetWriter(os.path.join(self.out_dir, "labels.parquet"), LABEL_SCHEMA)
+        self.labels.write_table(label_table)
+        self.first = False
+
+    def close(self):
+        for writer in (self.parquet, self.labels):
+            if writer is not None:
+                writer.close()
+
+LABEL_SCHEMA = pa.schema([("product_id", pa.string()), ("defect", pa.string()), ("detail", pa.string())])
+
+def generate(out_dir, n_products, chunk_rows=CHUNK_ROWS, seed=SEED, formats=("parquet",), defect_rates=None, images=True, image_size=IMAGE_SIZE, image_dir=None):
+    """Generate the whole catalog; returns counts and throughput.
+
+    Images go to `image_dir` (default `<out_dir>/images`).
+    """
+    defect_rates = DEFECT_RATES if defect_rates is None else defect_rates
+    writers = ChunkWriters(out_dir, formats)
+    image_dir = image_dir or os.path.join(out_dir, "images")
+    ingest_ts = datetime.now(timezone.utc)
+    counts = dict.fromkeys(DEFECTS, 0)
+    start_time = time.perf_counter()
+    image_s = 0.0
+    try:
+        for start in range(0, n_products, chunk_rows):
+            n = min(chunk_rows, n_products - start)
+            fields, reviews, labels, image_params = generate_chunk(start, n, seed, defect_rates)
+            paths = None
+            if images:
+                t = time.perf_counter()
+                paths = write_images(image_dir, fields["product_id"].to_numpy(), image_params, image_size)
+                image_s += time.perf_counter() - t
+            writers.write(to_arrow(fields, reviews, paths, ingest_ts), fields, labels)
+            for name, k in labels["defect"].value_counts().items():
+                counts[name] += int(k)
+            print(f"Chunk {start // chunk_rows + 1}: {start + n:,} / {n_products:,} products")
+    finally:
+        writers.close()
+    elapsed = time.perf_counter() - start_time
+    return {"products": n_products, "defects": counts, "seconds": elapsed, "rows_per_s": n_products / elapsed if elapsed else 0.0, "image_seconds": image_s}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a seeded synthetic catalog with labelled defects.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--n", type=int, default=None, help="Number of products")
+    parser.add_argument("--formats", nargs="*", default=None, choices=["parquet", "jsonl", "csv"])
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--no-images", action="store_true")
+    parser.add_argument("--no-load", action="store_true", help="Only write files under --out; do not replace the warehouse products table")
+    parser.add_argument("--local", action="store_true", help="Load into the local warehouse whatever warehouse.backend says")
+    args = parser.parse_args()
+    cfg = load_config(args.config) if os.path.exists(args.config) else {}
+    syn_cfg = cfg.get("synthetic", {})
+    out_dir = args.out or syn_cfg.get("out_dir", OUT_DIR)
+    formats = args.formats or syn_cfg.get("formats", ["parquet"])
+    if not args.no_load and "parquet" not in formats:
+        formats = [*formats, "parquet"]  # the file the warehouse load copies
+    stats = generate(
+        out_dir,
+        args.n or syn_cfg.get("n_products", N_PRODUCTS),
+        chunk_rows=syn_cfg.get("chunk_rows", CHUNK_ROWS),
+        seed=syn_cfg.get("seed", SEED),
+        formats=formats,
+        defect_rates={**DEFECT_RATES, **syn_cfg.get("defect_rates", {})},
+        images=not args.no_images and syn_cfg.get("images", True),
+        image_size=syn_cfg.get("image_size", IMAGE_SIZE),
+        # Where `make embed-images` looks for them.
+        image_dir=syn_cfg.get("images_dir") or cfg.get("embeddings", {}).get("images", {}).get("root"),
+    )
+    defects = ", ".join(f"{k} {v:,}" for k, v in stats["defects"].items())
+    print(f"Generated {stats['products']:,} products in {stats['seconds']:.1f}s ({stats['rows_per_s']:,.0f} rows/s; images {stats['image_seconds']:.1f}s)")
+    print(f"Injected defects: {defects}; labels in '{os.path.join(out_dir, 'labels.parquet')}'")
+    if not args.no_load:
+        # The table every offline stage reads by default (see pipeline.warehouse.products_path).
+        warehouse = open_warehouse(cfg, local=args.local)
+        rows = warehouse.load_parquet("products", os.path.join(out_dir, "products.parquet"))
+        print(f"Loaded {rows:,} products into {warehouse.table_id('products')}.")
+
+if __name__ == "__main__":
+    main()
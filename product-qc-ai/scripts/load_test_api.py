@@ -0,0 +1,101 @@
+"""
+Local load test for POST /validate: p50/p99 latency and throughput with
+micro-batching on and off.
+
+By default the app runs in-process (httpx ASGI transport, no server needed);
+pass --url to hit a running server instead (batching is then whatever that
+server was started with).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BRANDS = ["acme", "globex", "initech", "umbrella", "hooli"]
+CATEGORIES = ["electronics>laptops", "electronics>monitors", "home>kitchen", "apparel>shirts"]
+COLOURS = ["black", "white", "red", "blue", "silver"]
+
+def make_products(n, repeat=0.0, seed=0):
+    """Synthetic editor payloads; `repeat` is the share re-sending an earlier product unchanged."""
+    rng = random.Random(seed)
+    products = []
+    for i in range(n):
+        if products and rng.random() < repeat:
+            products.append(rng.choice(products))
+            continue
+        brand, colour = rng.choice(BRANDS), rng.choice(COLOURS)
+        size, spec_colour = rng.choice([13, 14, 15, 27]), colour if rng.random() < 0.8 else rng.choice(COLOURS)
+        products.append({
+            "product_id": f"p{i}",
+            "title": f"{brand} {size} inch {colour} model {rng.randint(1, 999)}",
+            "brand": brand,
+            "category": rng.choice(CATEGORIES),
+            "description": f"{colour} {size} inch device from {brand}",
+            "specs": {"screen_size": f"{size} inch", "colour": spec_colour},
+        })
+    return products
+
+async def run_load(client, products, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(product):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/validate", json=product)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in products))
+    elapsed = time.perf_counter() - start
+    stats = (await client.get("/validate/stats")).json()
+    p50, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 99])
+    return {"requests": len(products), "seconds": elapsed, "rps": len(products) / elapsed, "p50_ms": p50, "p99_ms": p99, **stats}
+
+async def run_in_process(config_path, products, concurrency, batching):
+    from api.server import create_app
+
+    app = create_app(config_path, batching=batching)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await run_load(client, products, concurrency)
+
+async def run_remote(url, products, concurrency):
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        return await run_load(client, products, concurrency)
+
+def print_result(label, r):
+    print(
+        f"{label:<13} {r['requests']:>7,} req in {r['seconds']:.2f}s = {r['rps']:>8,.0f} req/s; "
+        f"p50 {r['p50_ms']:.1f} ms, p99 {r['p99_ms']:.1f} ms; {r['batches']:,} batches "
+        f"(mean {r['mean_batch_size']:.1f}), LRU hits {r['lru_hits']:,}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test POST /validate.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--url", default=None, help="Running server to test instead of the in-process app")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--repeat", type=float, default=0.0, help="Share of requests re-sending an unchanged product")
+    args = parser.parse_args()
+    products = make_products(args.requests, args.repeat)
+    if args.url:
+        print_result("server", asyncio.run(run_remote(args.url, products, args.concurrency)))
+        return
+    for batching in (True, False):
+        result = asyncio.run(run_in_process(args.config, products, args.concurrency, batching))
+        print_result("batching on" if batching else "batching off", result)
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,54 @@
-# Product CSV → BigQuery ingestion and normalization script
+# Product CSV → warehouse (BigQuery or local Parquet) ingestion and normalization script
 import os
+import sys
+import time
+import argparse
+from datetime import datetime, timezone
+
 import pandas as pd
-from google.cloud import bigquery
-import re
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.config import load_config
+from pipeline.ingestion import chunk_to_arrow, normalize_chunk, iter_arrow_chunks, DEFAULT_CHUNKSIZE
+from pipeline.metrics import open_tracer
+from pipeline.warehouse import open_warehouse
 
 # --- CONFIG ---
-PROJECT_ID = "proj-product-qc-gmumabigq"  # <-- Replace with your GCP project ID
-DATASET_ID = "product_qc"
-TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.products"
 CSV_PATH = r"C:\Users\ADMIN\Desktop\quality control\Product-Quality-control-agent\product-qc-ai\data\processed\quality_control.csv"
 
 # --- LOAD CSV ---
 def load_and_normalize(csv_path):
-	df = pd.read_csv(csv_path)
-	# Normalize text fields
-	for col in ["title", "description", "brand", "category"]:
-		if col in df.columns:
-			df[col] = df[col].astype(str).str.strip().str.lower()
-			df[col] = df[col].apply(lambda x: re.sub(r'<.*?>', '', x))  # Remove HTML tags
-	# Flatten common fields, put variable specs into 'specs' JSON
-	common_fields = ["product_id", "sku", "brand", "category", "title", "description", "price", "rating", "review_count"]
-	variable_fields = [col for col in df.columns if col not in common_fields]
-	df["specs"] = df[variable_fields].to_dict(orient="records")
-	# Fill missing columns
-	for col in common_fields:
-		if col not in df.columns:
-			df[col] = None
-	# Add empty reviews and image_refs
-	df["reviews"] = [[] for _ in range(len(df))]
-	df["image_refs"] = [[] for _ in range(len(df))]
-	# Add ingest_ts
-	from datetime import datetime, timezone
-	now_ts = datetime.now(timezone.utc).isoformat()
-	df["ingest_ts"] = now_ts
-	# Select and order columns
-	out_cols = ["product_id", "sku", "brand", "category", "title", "description", "specs", "price", "rating", "review_count", "reviews", "image_refs", "ingest_ts"]
-	return df[out_cols]
+	# The same normalization as the streaming path, so both write the ARROW_SCHEMA products table.
+	df = pd.read_csv(csv_path, dtype={"product_id": "string", "sku": "string"})
+	return chunk_to_arrow(normalize_chunk(df), datetime.now(timezone.utc))
+
+# --- LOAD TO WAREHOUSE ---
+def load_to_warehouse(table, warehouse):
+	rows = warehouse.write("products", table)
+	print(f"Loaded {rows} rows to {warehouse.table_id('products')}.")
 
-# --- LOAD TO BIGQUERY ---
-def load_to_bigquery(df, table_id):
-	client = bigquery.Client(project=PROJECT_ID)
-	job = client.load_table_from_dataframe(df, table_id, job_config=bigquery.LoadJobConfig(write_disposition="WRITE_TRUNCATE"))
-	job.result()
-	print(f"Loaded {len(df)} rows to {table_id}.")
+# --- STREAMING LOAD (bounded memory) ---
+def stream_to_warehouse(csv_path, warehouse, tracer, chunksize=DEFAULT_CHUNKSIZE):
+	# Normalized Arrow chunks go straight to the warehouse: Parquet load jobs, or Parquet writes locally.
+	start = time.perf_counter()
+	with tracer.span("ingestion") as span:
+		rows = warehouse.write("products", iter_arrow_chunks(csv_path, chunksize))
+		span.add(rows_out=rows, bytes_processed=os.path.getsize(csv_path))
+	print(f"Loaded {rows} rows to {warehouse.table_id('products')} ({time.perf_counter() - start:.1f}s).")
 
 if __name__ == "__main__":
-	df = load_and_normalize(CSV_PATH)
-	load_to_bigquery(df, TABLE_ID)
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--config", default="config.yaml")
+	parser.add_argument("--csv", default=None, help="Source CSV (default: ingestion.csv from the config)")
+	parser.add_argument("--stream", action="store_true", help="Read and load the CSV in bounded chunks")
+	parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+	parser.add_argument("--local", action="store_true", help="Load into the local warehouse whatever warehouse.backend says")
+	args = parser.parse_args()
+	cfg = load_config(args.config)
+	args.csv = args.csv or cfg.get("ingestion", {}).get("csv") or CSV_PATH
+	warehouse = open_warehouse(cfg, local=args.local)
+	if args.stream:
+		with open_tracer(cfg, local=args.local) as tracer:
+			stream_to_warehouse(args.csv, warehouse, tracer, args.chunksize)
+	else:
+		load_to_warehouse(load_and_normalize(args.csv), warehouse)
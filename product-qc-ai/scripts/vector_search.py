@@ -1,24 +1,41 @@
 """
 Run vector similarity search queries on the embeddings tables to find similar products or detect mismatches.
 """
+import argparse
 import os
-from google.cloud import bigquery
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.config import load_config
+from pipeline.queries import QueryRunner
 
 PROJECT_ID = os.environ.get("BQ_PROJECT_ID", "your-gcp-project")
 DATASET = os.environ.get("BQ_DATASET", "product_qc")
-
-client = bigquery.Client(project=PROJECT_ID)
-
-def run_query(query, description):
-    print(f"Running: {description}")
-    job = client.query(query)
-    results = job.result()
-    print(f"Done: {description}\n")
-    return results
+# Set to a directory built by `make index` to serve lookups from the local IVF index.
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR")
+QUERY_CACHE_DIR = os.environ.get("BQ_QUERY_CACHE_DIR", "data/processed/cache/queries")
 
 def main():
-    # Example: Find top-5 similar products by text embedding (cosine similarity)
+    parser = argparse.ArgumentParser(description="Find the products most similar to one product.")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--local", action="store_true", help="Look up the local text index under vector_index.dir instead of BigQuery")
+    args = parser.parse_args()
+    cfg = load_config(args.config)
+    k = int(cfg["app"]["topk_similar"])
+    # Example: Find the top-k similar products by text embedding (cosine similarity)
     product_id = os.environ.get("QUERY_PRODUCT_ID", "example_id")
+    index_dir = VECTOR_INDEX_DIR
+    if args.local and not index_dir:
+        index_dir = os.path.join(cfg.get("vector_index", {}).get("dir", "data/processed/vector_index"), "text")
+    if index_dir:
+        from pipeline.vector_index import IVFIndex
+
+        neighbours = IVFIndex.load(index_dir).search_ids([product_id], k=k)[0]
+        if not neighbours:
+            print(f"Product '{product_id}' is not in the index at '{index_dir}'; set QUERY_PRODUCT_ID to an indexed product.")
+        for similar_id, score in neighbours:
+            print(product_id, similar_id, score)
+        return
     query = f"""
     SELECT
       t1.product_id,
@@ -29,10 +46,12 @@ def main():
       ON t1.product_id != t2.product_id
     WHERE t1.product_id = '{product_id}'
     ORDER BY cosine_similarity DESC
-    LIMIT 5;
+    LIMIT {k};
     """
-    results = run_query(query, f"Vector search for product {product_id}")
-    for row in results:
+    # Repeated lookups are served from the query cache until text_embeddings changes.
+    runner = QueryRunner(PROJECT_ID, cache_dir=QUERY_CACHE_DIR)
+    results = runner.read(query, f"Vector search for product {product_id}")
+    for row in results.to_pylist():
         print(row)
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
 import os
-import glob
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from google.cloud import bigquery
 from google.api_core.exceptions import NotFound
@@ -9,39 +11,110 @@ PROJECT_ID = "my_project_id"  # <-- Replace with your GCP project ID
 DATASET_ID = "product_qc"
 PRODUCTS_TABLE = f"{PROJECT_ID}.{DATASET_ID}.products"
 IMAGES_TABLE = f"{PROJECT_ID}.{DATASET_ID}.product_images"
+STAGING_TABLE = f"{PROJECT_ID}.{DATASET_ID}._staging_image_refs"
 IMAGES_ROOT = os.path.join("data", "images")
+MANIFEST_PATH = os.path.join("data", "processed", "image_manifest.json")
+SCAN_WORKERS = 16
+HASH_CHUNK = 1024 * 1024
 
 # --- 1. Organize local product images ---
-def collect_image_paths(images_root):
-    image_records = []
-    product_to_images = {}
-    now_ts = datetime.now(timezone.utc).isoformat()
+def _scan_product_dir(product_id, product_dir):
+    entries = []
+    with os.scandir(product_dir) as it:
+        for entry in it:
+            if entry.is_file():
+                st = entry.stat()
+                entries.append({
+                    "product_id": product_id,
+                    "local_path": os.path.relpath(entry.path),
+                    "size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns,
+                })
+    return entries
+
+def scan_images(images_root, workers=SCAN_WORKERS):
+    """Stat every image under images_root/<product_id>/, one thread per product directory."""
     if not os.path.exists(images_root):
         print(f"Image root directory '{images_root}' does not exist.")
-        return image_records, product_to_images
-    for product_id in os.listdir(images_root):
-        product_dir = os.path.join(images_root, product_id)
-        if not os.path.isdir(product_dir):
-            continue
-        image_files = glob.glob(os.path.join(product_dir, "*"))
-        if not image_files:
-            continue
-        product_to_images[product_id] = []
-        for img_path in image_files:
-            rel_path = os.path.relpath(img_path)
-            image_records.append({
-                "product_id": product_id,
-                "local_path": rel_path,
-                "ingest_ts": now_ts
-            })
-            product_to_images[product_id].append({"local_path": rel_path})
-    return image_records, product_to_images
+        return []
+    with os.scandir(images_root) as it:
+        product_dirs = [(e.name, e.path) for e in it if e.is_dir()]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda d: _scan_product_dir(*d), product_dirs)
+        return [entry for entries in results for entry in entries]
+
+def _hash_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(path, manifest):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+def update_manifest(entries, manifest, workers=SCAN_WORKERS):
+    """Hash only files whose size or mtime changed since the last run.
+
+    Returns (new manifest keyed by local_path, changed entries, removed entries).
+    """
+    new_manifest, changed = {}, []
+    for entry in entries:
+        old = manifest.get(entry["local_path"])
+        if old and old["size"] == entry["size"] and old["mtime_ns"] == entry["mtime_ns"]:
+            new_manifest[entry["local_path"]] = old
+        else:
+            changed.append(entry)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for entry, digest in zip(changed, pool.map(lambda e: _hash_file(e["local_path"]), changed)):
+            entry["content_hash"] = digest
+            new_manifest[entry["local_path"]] = entry
+    removed = [old for path, old in manifest.items() if path not in new_manifest]
+    return new_manifest, changed, removed
+
+def find_duplicate_images(manifest):
+    """Groups of byte-identical images (same content hash), largest first."""
+    by_hash = {}
+    for entry in manifest.values():
+        by_hash.setdefault(entry["content_hash"], []).append(entry["local_path"])
+    return sorted((paths for paths in by_hash.values() if len(paths) > 1), key=len, reverse=True)
+
+def collect_image_paths(images_root, manifest_path=MANIFEST_PATH):
+    """Incremental scan: image records for new/changed files and the image list of every touched product."""
+    now_ts = datetime.now(timezone.utc).isoformat()
+    manifest, changed, removed = update_manifest(scan_images(images_root), load_manifest(manifest_path))
+    image_records = [{
+        "product_id": e["product_id"],
+        "local_path": e["local_path"],
+        "content_hash": e["content_hash"],
+        "size_bytes": e["size"],
+        "ingest_ts": now_ts,
+    } for e in changed]
+    touched = {e["product_id"] for e in changed} | {e["product_id"] for e in removed}
+    product_to_images = {product_id: [] for product_id in touched}
+    for entry in manifest.values():
+        if entry["product_id"] in touched:
+            product_to_images[entry["product_id"]].append({"local_path": entry["local_path"]})
+    return image_records, product_to_images, manifest
 
 # --- 2. Create BigQuery table for image references ---
 def create_images_table(client, table_id):
     schema = [
         bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
         bigquery.SchemaField("local_path", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("content_hash", "STRING"),
+        bigquery.SchemaField("size_bytes", "INT64"),
         bigquery.SchemaField("ingest_ts", "TIMESTAMP", mode="REQUIRED"),
     ]
     table = bigquery.Table(table_id, schema=schema)
@@ -52,47 +125,70 @@ def create_images_table(client, table_id):
         client.create_table(table)
         print(f"Created table '{table_id}'.")
 
+def load_image_records(client, table_id, image_records):
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition="WRITE_APPEND",
+        schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+    )
+    client.load_table_from_json(image_records, table_id, job_config=job_config).result()
+
 # --- 3. Update products table with image_refs ---
-def update_products_image_refs(client, products_table, product_to_images):
-    # Fetch all product_ids
-    query = f"SELECT product_id FROM `{products_table}`"
-    products = [row.product_id for row in client.query(query).result()]
-    rows_to_update = []
-    for product_id in products:
-        image_refs = product_to_images.get(product_id, [])
-        if not image_refs:
-            continue
-        rows_to_update.append({
-            "product_id": product_id,
-            "image_refs": image_refs
-        })
-    if not rows_to_update:
+def update_products_image_refs(client, products_table, product_to_images, staging_table=STAGING_TABLE):
+    """Stage (product_id, local_path) pairs with one load job and apply them with one MERGE.
+
+    Products listed with no images get their image_refs cleared.
+    """
+    staged = []
+    for product_id, images in product_to_images.items():
+        staged.extend({"product_id": product_id, "local_path": img["local_path"]} for img in images)
+        if not images:
+            staged.append({"product_id": product_id, "local_path": None})
+    if not staged:
         print("No products to update with image_refs.")
         return
-    # Patch rows in BigQuery
-    errors = client.insert_rows_json(products_table, rows_to_update, row_ids=[row["product_id"] for row in rows_to_update])
-    if not errors:
-        print(f"Updated image_refs for {len(rows_to_update)} products in '{products_table}'.")
-    else:
-        print(f"Errors updating image_refs: {errors}")
+    job_config = bigquery.LoadJobConfig(
+        schema=[bigquery.SchemaField("product_id", "STRING"), bigquery.SchemaField("local_path", "STRING")],
+        write_disposition="WRITE_TRUNCATE",
+    )
+    client.load_table_from_json(staged, staging_table, job_config=job_config).result()
+    merge_sql = f"""
+    MERGE `{products_table}` p
+    USING (
+      SELECT product_id,
+        ARRAY_AGG(IF(local_path IS NULL, NULL, STRUCT(CAST(NULL AS STRING) AS gcs_uri, local_path AS object_ref))
+          IGNORE NULLS ORDER BY local_path) AS image_refs
+      FROM `{staging_table}`
+      GROUP BY product_id
+    ) s
+    ON p.product_id = s.product_id
+    WHEN MATCHED THEN UPDATE SET image_refs = IFNULL(s.image_refs, [])
+    """
+    job = client.query(merge_sql)
+    job.result()
+    client.delete_table(staging_table, not_found_ok=True)
+    print(f"Updated image_refs for {job.num_dml_affected_rows} products in '{products_table}'.")
 
 # --- MAIN ---
 def main():
     client = bigquery.Client(project=PROJECT_ID)
-    # 1. Collect image file paths
-    image_records, product_to_images = collect_image_paths(IMAGES_ROOT)
-    if not image_records:
-        print("No images found. Exiting.")
+    # 1. Scan image files (only new or changed files are hashed)
+    image_records, product_to_images, manifest = collect_image_paths(IMAGES_ROOT)
+    duplicates = find_duplicate_images(manifest)
+    print(f"Scanned {len(manifest)} images: {len(image_records)} new or changed, {len(duplicates)} groups of byte-identical duplicates.")
+    if not product_to_images:
+        print("No image changes. Exiting.")
+        save_manifest(MANIFEST_PATH, manifest)
         return
     # 2. Create and populate product_images table
     create_images_table(client, IMAGES_TABLE)
-    errors = client.insert_rows_json(IMAGES_TABLE, image_records)
-    if not errors:
-        print(f"Inserted {len(image_records)} image records into '{IMAGES_TABLE}'.")
-    else:
-        print(f"Errors inserting image records: {errors}")
+    if image_records:
+        load_image_records(client, IMAGES_TABLE, image_records)
+        print(f"Loaded {len(image_records)} image records into '{IMAGES_TABLE}'.")
     # 3. Update products table with image_refs
     update_products_image_refs(client, PRODUCTS_TABLE, product_to_images)
+    # Only remember the scan once BigQuery has it, so a failed run is retried next time.
+    save_manifest(MANIFEST_PATH, manifest)
 
 if __name__ == "__main__":
     main()
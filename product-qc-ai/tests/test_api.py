@@ -0,0 +1,73 @@
+# Unit tests for the validation API
+import asyncio
+
+import httpx
+import yaml
+
+from api.server import create_app
+
+def _config(tmp_path, spec_store=None):
+    with open("config.yaml", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    cfg["validation"]["cache_path"] = str(tmp_path / "validation.sqlite")
+    cfg["vector_index"]["dir"] = str(tmp_path / "no_index")
+    cfg["preprocessing"]["output"] = spec_store or str(tmp_path / "no_specs")
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump(cfg))
+    return str(path)
+
+def test_concurrent_requests_are_micro_batched_and_repeats_hit_the_lru(tmp_path):
+    app = create_app(_config(tmp_path))
+    products = [
+        {"product_id": f"p{i}", "title": f"acme 15 inch black laptop {i}", "brand": "acme",
+         "category": "electronics>laptops", "specs": {"screen_size": "15 inch", "colour": "red" if i % 2 else "black"}}
+        for i in range(20)
+    ]
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                first = await asyncio.gather(*(client.post("/validate", json=p) for p in products))
+                again = await client.post("/validate", json=products[0])
+                stats = (await client.get("/validate/stats")).json()
+                copy = await client.post("/validate", json={**products[0], "product_id": "copy"})
+                return [r.json() for r in first], again.json(), copy.json(), stats
+
+    first, again, copy, stats = asyncio.run(run())
+    assert [r["product_id"] for r in first] == [p["product_id"] for p in products]
+    assert first[0]["reasons"] is None and first[0]["severity"] in ("none", "medium", "high")
+    assert first[1]["tier"] == "rules" and first[1]["is_consistent"] is False and "colour mismatch" in first[1]["reasons"]
+    assert stats["products"] == 20 and stats["batches"] < 20
+    assert again["cached"] and again["is_consistent"] == first[0]["is_consistent"]
+    # Same content under another id is validated afresh, so its `similar` list is its own.
+    assert not copy["cached"] and copy["product_id"] == "copy" and copy["is_consistent"] == first[0]["is_consistent"]
+
+def test_consistent_product_passes_and_contradiction_is_flagged(tmp_path):
+    import pyarrow as pa
+
+    from pipeline.preprocessing import build_spec_store
+
+    catalog = pa.table({
+        "product_id": ["a", "b", "c"],
+        "category": ["vacuums"] * 3,
+        "specs": ['{"colour": "red", "wattage": "1400 w"}', '{"colour": "blue", "wattage": "900 w"}', '{"colour": "grey", "wattage": "1400 w"}'],
+    })
+    build_spec_store(catalog.to_batches(), str(tmp_path / "specs"))
+    app = create_app(_config(tmp_path, str(tmp_path / "specs")))
+    product = {
+        "product_id": "new", "title": "acme 1400 w red vacuum", "brand": "acme", "category": "vacuums",
+        "description": "the acme vacuum comes in red and draws 1400 w.", "specs": {"colour": "red", "wattage": "1400 w"},
+    }
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                ok = await client.post("/validate", json=product)
+                bad = await client.post("/validate", json={**product, "product_id": "bad", "title": "acme 1400 w vacuum", "description": "a blue vacuum."})
+                return ok.json(), bad.json()
+
+    ok, bad = asyncio.run(run())
+    assert ok["is_consistent"] is True and ok["mismatch_score"] == 0.0 and ok["severity"] == "none"
+    assert bad["mismatch_score"] == 0.5 and bad["severity"] == "medium"
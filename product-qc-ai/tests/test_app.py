@@ -1 +1,43 @@
 # Unit tests for app
+from datetime import datetime, timedelta, timezone
+
+import pyarrow.parquet as pq
+
+from app.data import CachedSource, ParquetSource
+from app.mock_data import ensure_mock_data, mock_metrics
+
+class CountingSource(ParquetSource):
+    def __init__(self, paths):
+        super().__init__(paths)
+        self.queries = 0
+
+    def page(self, *args, **kwargs):
+        self.queries += 1
+        return super().page(*args, **kwargs)
+
+def test_pages_filters_and_aggregates_are_pushed_down(tmp_path):
+    paths = ensure_mock_data(str(tmp_path), n_rows=5000)
+    source = ParquetSource(paths)
+    full = pq.read_table(paths["mismatches"]).to_pandas()
+    high = full[full["severity"] == "high"]
+    filters = [("severity", "==", "high")]
+    assert source.count("mismatches", filters) == len(high)
+    for sort in (("mismatch_score", True), ("product_id", False)):
+        expected = high.sort_values(sort[0], ascending=not sort[1])[sort[0]].iloc[20:30].tolist()
+        page = source.page("mismatches", filters=filters, sort=sort, offset=20, limit=10)
+        assert page[sort[0]].tolist() == expected
+    agg = source.aggregate("mismatches", "category", filters)
+    assert agg["rows"].sum() == len(high) and set(agg.columns) == {"category", "rows", "mean_mismatch_score"}
+    assert len(source.page("corrections", filters=[("status", "==", "pending")], limit=7)) == 7
+
+def test_cache_is_invalidated_by_a_new_metrics_run(tmp_path):
+    paths = ensure_mock_data(str(tmp_path), n_rows=1000)
+    source = CountingSource(paths)
+    cached = CachedSource(source, ttl=0)
+    cached.page("mismatches", limit=5)
+    cached.page("mismatches", limit=5)
+    assert source.queries == 1
+    later = datetime.now(timezone.utc) + timedelta(minutes=1)
+    pq.write_table(mock_metrics("run-2", later, 1000), paths["metrics"])
+    cached.page("mismatches", limit=5)
+    assert source.queries == 2
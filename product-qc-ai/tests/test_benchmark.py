@@ -0,0 +1,19 @@
+# Unit tests for the benchmark suite
+from scripts.benchmark import below_floor, compare_to_baseline, run_suite
+
+def test_regression_gate_respects_metric_direction_and_tolerance():
+    baseline = {"embedding@10000": {"rows_per_s": 1000.0, "p99_ms": 10.0, "peak_rss_mb": 100.0, "recall_at_k": 0.9}}
+    ok = {"embedding@10000": {"rows_per_s": 900.0, "p99_ms": 12.0, "peak_rss_mb": 110.0, "recall_at_k": 0.89, "new_metric": 1.0}}
+    assert compare_to_baseline(ok, baseline, {}) == []
+    slow = {"embedding@10000": {"rows_per_s": 500.0, "p99_ms": 14.0, "peak_rss_mb": 100.0, "recall_at_k": 0.5}}
+    failures = compare_to_baseline(slow, baseline, {"latency": 0.5})
+    assert [f.split()[1] for f in failures] == ["rows_per_s", "recall_at_k"]
+    assert compare_to_baseline({"search@1": {"p50_ms": 1.0}}, baseline, {}) == []
+    assert below_floor({"duplicates@1": {"precision": 0.5, "recall": 0.1}, "search@1": {"p50_ms": 1.0}}, {"precision": 0.9}) == ["duplicates@1 precision 0.50 < floor 0.90"]
+
+def test_suite_runs_every_stage_offline(tmp_path):
+    results = run_suite([2000], work_dir=str(tmp_path))
+    assert sorted(results) == ["consistency@2000", "duplicates@2000", "embedding@2000", "ingestion@2000", "search@2000"]
+    for metrics in results.values():
+        assert metrics["rows_per_s"] > 0 and metrics["p99_ms"] >= metrics["p50_ms"] and metrics["peak_rss_mb"] > 0
+    assert results["duplicates@2000"]["precision"] >= 0.9
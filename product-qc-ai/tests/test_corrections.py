@@ -0,0 +1,92 @@
+# Unit tests for cluster-level corrections
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from pipeline.cache import KVCache
+from pipeline.corrections import CORRECTION_SCHEMA, LocalFixer, cluster_rows, correct_rows, merge_corrections
+from pipeline.warehouse import LocalWarehouse
+
+def test_cluster_rows_splits_signatures_and_dissimilar_rows():
+    vectors = np.array([[1, 0], [0.99, 0.1], [0, 1], [1, 0], [0, 0]], dtype=np.float32)
+    labels, leaders, sims = cluster_rows(np.array(["a", "a", "a", "b", "b"]), vectors, cluster_cos=0.9, block_rows=2)
+    assert labels[0] == labels[1] and len(set(labels.tolist())) == 4
+    assert leaders[labels[2]] == 2 and sims[1] > 0.9
+
+def test_correct_rows_makes_one_call_per_cluster_and_reuses_caches(tmp_path):
+    n = 50
+    df = pd.DataFrame({
+        "product_id": [f"P{i}" for i in range(n)],
+        "title": [f"acme phone {64 * (1 + i % 2)} gb black" for i in range(n)],
+        "brand": "acme",
+        "category": "phones",
+        "specs": ['{"storage": "512 GB", "colour": "black"}'] * n,
+        "reasons": "capacity mismatch;",
+    })
+    vectors = np.tile(np.array([[1, 0]], dtype=np.float32), (n, 1))
+    templates, fixes = KVCache(str(tmp_path / "t.sqlite")), KVCache(str(tmp_path / "f.sqlite"))
+    fixer = LocalFixer()
+    corrections, stats = correct_rows(df, vectors, fixer, templates, fixes)
+    assert fixer.calls == 1 and stats["clusters"] == 1 and stats["corrected_rows"] == n
+    assert corrections["field"].unique().tolist() == ["specs.capacity"]
+    assert corrections.set_index("product_id").loc["P1", ["original_value", "corrected_value", "status"]].tolist() == ["512 gb", "128 gb", "applied"]
+
+    warehouse = LocalWarehouse(str(tmp_path / "wh"))
+    diff = merge_corrections(warehouse, pa.Table.from_pandas(corrections, schema=CORRECTION_SCHEMA, preserve_index=False))
+    assert set(diff["change"].to_pylist()) == {"insert"}
+
+    again, stats = correct_rows(df, vectors, fixer, templates, fixes)
+    assert fixer.calls == 1 and stats["fix_cache_hits"] == n and len(again) == n
+    diff = merge_corrections(warehouse, pa.Table.from_pandas(again, schema=CORRECTION_SCHEMA, preserve_index=False))
+    assert set(diff["change"].to_pylist()) == {"unchanged"} and warehouse.count("corrections") == n
+
+def test_unparseable_replies_are_retried_and_duplicate_fields_merge_once(tmp_path):
+    df = pd.DataFrame({
+        "product_id": ["P0"], "title": ["acme phone 128 gb"], "brand": "acme", "category": "phones",
+        "specs": ['{"storage": "512 GB"}'], "reasons": "capacity mismatch;",
+    })
+    vectors = np.array([[1, 0]], dtype=np.float32)
+    templates, fixes = KVCache(str(tmp_path / "t.sqlite")), KVCache(str(tmp_path / "f.sqlite"))
+    failing = LocalFixer()
+    failing.propose = lambda requests: [None for _ in requests]
+    correct_rows(df, vectors, failing, templates, fixes)
+    fixer = LocalFixer()
+    corrections, stats = correct_rows(df, vectors, fixer, templates, fixes)
+    assert fixer.calls == 1 and stats["corrected_rows"] == 1
+
+    twice = pd.concat([corrections, corrections.assign(confidence=0.1)], ignore_index=True)
+    warehouse = LocalWarehouse(str(tmp_path / "wh"))
+    merge_corrections(warehouse, pa.Table.from_pandas(twice, schema=CORRECTION_SCHEMA, preserve_index=False))
+    merged = warehouse.read("corrections")
+    assert merged.num_rows == 1 and merged["confidence"][0].as_py() > 0.5
+
+def test_unexplained_defects_share_a_cached_no_fix_per_embedding_bucket(tmp_path):
+    rng = np.random.default_rng(0)
+    base = rng.standard_normal(64).astype(np.float32)
+    # Near-identical listings, each its own cluster at cluster_cos=0.999999, plus one unrelated listing.
+    vectors = np.vstack([base + 0.01 * rng.standard_normal((6, 64)), -base[None, :]]).astype(np.float32)
+    df = pd.DataFrame({
+        "product_id": [f"P{i}" for i in range(7)],
+        "title": [f"acme lamp model {i}" for i in range(7)],
+        "brand": "acme", "category": "lighting", "specs": "{}", "reasons": None,
+    })
+    templates, fixes = KVCache(str(tmp_path / "t.sqlite")), KVCache(str(tmp_path / "f.sqlite"))
+    fixer = LocalFixer()
+    corrections, stats = correct_rows(df, vectors, fixer, templates, fixes, cluster_cos=0.999999)
+    assert stats["clusters"] == 7 and fixer.calls == 2 and corrections.empty
+    # "No fix" is an answer: the rerun, with other listings leading the clusters, makes no calls.
+    _, stats = correct_rows(df.iloc[::-1].reset_index(drop=True), vectors[::-1], fixer, templates, fixes, cluster_cos=0.999999)
+    assert fixer.calls == 2 and stats["template_cache_hits"] == 7
+
+def test_failed_template_calls_are_retried_on_the_next_run():
+    from pipeline.corrections import SchedulerFixer
+    from pipeline.llm import LLMScheduler, TransientLLMError
+
+    async def endpoint(prompt):
+        if "60 w lamp" in prompt:
+            raise TransientLLMError("quota exceeded")
+        return '[{"field": "specs.colour", "value": "{title_colour}", "confidence": 0.9}]'
+
+    fixer = SchedulerFixer(LLMScheduler(endpoint, concurrency=2, rate=1000, base_delay=0.001, max_retries=1))
+    proposed = fixer.propose([(["colour"], {"title": "red lamp"}), (["wattage"], {"title": "60 w lamp"})])
+    assert proposed == [[{"field": "specs.colour", "value": "{title_colour}", "confidence": 0.9}], None]
@@ -1 +1,179 @@
 # Unit tests for embeddings
+import numpy as np
+
+from pipeline.embeddings import (
+    ColorHashExtractor, HashingEmbedder, VectorStore, embed_images, embed_texts, iter_image_files, open_cache,
+)
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self, dim=32):
+        super().__init__(dim)
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        return super().embed(texts)
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    a = HashingEmbedder(64).embed(["red cotton shirt", "blue denim jeans"])
+    b = HashingEmbedder(64).embed(["red cotton shirt", "blue denim jeans"])
+    assert a.dtype == np.float32 and a.shape == (2, 64)
+    np.testing.assert_array_equal(a, b)
+    np.testing.assert_allclose(np.linalg.norm(a, axis=1), 1.0, rtol=1e-5)
+    # Punctuation and case never split a token from its bare form.
+    np.testing.assert_array_equal(HashingEmbedder(64).embed(['"Red", cotton SHIRT.']), a[:1])
+
+def test_vector_store_roundtrip_is_memory_mapped(tmp_path):
+    store = VectorStore(str(tmp_path / "s"), dim=4)
+    store.append(["a", "b"], np.eye(2, 4))
+    reopened = VectorStore(str(tmp_path / "s"))
+    assert isinstance(reopened.vectors, np.memmap)
+    assert reopened.ids == ["a", "b"]
+    np.testing.assert_array_equal(reopened.get(["b"]), [[0, 1, 0, 0]])
+
+def test_embed_texts_only_embeds_unseen_normalized_strings(tmp_path):
+    embedder = CountingEmbedder()
+    cache = open_cache(str(tmp_path), embedder)
+    stats = {}
+    first = embed_texts(["Red Shirt", "red   shirt", "Blue Jeans"], embedder, cache, stats=stats)
+    assert stats == {"texts": 3, "unique": 2, "embedded": 2}
+    np.testing.assert_array_equal(first[0], first[1])
+
+    second = embed_texts(["RED SHIRT", "green hat"], embedder, open_cache(str(tmp_path), embedder))
+    assert embedder.calls == [["red shirt", "blue jeans"], ["green hat"]]
+    np.testing.assert_array_equal(second[0], first[0])
+
+    stats, seen = {}, set()
+    for batch in (["red shirt", "blue jeans"], ["Red Shirt", "green hat"]):
+        embed_texts(batch, embedder, cache, stats=stats, seen=seen)
+    assert stats["texts"] == 4 and stats["unique"] == 3
+
+def test_incremental_refresh_reports_skipped_and_reembedded_rows():
+    from types import SimpleNamespace
+
+    from pipeline.embeddings import refresh_embedding_table
+
+    class FakeClient:
+        def __init__(self):
+            self.sql = []
+
+        def query(self, sql):
+            self.sql.append(sql)
+            if "COUNTIF" in sql:
+                rows = [SimpleNamespace(candidates=100, changed=3)]
+            else:
+                rows = []
+            affected = {"MERGE": 3, "UPDATE": 1}.get(sql.split(None, 1)[0])
+            return SimpleNamespace(result=lambda: iter(rows), num_dml_affected_rows=affected)
+
+    client = FakeClient()
+    stats = refresh_embedding_table(client, "text_embeddings", "p", "d", "m")
+    assert stats == {"candidates": 100, "skipped": 97, "reembedded": 3, "tombstoned": 1}
+    assert not any("CREATE OR REPLACE" in sql for sql in client.sql)
+    merge = next(sql for sql in client.sql if sql.split(None, 1)[0] == "MERGE")
+    assert "QUALIFY ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY ingest_ts DESC) = 1" in merge
+
+def test_ivf_index_matches_brute_force_on_clustered_vectors(tmp_path):
+    from pipeline.vector_index import IVFIndex, recall_at_k
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 16))
+    vectors = (centers[rng.integers(0, 20, 2000)] + 0.3 * rng.normal(size=(2000, 16))).astype(np.float32)
+    ids = [f"P{i}" for i in range(len(vectors))]
+    IVFIndex.build(str(tmp_path / "idx"), ids, vectors, nlist=20)
+    index = IVFIndex.load(str(tmp_path / "idx"))
+    assert isinstance(index.store.vectors, np.memmap)
+    assert recall_at_k(index, ids, vectors, k=5, nprobe=4, n_queries=50) > 0.9
+    neighbours = index.search_ids(["P0", "P1"], k=3)
+    assert [len(n) for n in neighbours] == [3, 3]
+    assert all(pid != "P0" for pid, _ in neighbours[0])
+    assert index.search_ids(["example_id", "P0"], k=3)[0] == []
+
+def test_duplicate_detection_groups_pairs_within_blocks(tmp_path):
+    from pipeline.duplicates import duplicate_groups, find_duplicate_pairs
+
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(300, 16)).astype(np.float32)
+    vectors[200] = vectors[3] + 0.01
+    vectors[201] = vectors[3] + 0.02
+    vectors[250] = vectors[10]
+    store = VectorStore(str(tmp_path / "text"), dim=16)
+    store.append([f"P{i}" for i in range(300)], vectors)
+
+    a, b, scores = find_duplicate_pairs(store.path, 0.95, tile_rows=64, workers=1)
+    groups = duplicate_groups(store.ids, a, b, scores)
+    assert sorted(groups.groupby("group_id")["product_id"].apply(sorted).tolist()) == [["P10", "P250"], ["P200", "P201", "P3"]]
+
+    keys = np.array(["phones"] * 300)
+    keys[200] = "cases"
+    a, b, _ = find_duplicate_pairs(store.path, 0.95, block_keys=keys, tile_rows=64, workers=1)
+    assert sorted(map(sorted, zip(a.tolist(), b.tolist()))) == [[3, 201], [10, 250]]
+
+    # Many small blocks are packed into shared tiles without pairing across blocks.
+    from pipeline.duplicates import _tasks, block_order
+
+    keys = np.arange(300) % 150
+    keys[250] = 10
+    assert len(list(_tasks(block_order(keys)[1], 64, 0.95))) == 5
+    a, b, _ = find_duplicate_pairs(store.path, 0.95, block_keys=keys, tile_rows=64, workers=1)
+    assert sorted(map(sorted, zip(a.tolist(), b.tolist()))) == [[10, 250]]
+
+def _write_ppm(path, pixels):
+    with open(path, "wb") as f:
+        f.write(b"P6\n%d %d\n255\n" % (pixels.shape[1], pixels.shape[0]) + pixels.tobytes())
+
+def test_embed_images_pools_per_product_and_caches_by_content(tmp_path):
+    rng = np.random.default_rng(0)
+    root = tmp_path / "images"
+    for pid, n in (("p1", 2), ("p2", 1), ("p3", 3)):
+        (root / pid).mkdir(parents=True)
+        for i in range(n):
+            _write_ppm(root / pid / f"{i}.ppm", rng.integers(0, 256, (20, 30, 3), dtype=np.uint8))
+    store_dir = str(tmp_path / "emb")
+    extractor = ColorHashExtractor()
+    first = embed_images(iter_image_files(str(root)), store_dir, extractor, image_size=16, batch_size=2, queue_size=2, workers=1)
+    store = VectorStore(f"{store_dir}/image")
+    assert store.ids == ["p1", "p2", "p3"] and store.dim == extractor.dim
+    np.testing.assert_allclose(np.linalg.norm(store.vectors, axis=1), 1.0, rtol=1e-5)
+    assert first["images"] == 6 and first["thumb_hits"] == 0 and first["feature_hits"] == 0
+    second = embed_images(iter_image_files(str(root)), store_dir, extractor, image_size=16, batch_size=2, queue_size=2, workers=1)
+    assert second["thumb_hits"] == 6 and second["feature_hits"] == 6
+    np.testing.assert_array_equal(VectorStore(f"{store_dir}/image").vectors, store.vectors)
+    assert list(iter_image_files(str(tmp_path / "missing"))) == []
+
+def test_review_pooling_embeds_unique_reviews_once_and_reuses_unchanged_products(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from pipeline.embeddings import embed_products
+
+    def write(rows):
+        pq.write_table(pa.table({
+            "product_id": [r[0] for r in rows], "description": ["d"] * len(rows), "specs": [None] * len(rows),
+            "reviews": [r[1] for r in rows],
+        }), str(tmp_path / "products.parquet"))
+
+    boiler = "Great product, fast shipping!"
+    write([("p1", [boiler, "too small"]), ("p2", [boiler.upper()]), ("p3", [])])
+    embedder = CountingEmbedder()
+    store_dir = str(tmp_path / "emb")
+    stats = embed_products(str(tmp_path / "products.parquet"), store_dir, embedder, review_variants=("trimmed",))
+    assert stats["review"]["reviews"] == 3 and stats["review"]["embedded"] == 2
+    pooled = VectorStore(f"{store_dir}/review")
+    assert pooled.ids == ["p1", "p2"] and VectorStore(f"{store_dir}/review_trimmed").ids == ["p1", "p2"]
+    np.testing.assert_allclose(np.linalg.norm(pooled.vectors, axis=1), 1.0, rtol=1e-5)
+    np.testing.assert_allclose(pooled.get(["p2"])[0], embedder.embed([boiler.lower()])[0], rtol=1e-5)
+
+    write([("p1", ["too small", boiler]), ("p2", [boiler, "broke"]), ("p3", [])])
+    stats = embed_products(str(tmp_path / "products.parquet"), store_dir, embedder, review_variants=("trimmed",))
+    assert stats["review"]["reused"] == 1 and stats["review"]["embedded"] == 1
+    np.testing.assert_array_equal(VectorStore(f"{store_dir}/review").get(["p1"]), pooled.get(["p1"]))
+
+def test_pool_reviews_trimmed_drops_outliers():
+    from pipeline.embeddings import pool_reviews
+
+    vectors = np.array([[1, 0], [1, 0.1], [-1, 0.2], [0, 1]], dtype=np.float32)
+    pooled = pool_reviews(vectors, [3, 1], ("mean", "trimmed", "weighted"), outlier_cos=0.3)
+    np.testing.assert_allclose(pooled["trimmed"][0], [0.9987523, 0.0499376], rtol=1e-5)
+    np.testing.assert_allclose(pooled["mean"][1], [0, 1])
+    assert pooled["weighted"][0][0] > pooled["mean"][0][0]
@@ -0,0 +1,62 @@
+# Unit tests for the partitioned flagged-record export
+import gzip
+import os
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from pipeline.warehouse import LocalWarehouse
+from scripts.export_results import PartitionedWriter, export, local_batches
+
+def _warehouse(tmp_path, corrected_ts):
+    warehouse = LocalWarehouse(str(tmp_path / "wh"))
+    n = 1000
+    scored = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    warehouse.write("validations", pa.table({
+        "product_id": [f"P{i}" for i in range(n)],
+        "is_consistent": [i % 4 == 0 for i in range(n)],
+        "tier": ["rules"] * n,
+        "reasons": ["capacity mismatch;"] * n,
+        # P3 was flagged after the last export; P5 carries no timestamp at all.
+        "validated_ts": pa.array([None if i == 5 else scored.replace(day=3) if i == 3 else scored for i in range(n)], pa.timestamp("us", tz="UTC")),
+    }))
+    scored_ids = [i for i in range(n) if i != 5]
+    warehouse.write("mismatches", pa.table({
+        "product_id": [f"P{i}" for i in scored_ids],
+        "mismatch_score": pa.array([0.9 if i % 2 else 0.5 for i in scored_ids], pa.float32()),
+        "severity": ["high" if i % 2 else "medium" for i in scored_ids],
+        "scored_ts": pa.array([scored] * len(scored_ids), pa.timestamp("us", tz="UTC")),
+    }))
+    warehouse.write("corrections", pa.table({
+        "product_id": ["P1", "P1", "P2"],
+        "field": ["capacity", "title", "capacity"],
+        "original_value": ["64 GB", "acme 64 gb", "64 GB"],
+        "corrected_value": ["512 GB", "acme 512 gb", "512 GB"],
+        "confidence": [0.9, 0.9, 0.5],
+        "status": ["applied", "applied", "review"],
+        "corrected_ts": pa.array([corrected_ts, corrected_ts, scored], pa.timestamp("us", tz="UTC")),
+    }))
+    products = pa.table({"product_id": [f"P{i}" for i in range(n)], "category": ["phones", "tv/audio"] * (n // 2), "brand": ["acme"] * n})
+    return warehouse, products
+
+def test_export_partitions_rolls_files_and_resumes_from_watermark(tmp_path):
+    warehouse, products = _warehouse(tmp_path, datetime(2026, 1, 2, tzinfo=timezone.utc))
+    out = tmp_path / "out"
+    writer = PartitionedWriter(str(out), target_bytes=1, row_group_rows=100, max_buffered_rows=150)
+    stats = export(local_batches(warehouse, products, batch_rows=128), writer)
+    assert stats["rows"] == 750 + 1 and stats["files"] > 4  # P1 has two corrected fields
+    assert sorted(os.listdir(out)) == ["category=phones", "category=tv_audio"]
+    table = ds.dataset(str(out), format="parquet", partitioning="hive").to_table()
+    assert table.num_rows == 751 and set(table["severity"].to_pylist()) == {"high", "medium", "unscored"}
+    assert stats["changed_ts"] == datetime(2026, 1, 3, tzinfo=timezone.utc)
+    since = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+    csv_writer = PartitionedWriter(str(tmp_path / "csv"), fmt="csv")
+    stats = export(local_batches(warehouse, products, since=since), csv_writer, since)
+    assert stats["rows"] == 4 and stats["files"] == 2
+    lines = []
+    for path in csv_writer.files:
+        with gzip.open(path, "rt") as f:
+            lines += f.read().splitlines()
+    ids = sorted(line.split(",")[0] for line in lines if not line.startswith('"product_id"'))
+    assert ids == ['"P1"', '"P1"', '"P3"', '"P5"'] and "acme 512 gb" in "".join(lines)
@@ -0,0 +1,41 @@
+# Unit tests for batched QC trend forecasting
+from datetime import date
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from pipeline.forecasting import daily_counts, forecast_table, holt_winters, update_daily
+
+def test_holt_winters_tracks_trend_and_weekly_season_for_all_series():
+    t = np.arange(56)
+    season = np.array([0.0, 0.02, 0.04, 0.02, 0.0, -0.04, -0.04])
+    Y = np.stack([0.2 + 0.001 * t + season[t % 7], np.full(56, 0.5), 0.1 + season[t % 7]])
+    Y[1, 10:20] = np.nan
+    forecast, rmse, _ = holt_winters(Y, horizon=7, period=7)
+    future = np.arange(56, 63)
+    expected = np.stack([0.2 + 0.001 * future + season[future % 7], np.full(7, 0.5), 0.1 + season[future % 7]])
+    assert forecast.shape == (3, 7)
+    assert np.abs(forecast - expected).max() < 0.01 and rmse.max() < 0.02
+
+def test_daily_counts_roll_into_forecasts_per_series():
+    products = pa.table({"product_id": ["a", "b", "c", "d"], "category": ["phones"] * 3 + ["tv"], "brand": ["acme"] * 4})
+    verdicts = pa.table({
+        "product_id": ["a", "b", "c", "d"],
+        "is_consistent": [False, False, True, False],
+        "tier": ["rules", "embedding", "rules", "llm"],
+        "reasons": ["capacity mismatch;colour mismatch;", None, "", None],
+    })
+    corrections = pa.table({"product_id": ["a", "d"], "status": ["applied", "review"]})
+    daily = None
+    for day in (date(2026, 1, 1), date(2026, 1, 2), date(2026, 1, 2)):
+        daily = update_daily(daily, daily_counts(products, verdicts, corrections, day), day, history_days=30)
+    assert daily.num_rows == 8  # re-running a day replaces it
+    counts = {(r["defect_type"], r["day"]): (r["products"], r["flagged"], r["corrected"]) for r in daily.to_pylist()}
+    assert counts[("capacity", date(2026, 1, 2))] == (3, 1, 1)
+    assert counts[("embedding", date(2026, 1, 1))] == (3, 1, 0)
+    forecasts = forecast_table(daily, horizon=3)
+    assert forecasts.num_rows == 4 * 2 * 3
+    flag = forecasts.filter(pc.equal(forecasts["metric"], "flag_rate")).to_pylist()
+    assert {r["day"] for r in flag} == {date(2026, 1, 3), date(2026, 1, 4), date(2026, 1, 5)}
+    assert all(abs(r["forecast"] - (1 / 3 if r["category"] == "phones" else 1.0)) < 1e-6 for r in flag)
@@ -0,0 +1,27 @@
+# Unit tests for pipeline metrics and tracing
+import pytest
+
+from pipeline.metrics import Tracer, latest_run_rows, prometheus_text
+from pipeline.warehouse import LocalWarehouse
+
+def test_tracer_batches_span_metrics_into_metrics_runs(tmp_path):
+    warehouse = LocalWarehouse(str(tmp_path), "qc", {"metrics": "metrics_runs"})
+    tracer = Tracer(warehouse, run_id="r1", flush_rows=10)
+    with tracer.span("validate", judge="local") as span:
+        span.add(rows_in=100, rows_out=100, llm_calls=3, cache_hits=30, cache_misses=10)
+    assert not warehouse.exists("metrics")  # 9 rows still buffered
+    with pytest.raises(RuntimeError):
+        with tracer.span("correct"):
+            raise RuntimeError("boom")
+    assert warehouse.exists("metrics")  # the 10-row threshold was crossed
+    tracer.close()
+
+    rows = latest_run_rows(warehouse)
+    assert len(list((tmp_path / "qc" / "metrics_runs").glob("part-*.parquet"))) == 1
+    values = {(r["stage"], r["metric"]): r["value"] for r in rows}
+    assert values[("validate", "cache_hit_rate")] == 0.75 and values[("validate", "llm_calls")] == 3
+    assert values[("validate", "rows_per_s")] > 0 and values[("correct", "failed")] == 1.0
+
+    text = prometheus_text(rows)
+    assert "# TYPE qc_cache_hit_rate gauge" in text
+    assert 'qc_llm_calls{run_id="r1",stage="validate",judge="local"} 3.0' in text
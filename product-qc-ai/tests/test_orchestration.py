@@ -0,0 +1,67 @@
+# Unit tests for the pipeline orchestrator
+import threading
+
+from pipeline.orchestration import Stage, load_state, run_pipeline, toposort
+
+def _graph(tmp_path, calls, fail=()):
+    src = tmp_path / "input.txt"
+    if not src.exists():
+        src.write_text("v1")
+    started = threading.Barrier(2, timeout=5)
+
+    def step(name, parallel=False):
+        def run():
+            if parallel:
+                started.wait()  # both branches must be in flight at once
+            if name in fail:
+                raise RuntimeError("boom")
+            calls.append(name)
+            (tmp_path / f"{name}.out").write_text(name)
+        run.__qualname__ = name
+        return run
+
+    return [
+        Stage("a", step("a"), inputs=[str(src)], outputs=[str(tmp_path / "a.out")], config_keys=["a"]),
+        Stage("b", step("b", parallel=True), deps=["a"], outputs=[str(tmp_path / "b.out")]),
+        Stage("c", step("c", parallel=True), deps=["a"], outputs=[str(tmp_path / "c.out")]),
+        Stage("d", step("d"), deps=["b", "c"]),
+    ]
+
+def test_toposort_orders_dependencies_first():
+    order = toposort([Stage("d", None, deps=["b"]), Stage("b", None, deps=["a"]), Stage("a", None)])
+    assert order == ["a", "b", "d"]
+
+def test_pipeline_runs_branches_concurrently_skips_unchanged_and_resumes(tmp_path):
+    state_path = str(tmp_path / "state.json")
+    cfg = {"a": 1}
+    calls = []
+    results = run_pipeline(_graph(tmp_path, calls, fail=("d",)), cfg, state_path, max_parallel=2)
+    assert results["d"]["status"] == "failed" and sorted(calls) == ["a", "b", "c"]
+    assert load_state(state_path)["a"]["status"] == "ok"
+
+    # Resume: only the failed stage runs again.
+    calls.clear()
+    results = run_pipeline(_graph(tmp_path, calls), cfg, state_path, max_parallel=2)
+    assert calls == ["d"] and results["a"]["status"] == "skipped"
+
+    # A config change invalidates the stage and everything downstream of it.
+    calls.clear()
+    run_pipeline(_graph(tmp_path, calls), {"a": 2}, state_path, max_parallel=2)
+    assert sorted(calls) == ["a", "b", "c", "d"]
+
+def test_load_stage_tracks_the_source_csv(tmp_path):
+    from pipeline.orchestration import pipeline_stages, stage_fingerprint
+
+    csv = tmp_path / "products.csv"
+    csv.write_text("product_id\nP1\n")
+    cfg = {"ingestion": {"csv": str(csv)}, "warehouse": {"root": str(tmp_path / "wh")}}
+    stages = {s.name: s for s in pipeline_stages(cfg, local=True)}
+    load = stages["load"]
+    assert load.inputs == [str(csv)] and load.outputs == [str(tmp_path / "wh" / "product_qc" / "products")]
+    assert stages["embed_text"].deps == ["load"] and stages["embed_text"].inputs == load.outputs
+    # An offline run keeps every stage process off BigQuery, whatever warehouse.backend says.
+    assert all(s.run[-1] == "--local" for s in stages.values())
+    before = stage_fingerprint(load, cfg, {})
+    csv.write_text("product_id\nP1\nP2\n")
+    assert stage_fingerprint(load, cfg, {}) != before
+    assert "load" not in {s.name for s in pipeline_stages({"ingestion": {"csv": str(tmp_path / "missing.csv")}})}
@@ -0,0 +1,31 @@
+# Unit tests for the spec attribute store
+import pyarrow as pa
+
+from pipeline.preprocessing import SpecStore, build_spec_store
+
+def test_spec_store_canonicalizes_keys_units_and_indexes_by_category_attribute(tmp_path):
+    batches = [
+        pa.record_batch({
+            "product_id": ["p1", "p2", "p3"],
+            "category": ["phones", "phones", None],
+            "specs": ['{"Color": "Red", "Storage": "1 TB"}', '{"colour": " blue", "capacity": "256 GB", "dims": {"Width": "10 cm"}}', None],
+        }),
+        # Mixed value types for one key go through the json.loads fallback.
+        pa.record_batch({"product_id": ["p4", "p5"], "category": ["phones", "phones"], "specs": ['{"capacity": 512}', '{"capacity": "1,024 mb"}']}),
+    ]
+    stats = build_spec_store(batches, str(tmp_path / "specs"))
+    assert stats == {"products": 5, "with_specs": 4, "attributes": 7}
+
+    store = SpecStore(str(tmp_path / "specs"))
+    assert sorted(store.index) == [("phones", "capacity"), ("phones", "colour"), ("phones", "dims_width")]
+    assert pa.types.is_dictionary(store.table.schema.field("value").type)
+    capacity = store.slice("phones", "capacity")
+    assert capacity.column("product_id").to_pylist() == ["p1", "p2", "p4", "p5"]
+    assert capacity.column("value_num").to_pylist() == [1024.0, 256.0, 512.0, 1.0]
+    assert capacity.column("unit").to_pylist() == ["gb", "gb", None, "gb"]
+    assert store.slice("phones", "colour").column("value").to_pylist() == ["red", "blue"]
+    assert store.lookup("phones", "capacity", ["p5", "p3", "p1"]).to_pylist() == [1.0, None, 1024.0]
+
+    stats = {(r["category"], r["attribute"]): r for r in store.attribute_stats().to_pylist()}
+    assert stats["phones", "capacity"]["products"] == 4 and stats["phones", "capacity"]["max"] == 1024.0
+    assert stats["phones", "colour"]["distinct_values"] == 2 and stats["phones", "colour"]["numeric"] == 0
@@ -0,0 +1,57 @@
+# Unit tests for the shared query runner
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pyarrow as pa
+
+from pipeline.queries import QueryRunner, normalize_sql
+
+class FakeJob:
+    def __init__(self, client, sql):
+        self.client, self.sql = client, sql
+        self.total_bytes_processed = 100
+
+    def result(self, page_size=None):
+        self.client.events.append(("wait", self.sql))
+        return self
+
+    def to_arrow(self):
+        return pa.table({"n": [len(self.client.events)]})
+
+class FakeClient:
+    def __init__(self):
+        self.events = []
+        self.modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def query(self, sql):
+        self.events.append(("submit", sql))
+        return FakeJob(self, sql)
+
+    def get_table(self, table_id):
+        return SimpleNamespace(modified=self.modified)
+
+def test_run_all_submits_every_job_before_waiting():
+    client = FakeClient()
+    runner = QueryRunner("p", client=client)
+    jobs = runner.run_all(["SELECT 1", ("SELECT 2", None), "SELECT 3"])
+    assert [kind for kind, _ in client.events] == ["submit"] * 3 + ["wait"] * 3
+    assert [job.sql for job in jobs] == ["SELECT 1", "SELECT 2", "SELECT 3"]
+    assert runner.stats["queries"] == 3 and runner.stats["bytes_processed"] == 300
+
+def test_read_cache_is_keyed_by_normalized_sql_and_table_snapshot(tmp_path):
+    assert normalize_sql("SELECT  a -- note\n FROM t WHERE b = 'x  y';") == "SELECT a FROM t WHERE b = 'x  y'"
+    client = FakeClient()
+    runner = QueryRunner("p", client=client, cache_dir=str(tmp_path))
+    sql = "SELECT COUNT(*) AS n FROM `p.d.mismatch_scores`"
+    first = runner.read(sql)
+    assert runner.read(sql.replace(" ", "\n  ")).equals(first) and runner.stats["cache_hits"] == 1
+    # A fresh runner finds the result on disk.
+    assert QueryRunner("p", client=client, cache_dir=str(tmp_path)).read(sql).equals(first)
+    assert runner.stats["queries"] == 1
+
+    # Rewriting the table, or a non-deterministic query, goes back to BigQuery.
+    client.modified = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    runner.read(sql)
+    runner.read("SELECT CURRENT_TIMESTAMP() AS n FROM `p.d.mismatch_scores`")
+    runner.read("SELECT CURRENT_TIMESTAMP() AS n FROM `p.d.mismatch_scores`")
+    assert runner.stats["queries"] == 4
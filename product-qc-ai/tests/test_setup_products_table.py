@@ -0,0 +1,31 @@
+# Unit tests for the sharded Amazon metadata parser
+import json
+
+from setup_products_table import MAX_BATCH_BYTES, encoded_size, iter_amazon_records, iter_batches, iter_shard_results
+
+def _strip_ts(records):
+    return [{k: v for k, v in r.items() if k != "ingest_ts"} for r in records]
+
+def test_sharded_parse_matches_serial_parse(tmp_path):
+    path = tmp_path / "meta.json"
+    lines = []
+    for i in range(200):
+        lines.append(json.dumps({"asin": f"A{i}", "title": f"item {i}", "categories": ["toys"], "price": str(i), "color": "red"}))
+        if i % 17 == 0:
+            lines.append("")
+            lines.append("   ")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    serial = list(iter_amazon_records(str(path)))
+    results = list(iter_shard_results(str(path), workers=2, shard_bytes=512))
+    assert len(results) > 4
+    sharded = [r for records, _ in results for r in records]
+    assert len(sharded) == 200 and _strip_ts(sharded) == _strip_ts(serial)
+    sizes = [size for _, batch_sizes in results for size in batch_sizes]
+    assert sizes == [encoded_size(r) for r in sharded]
+
+def test_batches_are_bounded_by_encoded_size():
+    records = [{"product_id": f"P{i:02d}", "description": "x" * 1000} for i in range(50)]
+    size = encoded_size(records[0])
+    batches = list(iter_batches([(records, [encoded_size(r) for r in records])], max_rows=500, max_bytes=5 * size))
+    assert [len(b) for b in batches] == [5] * 10
+    assert all(sum(encoded_size(r) for r in b) <= 5 * size <= MAX_BATCH_BYTES for b in batches)
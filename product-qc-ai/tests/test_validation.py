@@ -1 +1,249 @@
 # Unit tests for validation
+import numpy as np
+
+from pipeline.consistency import assign_severity, write_mismatch_scores
+from pipeline.embeddings import VectorStore
+
+def test_assign_severity_uses_config_thresholds():
+    scores = np.array([0.1, 0.35, 0.9, np.nan])
+    assert assign_severity(scores, 0.70, 0.85).tolist() == ["none", "medium", "high", "none"]
+
+def test_consistency_scores_stream_in_blocks(tmp_path):
+    import pyarrow.parquet as pq
+
+    text = VectorStore(str(tmp_path / "text"), dim=2, space="clip-2")
+    text.append(["a", "b", "c"], np.array([[1, 0], [1, 0], [0, 1]]))
+    image = VectorStore(str(tmp_path / "image"), dim=2, space="clip-2")
+    image.append(["c", "a"], np.array([[-1, 0], [1, 0]]))
+    # Same dim but another model's space: never compared with the others.
+    spec = VectorStore(str(tmp_path / "spec"), dim=2, space="hashing-2")
+    spec.append(["a", "b", "c"], np.array([[0, 1], [0, 1], [1, 0]]))
+    out = str(tmp_path / "mismatch_scores.parquet")
+    counts = write_mismatch_scores(str(tmp_path), out, 0.70, 0.85, block_rows=2)
+    table = pq.read_table(out).to_pydict()
+    assert table["product_id"] == ["a", "b", "c"]
+    assert table["severity"] == ["none", "none", "high"]
+    assert table["text_image_cos"][1] is None
+    assert all(v is None for v in table["spec_image_cos"] + table["spec_agreement"])
+    assert table["mismatch_score"][1] is None  # nothing comparable: unscored, not a maximal mismatch
+    assert counts == {"none": 2, "medium": 0, "high": 1, "unscored": 1}
+
+def test_spec_agreement_checks_parsed_values_against_the_text(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from pipeline.preprocessing import SpecStore, build_spec_store
+
+    products = pa.table({
+        "product_id": ["ok", "colour", "wattage", "silent"],
+        "category": ["vacuums"] * 4,
+        "title": ["acme 1400 w red vacuum", "acme 1400 w red vacuum", "acme 1400 w red vacuum", "acme vacuum"],
+        "description": ["the acme vacuum, in red, draws 1400 watts.", "a red vacuum.", "1400 watts.", "cleans carpets."],
+        "specs": ['{"colour": "red", "wattage": "1400 w"}', '{"colour": "blue", "wattage": "1400 w"}', '{"Color": "Red", "wattage": "1,400 W"}', '{"colour": "red"}'],
+    })
+    pq.write_table(products, str(tmp_path / "products.parquet"))
+    build_spec_store(products.to_batches(), str(tmp_path / "specs"))
+    out = str(tmp_path / "mismatch_scores.parquet")
+    counts = write_mismatch_scores(str(tmp_path / "emb"), out, 0.70, 0.85, catalog=str(tmp_path / "products.parquet"), spec_store=SpecStore(str(tmp_path / "specs")))
+    table = pq.read_table(out).to_pydict()
+    assert table["spec_agreement"] == [1.0, 0.5, 1.0, None]
+    assert table["severity"] == ["none", "medium", "none", "none"]
+    assert counts == {"none": 3, "medium": 1, "high": 0, "unscored": 1}
+
+def test_validation_cascade_only_sends_ambiguous_rows_to_llm(tmp_path):
+    import pandas as pd
+
+    from pipeline.cache import KVCache
+    from pipeline.validation import LocalJudge, validate_batch
+
+    df = pd.DataFrame({
+        "product_id": ["contradiction", "agree", "emb_bad", "emb_ok", "ambiguous", "ambiguous_dup"],
+        "title": ["acme phone 64gb", "acme phone 128gb black", "widget", "gadget", "zeta lamp", "Zeta  Lamp"],
+        "brand": ["acme", "acme", None, None, "zeta", "zeta"],
+        "category": ["phones", "phones", None, None, "lighting", "lighting"],
+        "specs": ['{"storage": "128GB"}', '{"storage": "128 GB", "color": "black"}', "{}", "{}", '{"bulb": "e27"}', '{"bulb": "e27"}'],
+    })
+    # A high score does not overrule agreeing rules.
+    mismatch = {"agree": 0.95, "emb_bad": 0.95, "emb_ok": 0.1, "ambiguous": 0.5, "ambiguous_dup": 0.5}
+    judge = LocalJudge()
+    cache = KVCache(str(tmp_path / "verdicts.sqlite"))
+    results, counts = validate_batch(df, mismatch, judge, cache, 0.70, 0.85, fail_threshold=0.9)
+    assert results["tier"].tolist() == ["rules", "rules", "embedding", "embedding", "llm", "cache"]
+    assert results["is_consistent"].tolist()[:4] == [False, True, False, True]
+    assert "capacity mismatch" in results["reasons"][0]
+    assert counts == {"rules": 2, "embedding": 2, "cache": 1, "llm": 1, "unresolved": 0}
+    assert judge.calls == 1
+
+    # A second run is served entirely from the verdict cache.
+    _, counts = validate_batch(df, mismatch, judge, KVCache(str(tmp_path / "verdicts.sqlite")), 0.70, 0.85, fail_threshold=0.9)
+    assert counts["llm"] == 0 and judge.calls == 1
+
+    # Without a calibrated threshold the embedding tier only routes high scores on to the LLM.
+    results, _ = validate_batch(df, mismatch, judge, cache, 0.70, 0.85)
+    assert results["tier"].tolist()[2] == "llm"
+
+def test_fail_threshold_is_calibrated_on_labels():
+    from pipeline.validation import calibrate_fail_threshold
+
+    scores = [0.0, 0.0, 0.2, 0.5, 0.5, 0.5, 1.0, None]
+    bad = [False, False, True, True, True, False, True, True]
+    assert calibrate_fail_threshold(scores, bad, min_precision=0.8) == 0.2
+    assert calibrate_fail_threshold(scores, bad, min_precision=0.85) == 1.0
+    assert calibrate_fail_threshold([0.3], [False]) is None
+
+def test_rule_checks_read_sizes_from_parsed_spec_values():
+    import pandas as pd
+
+    from pipeline.validation import rule_checks
+
+    df = pd.DataFrame({
+        "title": ["acme 15 inch laptop", "acme 2 in 1 laptop 13 inch", "acme tv 55\""],
+        "specs": ['{"model_year": "2020", "screen": "15 inch"}', '{"screen": "13 in"}', '{"size": "50\\""}'],
+    })
+    assert rule_checks(df)["reasons"].tolist() == ["", "", "screen size mismatch;"]
+
+def test_scheduler_judge_fills_concurrency_across_the_batch(tmp_path):
+    import pandas as pd
+
+    from pipeline.cache import KVCache
+    from pipeline.llm import FakeEndpoint, LLMScheduler
+    from pipeline.validation import SchedulerJudge, validate_batch
+
+    endpoint = FakeEndpoint(latency=0.01, jitter=0)
+    in_flight, peak = 0, 0
+
+    async def tracked(prompt):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            return await endpoint(prompt)
+        finally:
+            in_flight -= 1
+
+    judge = SchedulerJudge(LLMScheduler(tracked, concurrency=16, rate=10_000), pack_size=10)
+    n = 300
+    df = pd.DataFrame({"product_id": [f"P{i}" for i in range(n)], "title": [f"item {i}" for i in range(n)]})
+    _, counts = validate_batch(df, {f"P{i}": 0.5 for i in range(n)}, judge, KVCache(str(tmp_path / "v.sqlite")), 0.70, 0.85)
+    assert counts["llm"] == n and judge.calls == n // 10 and peak == 16
+
+def test_llm_scheduler_coalesces_retries_and_packs():
+    import asyncio
+
+    from pipeline.llm import FakeEndpoint, LLMScheduler, judge_items
+
+    endpoint = FakeEndpoint(latency=0.01, error_rate=0.3, seed=1, answer=lambda item: "ok" in item)
+    scheduler = LLMScheduler(endpoint, concurrency=4, rate=1000, base_delay=0.001, max_retries=20, seed=0)
+    items = ["a ok", "b", "c ok", "a ok", "d"] * 3
+    verdicts = asyncio.run(judge_items(scheduler, "Consistent?", items, pack_size=2))
+    assert verdicts == ["ok" in item for item in items]
+    # Four distinct items in two packs; every extra call is a retry of an injected failure.
+    assert scheduler.stats["requests"] == 2
+    assert scheduler.stats["calls"] == 2 + scheduler.stats["retries"]
+    report = scheduler.report()
+    assert report["p99_ms"] >= report["p50_ms"] > 0
+
+def test_failed_packs_leave_only_their_rows_unresolved(tmp_path):
+    import asyncio
+
+    import pandas as pd
+
+    from pipeline.cache import KVCache
+    from pipeline.llm import FakeEndpoint, LLMScheduler, TransientLLMError, judge_items
+    from pipeline.validation import SchedulerJudge, validate_batch
+
+    fake = FakeEndpoint(latency=0.001, jitter=0, answer=lambda item: "ok" in item)
+
+    async def endpoint(prompt):
+        if "bad" in prompt:
+            raise TransientLLMError("quota exceeded")
+        return await fake(prompt)
+
+    scheduler = LLMScheduler(endpoint, concurrency=4, rate=1000, base_delay=0.001, max_retries=1)
+    items = ["a ok", "b", "c bad", "d ok"]
+    assert asyncio.run(judge_items(scheduler, "Consistent?", items, pack_size=2)) == [True, False, None, None]
+    assert scheduler.stats["failures"] == 1
+
+    df = pd.DataFrame({"product_id": ["P0", "P1"], "title": ["lamp ok", "lamp bad"]})
+    cache = KVCache(str(tmp_path / "v.sqlite"))
+    results, counts = validate_batch(df, {}, SchedulerJudge(scheduler, pack_size=1), cache, 0.70, 0.85)
+    assert results["is_consistent"].tolist()[0] is True and pd.isna(results["is_consistent"][1])
+    assert counts["llm"] == 1 and counts["unresolved"] == 1 and len(cache) == 1
+
+    coalescing = LLMScheduler(FakeEndpoint(latency=0.01), concurrency=4, rate=1000)
+    asyncio.run(coalescing.map(["same prompt"] * 5))
+    assert coalescing.stats["calls"] == 1 and coalescing.stats["coalesced"] == 4
+
+def test_token_bucket_limits_rate():
+    import asyncio
+    import time
+
+    from pipeline.llm import TokenBucket
+
+    async def take(n):
+        bucket = TokenBucket(rate=100, burst=1)
+        for _ in range(n):
+            await bucket.acquire()
+
+    start = time.perf_counter()
+    asyncio.run(take(11))
+    assert time.perf_counter() - start >= 0.09
+
+def test_parquet_profile_matches_table_in_one_pass(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from pipeline.ingestion import IMAGE_REF_TYPE
+    from pipeline.profiling import check_criteria, profile_parquet
+
+    image_refs = pa.array([[{"gcs_uri": "gs://b/1.jpg", "object_ref": None}], [], None, []], type=pa.list_(IMAGE_REF_TYPE))
+    table = pa.table({
+        "product_id": ["p1", "p2", "p3", "p4"],
+        "title": ["abc", "de", None, "f"],
+        "description": ["desc", "", None, "x"],
+        "specs": ['{"a": 1}', None, "{}", "{}"],
+        "image_refs": image_refs,
+    })
+    path = str(tmp_path / "products.parquet")
+    pq.write_table(table, path)
+    profile = profile_parquet(path, batch_size=3, sample_size=2)
+    assert profile["row_count"] == 4
+    assert profile["desc_coverage"] == 0.5
+    assert profile["specs_coverage"] == 0.75
+    assert profile["image_coverage"] == 0.25
+    assert profile["columns"]["title"] == {"nulls": 1, "null_rate": 0.25, "avg_len": 2.0, "max_len": 3}
+    assert profile["columns"]["price"]["null_rate"] == 1.0
+    assert profile["top_images"] == [{"product_id": "p1", "n_images": 1}]
+    assert len(profile["sample"]) == 2
+    assert check_criteria(profile, {"min_row_count": 1, "min_image_coverage": 0.7}) == ["image coverage 0.25 < 0.7"]
+
+    # A local warehouse table is a directory of Parquet parts.
+    from pipeline.warehouse import LocalWarehouse
+
+    warehouse = LocalWarehouse(str(tmp_path / "wh"))
+    warehouse.write("products", (table.slice(0, 2), table.slice(2)))
+    warehouse.write("products", table.slice(0, 1), append=True)
+    assert profile_parquet(warehouse.table_id("products"), batch_size=3)["row_count"] == 5
+
+def test_synthetic_catalog_is_seeded_and_labels_detectable_defects(tmp_path):
+    import pyarrow.parquet as pq
+
+    from pipeline.ingestion import ARROW_SCHEMA
+    from pipeline.validation import rule_checks
+    from scripts.generate_synthetic import generate
+
+    rates = {"title_spec_contradiction": 0.1, "wrong_category": 0.05, "duplicate": 0.05, "image_mismatch": 0.05}
+    for run in ("a", "b"):
+        generate(str(tmp_path / run), 3000, chunk_rows=1000, seed=7, formats=("parquet", "csv"), defect_rates=rates, image_size=8)
+    products = pq.read_table(tmp_path / "a" / "products.parquet")
+    assert products.schema.equals(ARROW_SCHEMA) and products.num_rows == 3000
+    same_seed = pq.read_table(tmp_path / "b" / "products.parquet")
+    assert products.drop(["ingest_ts", "image_refs"]).equals(same_seed.drop(["ingest_ts", "image_refs"]))
+    labels = pq.read_table(tmp_path / "a" / "labels.parquet").to_pandas()
+    assert 200 < (labels["defect"] == "title_spec_contradiction").sum() < 400
+    dup = labels[labels["defect"] == "duplicate"].iloc[0]
+    df = products.to_pandas().set_index("product_id")
+    assert df.loc[dup["product_id"], "title"] == df.loc[dup["detail"], "title"]
+    assert df["description"].nunique() > 0.9 * len(df)  # wording varies between listings
+    flagged = rule_checks(products.select(["product_id", "title", "specs"]).to_pandas())["contradictions"] > 0
+    assert flagged[labels["defect"] == "title_spec_contradiction"].all()
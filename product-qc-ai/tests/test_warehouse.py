@@ -0,0 +1,63 @@
+# Unit tests for the warehouse backends
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.data import open_source
+from pipeline.warehouse import DEFAULT_PRODUCTS, open_warehouse, products_path
+
+def _cfg(tmp_path):
+    return {
+        "bq_dataset": "qc",
+        "bq_tables": {"products": "products_v2", "mismatches": "mismatch_scores"},
+        "warehouse": {"backend": "local", "root": str(tmp_path)},
+        "app": {"data_source": "warehouse"},
+    }
+
+def test_local_warehouse_streams_appends_and_replaces_tables(tmp_path):
+    warehouse = open_warehouse(_cfg(tmp_path))
+    assert warehouse.table_id("products") == str(tmp_path / "qc" / "products_v2")
+    chunks = (pa.table({"product_id": [f"p{i}", f"q{i}"], "price": [1.0, 2.0]}) for i in range(3))
+    assert warehouse.write("products", chunks) == 6
+    assert warehouse.write("products", pd.DataFrame({"product_id": ["r"], "price": [3.0]}), append=True) == 1
+    assert warehouse.count("products") == 7
+    assert sum(b.num_rows for b in warehouse.scan("products", columns=["product_id"], batch_size=2)) == 7
+
+    # A truncating write replaces the whole table.
+    warehouse.write("products", pa.table({"product_id": ["z"], "price": [9.0]}))
+    assert warehouse.read("products").column("product_id").to_pylist() == ["z"]
+
+def test_parquet_outputs_load_into_the_table_the_app_reads(tmp_path):
+    cfg = _cfg(tmp_path)
+    output = tmp_path / "scores.parquet"
+    pq.write_table(pa.table({"product_id": ["a", "b"], "mismatch_score": [0.9, 0.2], "severity": ["high", "none"]}), output)
+    warehouse = open_warehouse(cfg, local=True)
+    assert warehouse.load_parquet("mismatches", str(output)) == 2
+    assert warehouse.exists("mismatches") and not warehouse.exists("corrections")
+    source = open_source(cfg)
+    assert source.count("mismatches", [("severity", "==", "high")]) == 1
+
+def test_offline_stages_read_the_loaded_products_table(tmp_path):
+    cfg = {"warehouse": {"backend": "local", "root": str(tmp_path / "wh")}}
+    assert products_path(cfg) == DEFAULT_PRODUCTS
+    warehouse = open_warehouse(cfg)
+    warehouse.write("products", pa.table({"product_id": ["P1"]}))
+    assert products_path(cfg) == warehouse.table_id("products")
+    assert products_path({**cfg, "embeddings": {"input": "x.parquet"}}) == "x.parquet"
+    assert products_path({**cfg, "warehouse": {"backend": "bigquery"}}) == DEFAULT_PRODUCTS
+
+def test_default_csv_load_writes_the_products_schema_preprocessing_reads(tmp_path):
+    import pyarrow.dataset as ds
+
+    from pipeline.ingestion import ARROW_SCHEMA
+    from pipeline.preprocessing import SpecStore, build_spec_store
+    from scripts.load_to_bigquery import load_and_normalize, load_to_warehouse
+
+    csv = tmp_path / "products.csv"
+    csv.write_text("product_id,title,category,price,colour,wattage\nP1,Red <b>Vacuum</b>,vacuums,99.5,red,1400 W\nP2,Blue vacuum,vacuums,,blue,\n")
+    warehouse = open_warehouse({"warehouse": {"backend": "local", "root": str(tmp_path / "wh")}})
+    load_to_warehouse(load_and_normalize(str(csv)), warehouse)
+    products = ds.dataset(warehouse.table_id("products"), format="parquet")
+    assert products.schema.equals(ARROW_SCHEMA)
+    build_spec_store(products.to_batches(columns=["product_id", "category", "specs"]), str(tmp_path / "specs"))
+    assert SpecStore(str(tmp_path / "specs")).keys() == [("vacuums", "colour"), ("vacuums", "wattage")]